@@ -19,12 +19,13 @@ if getattr(sys, 'frozen', False):
     except Exception as e:
         print("Failed to set DLL directory:", e)
 
-from pyproj import datadir
-print("proj.db path:", datadir.get_data_dir())
+    from pyproj import datadir
+    print("proj.db path:", datadir.get_data_dir())
 
 import sys
 # import time
 import argparse
+import multiprocessing
 
 # from PySide6.QtWidgets import QApplication
 # from PySide6.QtGui import QIcon
@@ -32,7 +33,8 @@ import argparse
 # from PySide6.QtWidgets import QSplashScreen
 # from PySide6.QtQml import QQmlApplicationEngine
 
-from interface.interface import ProcessorInterface
+# The Qt interface and the processing modules are imported by run_gui/run_cli (the CLI never
+# loads PySide6, and Processor imports the heavy modules only for the task being run)
 
 
 USE_RESOURCES = False  # Set to True to use resources.qrc
@@ -45,6 +47,8 @@ if USE_RESOURCES:
 
 def run_gui():
 
+    from interface.interface import ProcessorInterface
+
     print("Not implemented yet")
 
     # app = QApplication(sys.argv)
@@ -87,7 +91,8 @@ def run_gui():
 def run_cli(args):
     print("working")
 
-    processorInterface = ProcessorInterface()
+    from interface.processor import Processor
+    from interface.progress import print_progress
 
     # parameters = {
     #     "task": "detection",
@@ -146,25 +151,64 @@ def run_cli(args):
 
     print(parameters)
 
-    processorInterface.process(parameters)
-
-    # Wait for the worker to finish to avoid QThread destruction error
-    if hasattr(processorInterface, 'worker') and processorInterface.worker is not None:
-        processorInterface.worker.wait()
+    # Run in the main thread, the Qt worker thread is only needed by the GUI. Progress events are
+    # printed as "PROGRESS {json}" lines for scripts wrapping the CLI
+    processor = Processor(parameters, progress_callback=print_progress)
+    processor.run()
 
 if __name__ == "__main__":
 
+    # Needed by the worker processes of the frozen exe (spawn start method)
+    multiprocessing.freeze_support()
+
     parser = argparse.ArgumentParser(description="Run the application in GUI or CLI mode.")
     parser.add_argument("--cli", action="store_true", help="Run in CLI mode.")
+    parser.add_argument("--serve-stdio", action="store_true", help="Stay alive running the JSON lines task requests read from stdin, keeping models loaded between tasks.")
     parser.add_argument("--task", type=str, help="Task performed for CLI processing (used only with --cli).")
     parser.add_argument("--input", type=str, help="Input for CLI processing (used only with --cli).")
     parser.add_argument("--output", type=str, help="Output for CLI processing (used only with --cli).")
     parser.add_argument("--align", action="store_true", help="Run in CLI mode.")
     parser.add_argument("--serpentine", action="store_true", help="Run in CLI mode.")
+    parser.add_argument("--batch-size", type=int, help="Number of tiles stacked in each model run (used only with --cli).")
+    parser.add_argument("--keep-tiles", action="store_true", help="Save intermediate tiles and per tile shapefiles for debugging (used only with --cli).")
+    parser.add_argument("--providers", type=str, help="Comma separated execution providers in order of preference, e.g. CPUExecutionProvider (used only with --cli).")
+    parser.add_argument("--intra-op-threads", type=int, help="Threads used inside each model operator (used only with --cli).")
+    parser.add_argument("--inter-op-threads", type=int, help="Threads used between model operators in parallel execution mode (used only with --cli).")
+    parser.add_argument("--execution-mode", type=str, choices=["sequential", "parallel"], help="Model execution mode (used only with --cli).")
+    parser.add_argument("--graph-optimization-level", type=str, choices=["disable", "basic", "extended", "all"], help="Model graph optimization level (used only with --cli).")
+    parser.add_argument("--max-detections", type=int, help="Maximum number of detections kept per tile (used only with --cli).")
+    parser.add_argument("--quantized", action="store_true", help="Use the INT8 quantized model (used only with --cli).")
+    parser.add_argument("--quantization-mode", type=str, choices=["dynamic", "static"], help="Quantization for the quantize_model task, static needs --input with calibration tiles (used only with --cli).")
+    parser.add_argument("--pipeline", action="store_true", help="Overlap tile reading, inference and writing in parallel stages (used only with --cli).")
+    parser.add_argument("--queue-depth", type=int, help="Tiles waiting between pipeline stages (used only with --cli).")
+    parser.add_argument("--reader-threads", type=int, help="Threads reading and preprocessing tiles in the pipeline (used only with --cli).")
+    parser.add_argument("--workers", type=int, help="Processes sharing the tiles of batch processing, each with its own model session (used only with --cli).")
+    parser.add_argument("--min-valid-fraction", type=float, help="Skip tiles with this fraction of valid (not nodata) pixels or less, default 0 skips only empty tiles, negative keeps all (used only with --cli).")
+    parser.add_argument("--prescreen", action="store_true", help="Skip tiles without vegetation in a low resolution overview of the raster (used only with --cli).")
+    parser.add_argument("--prescreen-threshold", type=float, help="Excess Green threshold of --prescreen, automatic (Otsu) by default (used only with --cli).")
+    parser.add_argument("--disable-io-binding", dest="io_binding", action="store_const", const=False, help="Run the model without preallocated input and output buffers (used only with --cli).")
+    parser.add_argument("--disable-dynamic-shapes", dest="dynamic_shapes", action="store_const", const=False, help="Letterbox every tile to a full square even if the model accepts dynamic input shapes (used only with --cli).")
+    parser.add_argument("--result-cache", action="store_true", help="Reuse the model outputs of tiles already processed with the same model, cached on disk, the thresholds can change between runs (used only with --cli).")
+    parser.add_argument("--result-cache-dir", type=str, help="Folder of --result-cache, default cache/results in the working directory (used only with --cli).")
+    parser.add_argument("--result-cache-max-mb", type=float, help="Size cap of --result-cache, least recently used tiles are removed above it (used only with --cli).")
+    parser.add_argument("--conf-threshold", type=float, help="Confidence threshold of the detections, also used by the rethreshold task (used only with --cli).")
+    parser.add_argument("--nms-threshold", type=float, help="IoU threshold of the non maximum suppression, also used by the rethreshold task (used only with --cli).")
+    parser.add_argument("--save-candidates", action="store_true", help="Save the raw candidates of a tiling detection next to the output, so the rethreshold task can apply other thresholds without running the model (used only with --cli).")
+    parser.add_argument("--candidates-file", type=str, help="File of --save-candidates, default <output>_candidates.npz (used only with --cli).")
+    parser.add_argument("--candidate-threshold", type=float, help="Confidence threshold of the candidates saved by --save-candidates (used only with --cli).")
+    parser.add_argument("--disable-checkpoint", dest="checkpoint", action="store_const", const=False, help="Do not record the tiles completed in <output>_manifest.json, an interrupted run then starts again from the first tile (used only with --cli).")
+    parser.add_argument("--profile", action="store_true", help="Time the stages of the task (tiling, read, preprocess, inference, decode, nms, georeference, merge, numbering, write) and print them as a JSON report (used only with --cli).")
+    parser.add_argument("--profile-output", type=str, help="Also save the --profile report in this JSON file (used only with --cli).")
+    parser.add_argument("--profile-stage", type=str, help="Run this stage of --profile under cProfile, e.g. numbering (used only with --cli).")
+    parser.add_argument("--profile-stats", type=str, help="cProfile stats file of --profile-stage, readable with pstats or snakeviz, default profile_<stage>.prof (used only with --cli).")
+    parser.add_argument("--disable-cpu-mem-arena", dest="enable_cpu_mem_arena", action="store_const", const=False, help="Release model memory between runs instead of keeping an arena (used only with --cli).")
 
     args = parser.parse_args()
 
-    if args.cli:
+    if args.serve_stdio:
+        from interface.stdioserver import serve_stdio
+        serve_stdio()
+    elif args.cli:
         if not args.task:
             args.task = "tiling_detection"
         if not args.input:
@@ -1,27 +1,142 @@
 import os
-import onnxruntime as ort
-import cv2 as cv
 import numpy as np
 import pandas as pd
 import geopandas as gpd
+import shapely
 import shapely.geometry
 from shapely.geometry import Polygon
+from pyproj import CRS as ProjCRS, Transformer
 
-import rasterio as rio
-from rasterio.crs import CRS
 import datetime
 
-from rasterio.mask import mask
-from rasterio.enums import Resampling
-
+from interface.lazyimport import LazyModule
 from interface.batchprocessor import BatchProcessor
+from interface.sessioncache import SESSION_CACHE
+from interface.pipeline import Pipeline, DEFAULT_QUEUE_DEPTH, DEFAULT_READER_THREADS
+from interface.resultcache import ResultCache, DEFAULT_RESULT_CACHE_MAX_MB, model_hash
+from interface.candidatestore import CandidateStore, DEFAULT_CANDIDATE_THRESHOLD
+from interface.manifest import TileCheckpoint, params_hash, file_signature
+from interface.profiling import PROFILER
+from interface.progress import ProgressReporter, TILE_INFERENCE_PHASES
 import glob
+import queue
+import threading
+import traceback
+import multiprocessing
+import time
+
+# Modules only needed by the detection tasks, imported on first use (plot numbering and
+# postprocessing never load them)
+ort = LazyModule("onnxruntime")
+cv = LazyModule("cv2")
+rio = LazyModule("rasterio")
+rio_mask = LazyModule("rasterio.mask")
 
 MODEL_PATH = "./models"
 #MODEL_PATH = r"\\CATALOGUE.CGIARAD.ORG\AcceleratedBreedingInitiative\1.Data\36. Dataset ROI\models"
 
 MODEL_FILENAME = "forages_rois_yolo_full_1024.onnx"
 
+# Variant of the model with a dynamic batch axis, used when batch_size > 1
+DYNAMIC_MODEL_FILENAME = "forages_rois_yolo_full_1024_dynamic.onnx"
+
+# INT8 quantized variant of the model, see quantization.py
+QUANTIZED_MODEL_FILENAME = "forages_rois_yolo_full_1024_int8.onnx"
+
+# Largest side of the model input
+IMGSZ = 1024
+
+# Largest stride of the model, the height and width of dynamic shape inputs must be multiples of it
+MODEL_STRIDE = 32
+
+# Input shapes of model files read by model_input_shape, (path, size, mtime) -> shape
+MODEL_INPUT_SHAPES = {}
+
+# Decode of the model outputs (ForagesROIsDetector.postprocess)
+CONF_THRESHOLD = 0.26
+NMS_THRESHOLD = 0.2
+
+# Execution providers tried in order, the ones missing in the onnxruntime build are skipped
+DEFAULT_PROVIDERS = ["CUDAExecutionProvider", "CPUExecutionProvider"]
+
+PROVIDER_OPTIONS = {
+    "CUDAExecutionProvider": {
+        "device_id": 0,
+        # Optional: additional options can be provided, e.g.
+        #"gpu_mem_limit":  * 1024 * 1024 * 1024,
+        #"gpu_mem_limit":  6 * 1024,
+        # "cudnn_conv_algo_search": "EXHAUSTIVE",
+        # "do_copy_in_default_stream": True,
+    }
+}
+
+EXECUTION_MODES = {
+    "sequential": "ORT_SEQUENTIAL",
+    "parallel": "ORT_PARALLEL",
+}
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": "ORT_DISABLE_ALL",
+    "basic": "ORT_ENABLE_BASIC",
+    "extended": "ORT_ENABLE_EXTENDED",
+    "all": "ORT_ENABLE_ALL",
+}
+
+def select_providers(providers=None):
+    """
+    Build the providers list for an InferenceSession from an ordered preference list
+    (list or comma separated string). Unavailable providers are dropped and the CPU
+    provider is always kept as last fallback.
+    """
+    if providers is None:
+        providers = DEFAULT_PROVIDERS
+    elif isinstance(providers, str):
+        providers = [p.strip() for p in providers.split(",") if p.strip()]
+
+    available = ort.get_available_providers()
+
+    selected = []
+    for provider in providers:
+        if provider not in available:
+            print(f"Execution provider {provider} not available, skipping")
+            continue
+        if provider in PROVIDER_OPTIONS:
+            selected.append((provider, PROVIDER_OPTIONS[provider]))
+        else:
+            selected.append(provider)
+
+    if "CPUExecutionProvider" not in providers:
+        selected.append("CPUExecutionProvider")
+
+    return selected
+
+def create_session_options(intra_op_threads=None, inter_op_threads=None, execution_mode=None
+                           , graph_optimization_level=None, enable_cpu_mem_arena=None):
+    """
+    Create onnxruntime SessionOptions, options left as None keep the onnxruntime defaults.
+
+    Parameters:
+        intra_op_threads (int): Threads used inside each operator (0 = one per physical core).
+        inter_op_threads (int): Threads used between operators, only for the parallel execution mode.
+        execution_mode (str): "sequential" or "parallel".
+        graph_optimization_level (str): "disable", "basic", "extended" or "all".
+        enable_cpu_mem_arena (bool): Use the CPU memory arena (faster, but keeps the peak memory allocated).
+    """
+    sess_options = ort.SessionOptions()
+
+    if intra_op_threads is not None:
+        sess_options.intra_op_num_threads = int(intra_op_threads)
+    if inter_op_threads is not None:
+        sess_options.inter_op_num_threads = int(inter_op_threads)
+    if execution_mode is not None:
+        sess_options.execution_mode = getattr(ort.ExecutionMode, EXECUTION_MODES[execution_mode])
+    if graph_optimization_level is not None:
+        sess_options.graph_optimization_level = getattr(ort.GraphOptimizationLevel, GRAPH_OPTIMIZATION_LEVELS[graph_optimization_level])
+    if enable_cpu_mem_arena is not None:
+        sess_options.enable_cpu_mem_arena = bool(enable_cpu_mem_arena)
+
+    return sess_options
+
 # Preprocess image
 def preprocess(np_img, imgsz=1024):
 
@@ -43,9 +158,365 @@ def preprocess(np_img, imgsz=1024):
     img_input = np.expand_dims(img_input, axis=0)  # Add batch dim
     return img_input, r, (h0, w0)
 
+def preprocess_batch(np_imgs, imgsz=1024):
+    """
+    Preprocess a list of images and stack them in a single (B, 3, imgsz, imgsz) blob.
+
+    Returns:
+        blob (np.ndarray): Stacked network input.
+        scales (list): Letterbox scale of each image.
+        shapes (list): Original (height, width) of each image.
+    """
+    blobs = []
+    scales = []
+    shapes = []
+    for np_img in np_imgs:
+        img_input, r, shape = preprocess(np_img, imgsz=imgsz)
+        blobs.append(img_input)
+        scales.append(r)
+        shapes.append(shape)
+
+    return np.concatenate(blobs, axis=0), scales, shapes
+
+class LetterboxPreprocessor():
+    """
+    Letterbox preprocessing into preallocated input buffers reused across calls.
+
+    Images are resized directly into a staging buffer, then normalized and transposed (HWC to CHW)
+    in place into their slot of the input buffer, so steady state preprocessing does not allocate
+    new arrays. Images are scaled to fit imgsz and placed at the top left corner of their input.
+
+    With stride=None (fixed shape model) every input is (3, imgsz, imgsz) and produces the same
+    values as preprocess(). With a stride (dynamic shape model) the input of each image is only
+    padded up to the next multiple of the stride, so partial and elongated tiles do not run the
+    model over a full square of padding.
+
+    The returned tensors are overwritten by the next calls. Different slots can be filled from
+    different threads (each thread has its own resize buffer), as done by the prefetch pipeline.
+    """
+
+    PAD_VALUE = 114
+
+    def __init__(self, imgsz=IMGSZ, batch_size=1, stride=None):
+
+        self.imgsz = imgsz
+        self.batch_size = batch_size
+        self.stride = stride
+
+        # Each slot holds a contiguous (3, height, width) input of up to (3, imgsz, imgsz)
+        self.slot_length = 3 * imgsz * imgsz
+        self.buffer = np.empty((batch_size, self.slot_length), dtype=np.float32)
+        self.local = threading.local() # resize buffer of each thread
+
+        # Input shape (h, w) and size (h, w) of the image region of each slot, the rest of the slot holds the padding
+        self.slot_sizes = [None]*batch_size
+
+        # Batch size -> buffer gathering slots of different shapes (see batch_tensor)
+        self.staging = {}
+
+        self.pad_value = np.float32(self.PAD_VALUE) / np.float32(255.0)
+
+    @property
+    def blob(self):
+        """
+        All the slots as a (batch_size, 3, imgsz, imgsz) tensor (slots of fixed shape inputs).
+        """
+        return self.buffer.reshape(self.batch_size, 3, self.imgsz, self.imgsz)
+
+    def letterbox(self, h0, w0):
+        """
+        Letterbox scale, resized image size (h, w) and input shape (h, w) of an image.
+        """
+
+        r = self.imgsz / max(h0, w0)
+        new_h, new_w = int(h0 * r), int(w0 * r)
+
+        if self.stride is None:
+            return r, (new_h, new_w), (self.imgsz, self.imgsz)
+
+        stride = self.stride
+        return r, (new_h, new_w), (-(-new_h // stride) * stride, -(-new_w // stride) * stride)
+
+    def slot_input(self, slot):
+        """
+        Input (3, h, w) held by a slot.
+        """
+        h, w = self.slot_sizes[slot][0]
+        return self.buffer[slot, :3*h*w].reshape(3, h, w)
+
+    @PROFILER.timed("preprocess")
+    def preprocess_into(self, np_img, slot, band_first=False):
+        """
+        Preprocess an RGB image (h, w, 3), or a band-first raster array (bands, h, w) as read by
+        rasterio, into a slot of the input buffer. Images that are not 8-bit are first converted
+        with to_uint8.
+
+        Returns:
+            r (float): Letterbox scale.
+            (h0, w0) (tuple): Original image size.
+        """
+
+        imgsz = self.imgsz
+
+        if band_first:
+            np_img = to_uint8(rgb_bands(np_img))
+            h0, w0 = np_img.shape[1:]
+        else:
+            np_img = to_uint8(np_img)
+            h0, w0 = np_img.shape[:2]
+        r, (new_h, new_w), (input_h, input_w) = self.letterbox(h0, w0)
+
+        if (new_h, new_w) == (h0, w0):
+            # Band-first arrays are copied as they are, without transposing
+            chw = np_img if band_first else np_img.transpose(2, 0, 1)
+        else:
+            hwc = np.ascontiguousarray(np_img.transpose(1, 2, 0)) if band_first else np_img
+            if not hasattr(self.local, "resized"):
+                self.local.resized = np.empty((imgsz, imgsz, 3), dtype=np.uint8)
+            resized = cv.resize(hwc, (new_w, new_h), dst=self.local.resized[:new_h, :new_w], interpolation=cv.INTER_LINEAR)
+            chw = resized.transpose(2, 0, 1)
+
+        target = self.buffer[slot, :3*input_h*input_w].reshape(3, input_h, input_w)
+
+        # Padding only changes when the input shape or the image region changes
+        sizes = ((input_h, input_w), (new_h, new_w))
+        if self.slot_sizes[slot] != sizes:
+            target[:, new_h:, :] = self.pad_value
+            target[:, :new_h, new_w:] = self.pad_value
+            self.slot_sizes[slot] = sizes
+
+        np.divide(chw, np.float32(255.0), out=target[:, :new_h, :new_w], dtype=np.float32, casting="unsafe")
+
+        return r, (h0, w0)
+
+    def batch_tensor(self, slots):
+        """
+        Contiguous (len(slots), 3, h, w) input tensor of the given slots.
+
+        Consecutive slots of fixed shape inputs and single slots are views of the input buffer.
+        Otherwise the slots are gathered in a staging buffer, padded to the largest height and width.
+        """
+
+        shapes = [self.slot_sizes[slot][0] for slot in slots]
+
+        if len(slots) == 1:
+            return self.slot_input(slots[0])[None]
+
+        if self.stride is None and list(slots) == list(range(slots[0], slots[0] + len(slots))):
+            return self.blob[slots[0]:slots[0] + len(slots)]
+
+        input_h = max(h for h, _ in shapes)
+        input_w = max(w for _, w in shapes)
+
+        staging = self.staging.get(len(slots))
+        if staging is None:
+            staging = np.empty(len(slots) * self.slot_length, dtype=np.float32)
+            self.staging[len(slots)] = staging
+        tensor = staging[:len(slots)*3*input_h*input_w].reshape(len(slots), 3, input_h, input_w)
+
+        for i, (slot, (h, w)) in enumerate(zip(slots, shapes)):
+            tensor[i, :, :h, :w] = self.slot_input(slot)
+            if h < input_h:
+                tensor[i, :, h:, :] = self.pad_value
+            if w < input_w:
+                tensor[i, :, :h, w:] = self.pad_value
+
+        return tensor
+
+    def preprocess_batch(self, np_imgs, band_first=False):
+        """
+        Preprocess up to batch_size RGB images (or band-first arrays, see preprocess_into).
+
+        Returns:
+            blob (np.ndarray): Input tensor (len(np_imgs), 3, h, w), (3, imgsz, imgsz) inputs for fixed shape models.
+            scales (list): Letterbox scale of each image.
+            shapes (list): Original (height, width) of each image.
+        """
+
+        if len(np_imgs) > self.batch_size:
+            raise ValueError(f"Batch of {len(np_imgs)} images larger than the preprocessor batch size {self.batch_size}")
+
+        scales = []
+        shapes = []
+        for slot, np_img in enumerate(np_imgs):
+            r, shape = self.preprocess_into(np_img, slot, band_first=band_first)
+            scales.append(r)
+            shapes.append(shape)
+
+        return self.batch_tensor(list(range(len(np_imgs)))), scales, shapes
+
+def split_batch_outputs(outputs, batch_len):
+    """
+    Split raw ONNX outputs of a batch (B, 5+C, N) in a list of per image outputs (1, 5+C, N),
+    as expected by postprocess_yolo_output.
+    """
+    return [[output[i:i+1] for output in outputs] for i in range(batch_len)]
+
+class IOBindingRunner():
+    """
+    Session runs through ORT IO binding with preallocated output buffers.
+
+    A binding is kept per input shape (i.e. per batch size) and output set. Its outputs are bound to
+    numpy buffers created by the first run and its input is bound again only when the input array
+    changes, so steady state runs do not allocate numpy arrays nor copy the input.
+
+    The returned outputs are the buffers of the output set and are overwritten by the next run with
+    the same input shape and set: callers keeping outputs while running the next batch (the prefetch
+    pipeline) use several output sets.
+    """
+
+    # Bindings kept, with dynamic shape inputs there is one per input shape
+    MAX_BINDINGS = 32
+
+    def __init__(self, ort_sess):
+
+        self.ort_sess = ort_sess
+        self.input_name = ort_sess.get_inputs()[0].name
+        self.output_names = [output.name for output in ort_sess.get_outputs()]
+
+        # (input shape, output set) -> [binding, bound input address, output buffers]
+        self.bindings = {}
+
+    @PROFILER.timed("inference")
+    def run(self, blob, output_set=0):
+        """
+        Run the session over a contiguous float32 input tensor.
+
+        Returns:
+            list: Output arrays, reused by the next runs with the same input shape and output_set.
+        """
+
+        key = (blob.shape, output_set)
+        entry = self.bindings.get(key)
+        if entry is None:
+            if len(self.bindings) >= self.MAX_BINDINGS:
+                # Dynamic shape inputs: drop the oldest shape instead of keeping buffers for every shape seen
+                del self.bindings[next(iter(self.bindings))]
+            binding = self.ort_sess.io_binding()
+            for name in self.output_names:
+                binding.bind_output(name, "cpu")
+            entry = [binding, None, None]
+            self.bindings[key] = entry
+
+        binding, input_address, buffers = entry
+
+        if input_address != blob.ctypes.data:
+            binding.bind_input(self.input_name, "cpu", 0, blob.dtype, blob.shape, blob.ctypes.data)
+            entry[1] = blob.ctypes.data
+
+        self.ort_sess.run_with_iobinding(binding)
+
+        if buffers is None:
+            # First run with this shape: the outputs allocated by ORT become the buffers of the next runs
+            buffers = binding.copy_outputs_to_cpu()
+            for name, buffer in zip(self.output_names, buffers):
+                binding.bind_output(name, "cpu", 0, buffer.dtype, buffer.shape, buffer.ctypes.data)
+            entry[2] = buffers
+
+        return buffers
+
+def model_input_shape(model_filepath):
+    """
+    Shape of the first input of an ONNX model, ints for the fixed axes, read with onnx without
+    creating a session. None if onnx is not installed.
+    """
+    try:
+        import onnx
+    except ImportError:
+        return None
+
+    stat = os.stat(model_filepath)
+    key = (os.path.abspath(model_filepath), stat.st_size, stat.st_mtime)
+    if key not in MODEL_INPUT_SHAPES:
+        graph = onnx.load(model_filepath, load_external_data=False).graph
+        initializers = {initializer.name for initializer in graph.initializer}
+        model_input = [value_info for value_info in graph.input if value_info.name not in initializers][0]
+        MODEL_INPUT_SHAPES[key] = [dim.dim_value if dim.HasField("dim_value") else dim.dim_param
+                                   for dim in model_input.type.tensor_type.shape.dim]
+
+    return MODEL_INPUT_SHAPES[key]
+
+def export_dynamic_batch_model(model_filepath, output_filepath=None):
+    """
+    Create a copy of an ONNX model with a dynamic batch axis on its inputs and outputs.
+
+    Only works if the graph does not hard-code the batch size internally (e.g. in Reshape nodes),
+    otherwise the model must be re-exported with a dynamic batch (ultralytics: dynamic=True).
+    """
+    import onnx
+
+    if output_filepath is None:
+        output_filepath = os.path.join(os.path.dirname(model_filepath), DYNAMIC_MODEL_FILENAME)
+
+    model = onnx.load(model_filepath)
+    for value_info in list(model.graph.input) + list(model.graph.output):
+        dim = value_info.type.tensor_type.shape.dim[0]
+        dim.ClearField("dim_value")
+        dim.dim_param = "batch"
+
+    onnx.save(model, output_filepath)
+
+    # Check that the graph really accepts batches larger than one
+    ort_sess = ort.InferenceSession(output_filepath, providers=["CPUExecutionProvider"])
+    model_input = ort_sess.get_inputs()[0]
+    _, c, h, w = [d if isinstance(d, int) else 1024 for d in model_input.shape]
+    try:
+        ort_sess.run(None, {model_input.name: np.zeros((2, c, h, w), dtype=np.float32)})
+    except Exception as e:
+        os.remove(output_filepath)
+        raise ValueError(f"Model {model_filepath} has a fixed batch size inside the graph, re-export it with a dynamic batch: {e}")
+
+    print("Dynamic batch model saved to", output_filepath)
+    return output_filepath
+
 def sigmoid(x):
     return 1 / (1 + np.exp(-x))
 
+def logit(p):
+    """
+    Inverse of sigmoid, -inf/inf outside (0, 1).
+    """
+    if p <= 0:
+        return -np.inf
+    if p >= 1:
+        return np.inf
+    return float(np.log(p / (1 - p)))
+
+# Maximum size in pixels of the low resolution mask used to find tiles without valid pixels
+VALID_MASK_SIZE = 1024
+
+# Maximum size in pixels of the overview used to pre-screen the field extent
+PRESCREEN_SIZE = 2048
+
+# Dilation in overview pixels of the vegetation mask of the pre-screening
+PRESCREEN_MARGIN = 2
+
+# Margin (in logits) of the candidate prefilter, so float32 rounding of sigmoid never drops a valid box
+LOGIT_PREFILTER_MARGIN = 1e-3
+
+def prefilter_candidates(output, conf_threshold):
+    """
+    Select the anchors that can reach conf_threshold, working on the raw logits.
+
+    As objectness and class scores are in [0, 1], sigmoid(obj) * sigmoid(cls) > conf_threshold
+    implies obj > logit(conf_threshold) and cls > logit(conf_threshold), so the anchors failing
+    either test are background and never need the sigmoid.
+
+    Parameters:
+        output (np.ndarray): Raw output (5+C, N) of one image.
+        conf_threshold (float): Confidence threshold.
+
+    Returns:
+        np.ndarray: Indices of the candidate anchors.
+    """
+    threshold = logit(conf_threshold) - LOGIT_PREFILTER_MARGIN
+
+    mask = output[4] > threshold
+    if output.shape[0] > 5:
+        mask &= output[5:].max(axis=0) > threshold
+
+    return np.flatnonzero(mask)
+
 def xywh2xyxy(xywh):
     xy = xywh[:, :2]
     wh = xywh[:, 2:]
@@ -53,121 +524,319 @@ def xywh2xyxy(xywh):
     bottom_right = xy + wh / 2
     return np.concatenate([top_left, bottom_right], axis=1)
 
-def postprocess_yolo_output(outputs, conf_threshold=0.3, nms_threshold=0.5, input_size=1024, orig_shape=(1024, 1024)):
+def overlapping_pairs(x1, y1, x2, y2, iou_threshold, max_pairs=4_000_000):
     """
-    Convert raw YOLO ONNX output (1, 5+C, N) to bboxes and class IDs using sigmoid + NMS.
+    Find all pairs of boxes with IoU > iou_threshold without building the full IoU matrix.
+
+    Boxes are grouped in horizontal bands as high as the highest box, so a box can only overlap
+    boxes of its own band and of the neighbour bands. Inside the bands the boxes are sorted by x1
+    and the candidates of each box are found with searchsorted. Since the IoU of two boxes is at
+    most the IoU of their x intervals, boxes with IoU > iou_threshold have x1 closer than
+    (1 - iou_threshold) times the width of the box starting first. Candidate pairs are checked in
+    chunks of at most max_pairs.
+
+    The coordinates and the IoU stay in the dtype of the inputs (float32 in nms_boxes), only the
+    sort key combining band and x1 is computed in float64.
 
     Returns:
-        bboxes (np.ndarray): Bounding boxes (N, 5) in xyxy format with scores.
-        classes (np.ndarray): Class IDs (N,).
+        first, second (np.ndarray): Indices of the overlapping pairs.
+    """
+    band_height = max(float((y2 - y1).max()), 1.0)
+    x_offset = float(x1.min())
+    band_width = float(x2.max()) - x_offset + 1
+    max_width = float((x2 - x1).max())
+
+    # Sort key: band first, then x1
+    band = np.floor((y1.astype(np.float64) - float(y1.min())) / band_height)
+    key = band * band_width + (x1.astype(np.float64) - x_offset)
+    order = np.argsort(key, kind="stable")
+    key = key[order]
+    band = band[order]
+    sx1, sy1, sx2, sy2 = x1[order], y1[order], x2[order], y2[order]
+    areas = (sx2 - sx1) * (sy2 - sy1)
+
+    n = len(order)
+    key_x1 = sx1.astype(np.float64) - x_offset
+
+    # Largest x1 distance of an overlapping pair, with a margin for the float32 IoU
+    reach_factor = max(1.0 - iou_threshold, 0.0) * (1 + 1e-4)
+    reach = (sx2.astype(np.float64) - sx1) * reach_factor
+    max_reach = max_width * reach_factor
+
+    # Same band: following boxes with x1 within the reach
+    same_start = np.arange(1, n + 1)
+    same_end = np.searchsorted(key, band * band_width + key_x1 + reach, side="right")
+
+    # Next band: boxes with x1 in (x1 - max_reach, x1 + reach]
+    next_band = (band + 1) * band_width
+    next_start = np.searchsorted(key, next_band + (key_x1 - max_reach), side="right")
+    next_end = np.searchsorted(key, next_band + key_x1 + reach, side="right")
+
+    first = []
+    second = []
+    for starts, ends in [(same_start, same_end), (next_start, next_end)]:
+        counts = np.maximum(ends - starts, 0)
+        cumulative = np.cumsum(counts)
+
+        chunk_start = 0
+        while chunk_start < n:
+            chunk_end = int(np.searchsorted(cumulative, cumulative[chunk_start] - counts[chunk_start] + max_pairs, side="right"))
+            chunk_end = min(max(chunk_end, chunk_start + 1), n)
+
+            chunk_counts = counts[chunk_start:chunk_end]
+            i = np.repeat(np.arange(chunk_start, chunk_end), chunk_counts)
+            j = starts[i] + np.arange(len(i)) - np.repeat(np.cumsum(chunk_counts) - chunk_counts, chunk_counts)
+
+            inter_w = np.maximum(np.minimum(sx2[i], sx2[j]) - np.maximum(sx1[i], sx1[j]), 0)
+            inter_h = np.maximum(np.minimum(sy2[i], sy2[j]) - np.maximum(sy1[i], sy1[j]), 0)
+            inter = inter_w * inter_h
+            union = areas[i] + areas[j] - inter
+            iou = np.where(union > 0, inter / np.maximum(union, areas.dtype.type(1e-12)), 0)
+
+            overlap = iou > iou_threshold
+            first.append(order[i[overlap]])
+            second.append(order[j[overlap]])
+
+            chunk_start = chunk_end
+
+    if not first:
+        return np.zeros((0,), dtype=np.int64), np.zeros((0,), dtype=np.int64)
+
+    return np.concatenate(first), np.concatenate(second)
+
+# Below this number of boxes cv.dnn.NMSBoxes per class is faster than the sparse pairs of nms_boxes
+NMS_SPARSE_MIN_BOXES = 256
+
+def nms_boxes_opencv(boxes, scores, class_ids, iou_threshold):
+    """
+    cv.dnn.NMSBoxes run per class, indices of the kept boxes in any order (boxes with a score <= 0
+    are dropped by OpenCV).
+    """
+    keep = []
+    for class_id in np.unique(class_ids):
+        indices = np.flatnonzero(class_ids == class_id)
+        boxes_xywh = boxes[indices].astype(np.float32)
+        boxes_xywh[:, 2:] -= boxes_xywh[:, :2]
+        kept = cv.dnn.NMSBoxes(bboxes=boxes_xywh.tolist(), scores=scores[indices].tolist()
+                               , score_threshold=0.0, nms_threshold=float(iou_threshold))
+        keep.append(indices[np.array(kept, dtype=np.int64).reshape(-1)])
+    return np.concatenate(keep)
+
+def nms_boxes(boxes, scores, class_ids, iou_threshold, max_detections=None):
+    """
+    Greedy class aware non-maximum suppression, same results as running cv.dnn.NMSBoxes per class
+    (which is used for less than NMS_SPARSE_MIN_BOXES boxes with positive scores).
+
+    Boxes of each class are shifted by class_id * (max coordinate + 1) so boxes of different
+    classes never overlap and all classes are suppressed together, with float32 coordinates and
+    IoU. The overlapping pairs are stored as sparse (CSR) lists of the lower score neighbours of
+    each box, and a single sweep in score order keeps every box not suppressed by a kept box.
+
+    Parameters:
+        boxes (np.ndarray): Boxes (N, 4) in xyxy format.
+        scores (np.ndarray): Scores (N,).
+        class_ids (np.ndarray): Class IDs (N,).
+        iou_threshold (float): Boxes overlapping a kept box with IoU > iou_threshold are removed.
+        max_detections (int): Optional maximum number of kept boxes (highest scores first).
+
+    Returns:
+        np.ndarray: Indices of the kept boxes, by decreasing score.
+    """
+    if len(boxes) == 0:
+        return np.zeros((0,), dtype=np.int64)
+
+    if len(boxes) < NMS_SPARSE_MIN_BOXES and scores.min() > 0:
+        keep = np.sort(nms_boxes_opencv(boxes, scores, class_ids, iou_threshold))
+        keep = keep[np.argsort(-scores[keep], kind="stable")]
+        return keep if max_detections is None else keep[:max_detections]
+
+    boxes = boxes.astype(np.float32, copy=False)
+    offsets = class_ids.astype(np.float32) * (boxes.max() + 1)
+
+    # Work in decreasing score order, rank 0 is the best box
+    order = np.argsort(-scores, kind="stable")
+    x1 = boxes[order, 0] + offsets[order]
+    y1 = boxes[order, 1] + offsets[order]
+    x2 = boxes[order, 2] + offsets[order]
+    y2 = boxes[order, 3] + offsets[order]
+
+    first, second = overlapping_pairs(x1, y1, x2, y2, iou_threshold)
+
+    # Edges go from the higher score box to the lower score box
+    src = np.minimum(first, second)
+    dst = np.maximum(first, second)
+
+    # CSR lists: the lower score neighbours of rank r are neighbours[indptr[r]:indptr[r+1]]
+    n = len(order)
+    neighbours = dst[np.argsort(src, kind="stable")]
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+
+    # Greedy sweep by decreasing score, the suppression of a box is final when its rank is reached.
+    # Only the boxes with lower score neighbours can suppress others.
+    suppressed = np.zeros(n, dtype=bool)
+    for rank in np.flatnonzero(indptr[1:] > indptr[:-1]).tolist():
+        if not suppressed[rank]:
+            suppressed[neighbours[indptr[rank]:indptr[rank + 1]]] = True
+
+    keep = order[~suppressed]
+
+    if max_detections is not None:
+        keep = keep[:max_detections]
+
+    return keep
+
+def decode_yolo_candidates(outputs, conf_threshold=0.3, input_size=1024, orig_shape=(1024, 1024), scale=None, pad=None):
+    """
+    Decode the raw YOLO ONNX output (1, 5+C, N) of one image into the candidate boxes with a
+    confidence > conf_threshold, before NMS. Anchors are prefiltered in logit space, so the scores
+    are only computed for the candidates.
+
+    Boxes are mapped back to the orig_shape (height, width) image with the letterbox scale and the
+    (x, y) padding before the image. By default they are computed for an image centered in a
+    square input_size input, LetterboxPreprocessor inputs pass their scale and pad=(0, 0).
+
+    Returns:
+        boxes (np.ndarray): Boxes (N, 4) in xyxy format.
+        objectness (np.ndarray): Objectness scores (N,).
+        class_scores (np.ndarray): Class scores (N, C).
     """
     output = outputs[0]  # (1, 5+C, N)
     output = np.squeeze(output, axis=0)  # (5+C, N)
-    output = output.transpose(1, 0)      # (N, 5+C)
 
-    boxes_xywh = output[:, :4]
+    candidates = prefilter_candidates(output, conf_threshold)
+    output = output[:, candidates].transpose(1, 0)  # (candidates, 5+C)
+
     objectness = sigmoid(output[:, 4])
     class_scores = sigmoid(output[:, 5:])  # shape (N, num_classes)
 
+    # Filter by confidence (objectness * class_score of the best class)
+    mask = (objectness[:, None] * class_scores).max(axis=1, initial=0) > conf_threshold
+    boxes_xywh = output[mask, :4]
+    objectness = objectness[mask]
+    class_scores = class_scores[mask]
+
+    # Convert to xyxy and scale
+    boxes_xyxy = xywh2xyxy(boxes_xywh)
+
+    # Undo letterbox scaling
+    if scale is None:
+        gain = input_size / max(orig_shape)
+        pad_x = (input_size - orig_shape[1] * gain) / 2
+        pad_y = (input_size - orig_shape[0] * gain) / 2
+    else:
+        gain = scale
+        pad_x, pad_y = pad if pad is not None else (0, 0)
+    boxes_xyxy[:, [0, 2]] -= pad_x
+    boxes_xyxy[:, [1, 3]] -= pad_y
+    boxes_xyxy /= gain
+    boxes_xyxy = np.clip(boxes_xyxy, 0, np.array([orig_shape[1], orig_shape[0], orig_shape[1], orig_shape[0]], dtype=boxes_xyxy.dtype))
+
+    return boxes_xyxy, objectness, class_scores
+
+def select_detections(boxes_xyxy, objectness, class_scores, conf_threshold=0.3, nms_threshold=0.5, max_detections=None):
+    """
+    Keep the candidates of decode_yolo_candidates with a confidence > conf_threshold and apply class
+    aware NMS. Candidates decoded with a lower threshold give the same detections as decoding with
+    conf_threshold, so thresholds can be changed without running the model again.
+
+    Returns:
+        bboxes (np.ndarray): Bounding boxes (N, 5) in xyxy format with scores.
+        classes (np.ndarray): Class IDs (N,).
+    """
+
     # Final confidence = objectness * class_score per class
     scores = objectness[:, None] * class_scores  # shape (N, num_classes)
     class_ids = np.argmax(scores, axis=1)
-    confidences = np.max(scores, axis=1)
+    confidences = np.max(scores, axis=1, initial=0)
 
     # Filter by confidence
     mask = confidences > conf_threshold
-    boxes_xywh = boxes_xywh[mask]
+    boxes_xyxy = boxes_xyxy[mask]
     class_ids = class_ids[mask]
     confidences = confidences[mask]
 
-    if len(boxes_xywh) == 0:
+    if len(boxes_xyxy) == 0:
         return [[np.zeros((0, 5))], [np.zeros((0,), dtype=np.int32)]]
 
-    # Convert to xyxy and scale
-    boxes_xyxy = xywh2xyxy(boxes_xywh)
+    # Class aware NMS
+    keep = nms_boxes(boxes_xyxy, confidences, class_ids, nms_threshold, max_detections=max_detections)
 
-    # Undo letterbox scaling
-    gain = input_size / max(orig_shape)
-    pad_x = (input_size - orig_shape[1] * gain) / 2
-    pad_y = (input_size - orig_shape[0] * gain) / 2
-    boxes_xyxy[:, [0, 2]] -= pad_x
-    boxes_xyxy[:, [1, 3]] -= pad_y
-    boxes_xyxy /= gain
-    boxes_xyxy = np.clip(boxes_xyxy, 0, [orig_shape[1], orig_shape[0], orig_shape[1], orig_shape[0]])
-
-    # Prepare final lists
-    final_boxes = []
-    final_scores = []
-    final_classes = []
-
-    # NMS per class
-    for cls in np.unique(class_ids):
-        cls_mask = class_ids == cls
-        cls_boxes = boxes_xyxy[cls_mask]
-        cls_scores = confidences[cls_mask]
-
-        boxes_nms = cls_boxes.copy()
-        boxes_nms[:, 2] -= boxes_nms[:, 0]
-        boxes_nms[:, 3] -= boxes_nms[:, 1]
-
-        indices = cv.dnn.NMSBoxes(
-            bboxes=boxes_nms.tolist(),
-            scores=cls_scores.tolist(),
-            score_threshold=conf_threshold,
-            nms_threshold=nms_threshold
-        )
-
-        if len(indices) > 0:
-            indices = np.array(indices).flatten()
-            final_boxes.append(cls_boxes[indices])
-            final_scores.append(cls_scores[indices])
-            final_classes.append(np.full(len(indices), cls, dtype=np.int32))
-
-    if not final_boxes:
+    if len(keep) == 0:
         return [[np.zeros((0, 5))], [np.zeros((0,), dtype=np.int32)]]
 
-    final_boxes = np.concatenate(final_boxes, axis=0)
-    final_scores = np.concatenate(final_scores, axis=0)
-    final_classes = np.concatenate(final_classes, axis=0)
+    # Group the detections by class, keeping the decreasing score order inside each class
+    keep = keep[np.argsort(class_ids[keep], kind="stable")]
 
-    final_boxes = np.concatenate([final_boxes, final_scores[:, None]], axis=1)  # (N, 5)
+    final_boxes = np.concatenate([boxes_xyxy[keep], confidences[keep, None]], axis=1)  # (N, 5)
+    final_classes = class_ids[keep].astype(np.int32)
 
     return [[final_boxes], [final_classes]]
 
-def outputs_to_df(outputs):
+def postprocess_yolo_output(outputs, conf_threshold=0.3, nms_threshold=0.5, input_size=1024, orig_shape=(1024, 1024), max_detections=None
+                            , scale=None, pad=None):
     """
-    Convert bounding boxes from the padded & resized image back to the original image coordinates.
-    
+    Convert raw YOLO ONNX output (1, 5+C, N) to bboxes and class IDs using sigmoid + NMS
+    (decode_yolo_candidates then select_detections).
+
+    Returns:
+        bboxes (np.ndarray): Bounding boxes (N, 5) in xyxy format with scores.
+        classes (np.ndarray): Class IDs (N,).
+    """
+    candidates = decode_yolo_candidates(outputs, conf_threshold=conf_threshold, input_size=input_size, orig_shape=orig_shape
+                                        , scale=scale, pad=pad)
+
+    return select_detections(*candidates, conf_threshold=conf_threshold, nms_threshold=nms_threshold, max_detections=max_detections)
+
+def box_iou(boxes_a, boxes_b):
+    """
+    Pairwise IoU between two sets of boxes in xyxy format.
+
+    Returns:
+        np.ndarray: IoU matrix (len(boxes_a), len(boxes_b)).
+    """
+    boxes_a = np.asarray(boxes_a)[:, :4]
+    boxes_b = np.asarray(boxes_b)[:, :4]
+
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    inter = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+
+    area_a = np.prod(boxes_a[:, 2:] - boxes_a[:, :2], axis=1)
+    area_b = np.prod(boxes_b[:, 2:] - boxes_b[:, :2], axis=1)
+    union = area_a[:, None] + area_b[None, :] - inter
+
+    return np.where(union > 0, inter / np.maximum(union, 1e-12), 0.0)
+
+# Columns of the detections of one image, see outputs_to_detections
+DETECTION_COLUMNS = ["xmin", "ymin", "xmax", "ymax", "score", "class"]
+
+def outputs_to_detections(outputs):
+    """
+    Columnar view of the postprocessed outputs of one image (no per detection Python objects).
+
     Parameters:
-        bboxes (list): List of bounding boxes as [x1, y1, x2, y2, score].
-        classes (list): List of corresponding class labels.
-        original_size (tuple): (height, width) of the original image.
-        target_size (tuple): (target_height, target_width) used for resizing/padding.
-    
+        outputs (list): Output of postprocess_yolo_output, [[bboxes (N, 5)], [classes (N,)]].
+
     Returns:
-        DataFrame: A pandas DataFrame with columns [xmin, ymin, xmax, ymax, score, class].
+        dict: Column name (DETECTION_COLUMNS) -> array of length N, float32 boxes and scores, int32 classes.
     """
+    bboxes = np.asarray(outputs[0][0], dtype=np.float32).reshape(-1, 5)
+    classes = np.asarray(outputs[1][0], dtype=np.int32)
 
-    bboxes = outputs[0][0]
-    classes = outputs[1][0]
+    detections = {column: bboxes[:, index] for index, column in enumerate(DETECTION_COLUMNS[:5])}
+    detections["class"] = classes
 
-    results = []
-    for bbox, label in zip(bboxes, classes):
-        x1, y1, x2, y2, score = bbox
+    return detections
 
-        
-        results.append({
-            "xmin": x1,
-            "ymin": y1,
-            "xmax": x2,
-            "ymax": y2,
-            "score": score,
-            "class": label
-        })
-        
-    # Convert the list of dictionaries to a pandas DataFrame
-    df = pd.DataFrame(results)
-    return df
+def outputs_to_df(outputs):
+    """
+    Convert the postprocessed outputs of one image to a DataFrame.
+
+    Returns:
+        DataFrame: A pandas DataFrame with columns [xmin, ymin, xmax, ymax, score, class].
+    """
+    return pd.DataFrame(outputs_to_detections(outputs), columns=DETECTION_COLUMNS)
 
 def pos2coords(pos, extent, img_width, img_height):
     # extent is a rasterio BoundingBox: left, bottom, right, top
@@ -181,63 +850,100 @@ def pos2coords(pos, extent, img_width, img_height):
     return (coord_x, coord_y)
 
 
-def save_shapefile_bb(df, extent, img_width, img_height, epsg, allow_cols=[], output_filename=None):
-    print(type(df))
-    if type(df) == "NoneType":
+def boxes_to_coords(xmin, ymin, xmax, ymax, extent, img_width, img_height):
+    """
+    Map pixel boxes to the corners of their polygons in map coordinates (vectorized pos2coords).
+
+    Returns:
+        coords (np.ndarray): Corners (N, 4, 2) in the order (xmin, ymin), (xmax, ymin), (xmax, ymax), (xmin, ymax).
+    """
+    left, bottom, right, top = extent.left, extent.bottom, extent.right, extent.top
+
+    pixel_x = np.stack([xmin, xmax, xmax, xmin], axis=1).astype(np.float64)
+    pixel_y = np.stack([ymin, ymin, ymax, ymax], axis=1).astype(np.float64)
+
+    coord_x = (pixel_x / img_width) * (right - left) + left
+    coord_y = (1.0 - pixel_y / img_height) * (top - bottom) + bottom
+
+    return np.stack([coord_x, coord_y], axis=2)
+
+def polygon_areas_m2(coords, epsg, extent):
+    """
+    Areas in square meters of polygons given by their corners (N, K, 2), all at once.
+
+    Geographic coordinates are projected to a cylindrical equal area projection centered on the
+    extent (as done before with to_crs), projected ones are measured in their own linear units.
+    """
+    if len(coords) == 0:
+        return np.zeros((0,))
+
+    crs = ProjCRS.from_user_input(f"EPSG:{epsg}")
+
+    if crs.is_geographic:
+        equal_area_crs = f"+proj=cea +lat_0={extent.bottom} +lon_0={extent.left} +units=m"
+        transformer = Transformer.from_crs(crs, equal_area_crs, always_xy=True)
+        x, y = transformer.transform(coords[..., 0], coords[..., 1])
+        scale = 1.0
+    else:
+        x, y = coords[..., 0], coords[..., 1]
+        scale = crs.axis_info[0].unit_conversion_factor if crs.axis_info else 1.0
+
+    # Shoelace formula over the corners of every polygon
+    area = 0.5 * np.abs(np.sum(x * np.roll(y, -1, axis=1) - np.roll(x, -1, axis=1) * y, axis=1))
+
+    return area * scale**2
+
+@PROFILER.timed("georeference")
+def save_shapefile_bb(detections, extent, img_width, img_height, epsg, allow_cols=[], output_filename=None):
+    """
+    Create (and optionally save) the polygons of the detected boxes in map coordinates.
+
+    Parameters:
+        detections (dict | DataFrame): Detection columns (see outputs_to_detections).
+        extent (BoundingBox): Extent of the image.
+        img_width, img_height (int): Image size in pixels.
+        epsg (str): EPSG code of the image.
+        allow_cols (list): Detection columns copied to the attributes.
+        output_filename (str): Optional shapefile.
+
+    Returns:
+        GeoDataFrame: Polygons with the allow_cols attributes and area_m2.
+    """
+    if detections is None:
         print("No results")
         return
 
-    df_tree_polygons_test = pd.DataFrame()
-    tree_bb = []
-    count = 0
-
-    for index, detection in df.iterrows():
-        xmin = detection["xmin"]
-        ymin = detection["ymin"]
-        xmax = detection["xmax"]
-        ymax = detection["ymax"]
-        new_contour = [(xmin, ymin), (xmax, ymin), (xmax, ymax), (xmin, ymax)]
-        coord_polygon = []
-        for point in new_contour:
-            coord = (point[0], point[1])
-            new_coord = pos2coords(coord, extent, img_width, img_height)
-            coord_polygon.append(new_coord)
-        #print("len", len(coord_polygon))
-        if len(coord_polygon) > 2:
-            polygon_object = shapely.geometry.Polygon(coord_polygon)
-            #mydic = {'Class': 'Tree', 'ID': count, 'label': 'Tree'}
-            mydic = {'Type': 'forage_plant'}
-            for col in allow_cols:
-                mydic[col] = detection[col]
-            df_item_test = pd.DataFrame(mydic, index=[count])
-            df_tree_polygons_test = pd.concat((df_tree_polygons_test, df_item_test))
-            tree_bb.append(polygon_object)
-            count = count + 1
+    # All the boxes are georeferenced and converted to polygons at once
+    coords = boxes_to_coords(*[np.asarray(detections[col]) for col in ["xmin", "ymin", "xmax", "ymax"]]
+                             , extent, img_width, img_height)
+    tree_bb = shapely.polygons(coords)
+
+    attributes = {'Type': ['forage_plant']*len(tree_bb)}
+    for col in allow_cols:
+        attributes[col] = np.asarray(detections[col])
+    df_tree_polygons_test = pd.DataFrame(attributes)
 
     # Create geodataframe
     gdf_trees = gpd.GeoDataFrame(df_tree_polygons_test, geometry=tree_bb)
     if epsg is not None:
         gdf_trees = gdf_trees.set_crs(epsg=epsg)
-    print(gdf_trees)
+    print(f"{len(gdf_trees)} detections") # printing the whole GeoDataFrame costs more than building it
 
     # Area calculation (optional, only if extent is valid)
-    if extent is not None:
-        lon = extent.left
-        lat = extent.bottom
-        new_crs = f"+proj=cea +lat_0={lat} +lon_0={lon} +units=m"
-        gdf_trees["area_m2"] = gdf_trees.to_crs(new_crs).area
+    if extent is not None and epsg is not None:
+        gdf_trees["area_m2"] = polygon_areas_m2(coords, epsg, extent)
         #gdf_trees["a_diam_m"] = np.sqrt(gdf_trees["area_m2"] * 4.0 / np.pi)
 
     if output_filename is not None:
         gdf_trees_bb = gdf_trees.copy()
-        print("HERE")
-        print(output_filename)        
         if gdf_trees_bb.empty:
         # Ensure at least the geometry column exists with correct type
             gdf_trees_bb = gpd.GeoDataFrame(columns=gdf_trees_bb.columns, geometry='geometry', crs=gdf_trees_bb.crs)
         safe_path = os.path.normpath(output_filename)
         gdf_trees_bb.to_file(safe_path, index=False)
 
+    return gdf_trees
+
     # ...existing code for saving outputs...
     # if "bounding_boxes" in self.parameters["vector_outputs"]:
     #     gdf_trees_bb = gdf_trees.copy()
@@ -255,6 +961,41 @@ def save_shapefile_bb(df, extent, img_width, img_height, epsg, allow_cols=[], ou
     #         self.output_files.append(new_output_filename)
 
 
+def crs_to_epsg(crs, filepath):
+    """
+    Get the EPSG code (without the "EPSG:" prefix) of a raster CRS, as used by save_shapefile_bb.
+    """
+    if crs:
+        if not crs.is_epsg_code and crs.to_epsg() is None:
+            raise ValueError(f"Could not determine EPSG code for file: {filepath}")
+    else:
+        raise ValueError(f"No CRS found in raster file: {filepath}")
+
+    return crs.to_string().replace("EPSG:", "")
+
+def rgb_bands(tile):
+    """
+    First three bands of a band-first raster array (bands, height, width), the first band is
+    repeated for single band rasters.
+    """
+    if tile.shape[0] < 3:
+        return np.repeat(tile[:1], 3, axis=0)
+    return tile[:3]
+
+def to_uint8(np_img):
+    """
+    8-bit pixels of an image of any dtype, as cv.imread converted them: integer rasters (e.g. 16-bit
+    orthomosaics) are scaled by the maximum of their dtype, float rasters are clipped to 0-255.
+    """
+    if np_img.dtype == np.uint8:
+        return np_img
+    if np.issubdtype(np_img.dtype, np.integer):
+        scale = np.float32(255.0/np.iinfo(np_img.dtype).max)
+        np_img = np.clip(np_img, 0, None).astype(np.float32)*scale
+    else:
+        np_img = np.nan_to_num(np_img.astype(np.float32, copy=False))
+    return np.rint(np.clip(np_img, 0, 255)).astype(np.uint8)
+
 def check_raster(input_file):
 
     metadata = {}
@@ -270,7 +1011,6 @@ import numpy as np
 import geopandas as gpd
 from shapely.geometry import box
 from shapely.geometry import Polygon
-from sklearn.decomposition import PCA
 
 
 def compute_centroids(gdf):
@@ -361,6 +1101,8 @@ def compute_pca_axes(points):
     The first row is the direction of maximum variance (usually horizontal),
     the second is orthogonal.
     """
+    from sklearn.decomposition import PCA # Slow import, only needed here
+
     pca = PCA(n_components=2)
     pca.fit(points)
     axes = pca.components_
@@ -539,6 +1281,7 @@ def rotate_polygon_to_pca_axes(polygon, centroid, axes):
 
 
 # --- Main pipeline ---
+@PROFILER.timed("numbering")
 def label_polygons_from_shapefile(gdf, output_path=None, serpentine=False, row_tol=10,
                                    iou_thresh=0.3, min_ratio=0.2, max_ratio=5.0, align_to_grid=False, only_postprocess=False):
     # Save original CRS
@@ -794,7 +1537,142 @@ class TILER():
         self.grid = self.grid.set_crs(epsg=self.crs, allow_override=True)
         #grid.to_file("grid.shp")
 
-    def extract_tiles(self, scale = 1.0):
+    def low_resolution_shape(self, max_size):
+        """
+        (height, width) of a decimated read of the raster with at most max_size pixels per side.
+        """
+        factor = max(1, int(np.ceil(max(self.raster.width, self.raster.height) / max_size)))
+        return int(np.ceil(self.raster.height / factor)), int(np.ceil(self.raster.width / factor))
+
+    def tile_fractions(self, values):
+        """
+        Mean of a low resolution array covering the whole raster (e.g. a 0/1 mask) inside each grid tile.
+        Parts of a tile outside the raster are not counted.
+
+        Returns:
+            np.ndarray: Mean value of each tile of the grid, in grid order.
+        """
+        raster = self.raster
+        out_h, out_w = values.shape
+
+        # Integral image: sum of any window in constant time
+        integral = np.zeros((out_h + 1, out_w + 1))
+        integral[1:, 1:] = values.astype(np.float64).cumsum(axis=0).cumsum(axis=1)
+
+        bounds = self.grid.to_crs(raster.crs).bounds
+        inverse = ~raster.transform
+        cols_a, rows_a = inverse * (bounds["minx"].values, bounds["maxy"].values)
+        cols_b, rows_b = inverse * (bounds["maxx"].values, bounds["miny"].values)
+
+        scale_x = out_w / raster.width
+        scale_y = out_h / raster.height
+        c0 = np.clip(np.floor(np.minimum(cols_a, cols_b) * scale_x), 0, out_w).astype(int)
+        c1 = np.clip(np.ceil(np.maximum(cols_a, cols_b) * scale_x), 0, out_w).astype(int)
+        r0 = np.clip(np.floor(np.minimum(rows_a, rows_b) * scale_y), 0, out_h).astype(int)
+        r1 = np.clip(np.ceil(np.maximum(rows_a, rows_b) * scale_y), 0, out_h).astype(int)
+
+        sums = integral[r1, c1] - integral[r0, c1] - integral[r1, c0] + integral[r0, c0]
+        areas = (r1 - r0) * (c1 - c0)
+
+        return np.where(areas > 0, sums / np.maximum(areas, 1), 0.0)
+
+    def read_valid_mask(self, max_size=VALID_MASK_SIZE):
+        """
+        Low resolution fraction of valid pixels (not nodata, not masked by the alpha band or internal
+        mask) of the raster, overviews are used when available.
+        """
+        # Averaging keeps partially valid areas as non zero values
+        valid = self.raster.dataset_mask(out_shape=self.low_resolution_shape(max_size), resampling=rio.enums.Resampling.average)
+        return valid.astype(np.float64) / 255.0
+
+    def valid_fractions(self, max_size=VALID_MASK_SIZE):
+        """
+        Fraction of valid pixels of each grid tile, from the dataset mask read at low resolution.
+        """
+        return self.tile_fractions(self.read_valid_mask(max_size))
+
+    def vegetation_mask(self, max_size=PRESCREEN_SIZE, exg_threshold=None, texture_threshold=0.0, margin=PRESCREEN_MARGIN):
+        """
+        Low resolution mask of the areas where plots can exist, from a decimated read of the raster
+        (GDAL overviews are used when available, otherwise the read is resampled on the fly).
+
+        A pixel is kept when its Excess Green index (2g - r - b over chromatic coordinates) is above
+        exg_threshold (Otsu threshold over the valid pixels when None) and the local standard deviation
+        of the index is above texture_threshold. The mask is dilated by margin pixels so plots on the
+        border of the vegetation are not lost.
+
+        Returns:
+            np.ndarray: Mask (height, width) of 0/1 values covering the raster.
+        """
+        raster = self.raster
+        out_shape = self.low_resolution_shape(max_size)
+
+        indexes = [1, 2, 3] if raster.count >= 3 else [1, 1, 1]
+        r, g, b = raster.read(indexes=indexes, out_shape=(3,) + out_shape, resampling=rio.enums.Resampling.average).astype(np.float32)
+        valid = self.read_valid_mask(max_size) > 0
+
+        total = r + g + b
+        total[total == 0] = 1
+        exg = (2*g - r - b) / total
+
+        if exg_threshold is None:
+            # Otsu over the index scaled from [-1, 2] to [0, 255]
+            values = np.clip((exg[valid] + 1) / 3 * 255, 0, 255).astype(np.uint8)
+            if len(values) == 0:
+                return np.zeros(out_shape)
+            otsu, _ = cv.threshold(values.reshape(1, -1), 0, 255, cv.THRESH_BINARY + cv.THRESH_OTSU)
+            exg_threshold = otsu / 255 * 3 - 1
+            print(f"Excess Green threshold {exg_threshold:.3f}")
+
+        candidates = (exg > exg_threshold) & valid
+
+        if texture_threshold > 0:
+            mean = cv.blur(exg, (5, 5))
+            std = np.sqrt(np.maximum(cv.blur(exg*exg, (5, 5)) - mean*mean, 0))
+            candidates &= std > texture_threshold
+
+        candidates = candidates.astype(np.uint8)
+        if margin > 0:
+            candidates = cv.dilate(candidates, np.ones((2*margin + 1, 2*margin + 1), np.uint8))
+
+        return candidates
+
+    def prune_grid(self, keep, reason):
+        """
+        Keep only the grid tiles selected by the boolean array keep.
+
+        Returns:
+            int: Number of removed tiles.
+        """
+        skipped = int((~keep).sum())
+        print(f"Skipping {skipped} of {len(self.grid)} tiles {reason}")
+        self.grid = self.grid[keep]
+        return skipped
+
+    def skip_empty_tiles(self, min_valid_fraction=0.0):
+        """
+        Remove from the grid the tiles whose valid pixel fraction is <= min_valid_fraction.
+
+        Returns:
+            int: Number of skipped tiles.
+        """
+        fractions = self.valid_fractions()
+        return self.prune_grid(fractions > min_valid_fraction, f"with valid pixel fraction <= {min_valid_fraction}")
+
+    def prescreen_tiles(self, min_vegetation_fraction=0.0, **kwargs):
+        """
+        Remove from the grid the tiles whose fraction of vegetation (see vegetation_mask) is <= min_vegetation_fraction,
+        e.g. tiles over roads, buildings or bare soil.
+
+        Returns:
+            int: Number of skipped tiles.
+        """
+        fractions = self.tile_fractions(self.vegetation_mask(**kwargs))
+        return self.prune_grid(fractions > min_vegetation_fraction, f"with vegetation fraction <= {min_vegetation_fraction}")
+
+    def extract_tiles(self, scale = 1.0, tile_done = None):
+
+            # tile_done(i, tile) is called after each tile, tile is None if the file already existed
 
             #size = 256
 
@@ -808,10 +1686,15 @@ class TILER():
 
                 if os.path.exists(filename):
                     print(f"File already exists {filename}")
+                    if tile_done is not None:
+                        tile_done(i, None)
                     continue
 
 
                 tile, w, h = self.clip_raster(i, filename)
+
+                if tile_done is not None:
+                    tile_done(i, tile)
                 
 
                 coco_images.append({
@@ -825,6 +1708,25 @@ class TILER():
 
             return
 
+    @PROFILER.timed("read")
+    def read_tile(self, id, dataset=None):
+        """
+        Read a tile of the grid from the raster as a band-first array, without saving it.
+        Threads reading in parallel must pass their own dataset (rio.open of path_raster).
+
+        Returns:
+            tile (np.ndarray): Tile pixels (bands, height, width).
+            tile_transform (Affine): Transform of the tile.
+        """
+
+        if dataset is None:
+            dataset = self.raster
+
+        vector = self.grid[id:id+1].to_crs(dataset.crs)
+        tile, tile_transform = rio_mask.mask(dataset, vector.geometry, crop=True)
+
+        return tile, tile_transform
+
     def clip_raster(self, id, filename, scale = 1.0):
 
         #vector = self.grid.to_crs(self.raster.crs)
@@ -842,7 +1744,7 @@ class TILER():
                     int(dataset.height * scale),
                     int(dataset.width * scale)
                 ),
-                resampling=Resampling.bilinear
+                resampling=rio.enums.Resampling.bilinear
             )
 
             # scale image transform
@@ -855,7 +1757,7 @@ class TILER():
 
         #tile, tile_transform = mask(self.raster, [vector.geometry[id]], crop=True)
         #tile, tile_transform = mask(raster, vector.geometry, crop=True, filled = True)
-        tile, tile_transform = mask(raster, vector.geometry, crop=True)
+        tile, tile_transform = rio_mask.mask(raster, vector.geometry, crop=True)
 
         width = tile.shape[2]
         height = tile.shape[1]
@@ -888,9 +1790,66 @@ class TILER():
 
 class ForagesROIsDetector():
 
-    def __init__(self):
+    def __init__(self, batch_size=1, providers=None, session_options=None, use_session_cache=True, quantized=False
+                 , max_detections=None, pipeline=False, queue_depth=DEFAULT_QUEUE_DEPTH, reader_threads=DEFAULT_READER_THREADS
+                 , workers=1, io_binding=True, dynamic_shapes=True
+                 , result_cache_dir=None, result_cache_max_mb=DEFAULT_RESULT_CACHE_MAX_MB
+                 , conf_threshold=CONF_THRESHOLD, nms_threshold=NMS_THRESHOLD, candidate_threshold=DEFAULT_CANDIDATE_THRESHOLD):
 
         self.ort_sess = None
+        self.model_filepath = None
+
+        # Use the INT8 model (QUANTIZED_MODEL_FILENAME) instead of the fp32 one
+        self.quantized = quantized
+
+        # Optional cap of detections kept per tile after NMS
+        self.max_detections = max_detections
+
+        # Share model sessions with the other detectors of the process
+        self.use_session_cache = use_session_cache
+
+        # Ordered list of execution providers, see select_providers
+        self.providers = providers
+        # Keyword arguments of create_session_options (threads, execution mode, ...)
+        self.session_options = {k: v for k, v in (session_options or {}).items() if v is not None}
+
+        # Number of tiles stacked in each session run
+        self.batch_size = max(1, int(batch_size))
+        # Batch size accepted by the loaded model, None if the batch axis is dynamic
+        self.model_batch_size = None
+
+        # Reused input buffers, created on the first predict
+        self.preprocessor = None
+
+        # Run the session with preallocated output buffers (see IOBindingRunner)
+        self.io_binding = io_binding
+        self.runner = None
+
+        # Pad inputs only up to a multiple of MODEL_STRIDE when the model has dynamic height and width
+        self.dynamic_shapes = dynamic_shapes
+        # Model input size and stride of the letterbox (None for square imgsz inputs), set by initialize
+        self.imgsz = IMGSZ
+        self.input_stride = None
+
+        self.conf_threshold = conf_threshold
+        self.nms_threshold = nms_threshold
+        # Confidence threshold of the raw candidates saved by tile_inference (see interface.candidatestore)
+        self.candidate_threshold = candidate_threshold
+
+        # Raw candidates cached on disk by image content (see interface.resultcache), None disables it
+        self.result_cache_dir = result_cache_dir
+        self.result_cache_max_mb = result_cache_max_mb
+        self.result_cache = ResultCache(result_cache_dir, result_cache_max_mb) if result_cache_dir else None
+
+        # Overlap reading, inference and writing with the prefetch pipeline (see run_pipeline)
+        self.pipeline = pipeline
+        self.queue_depth = queue_depth
+        self.reader_threads = reader_threads
+        # Utilization report of the last pipeline run
+        self.pipeline_report = None
+
+        # Processes sharing the files of batch_processing, each with its own session (see sharded_processing)
+        self.workers = max(1, int(workers))
 
         pass
 
@@ -899,31 +1858,367 @@ class ForagesROIsDetector():
         #Load model
         if self.ort_sess is None:            
 
-            model_filepath = os.path.join(MODEL_PATH, MODEL_FILENAME)
+            model_filepath = self.get_model_filepath()
+
+            providers = select_providers(self.providers)
 
-            providers = [
-                ("CUDAExecutionProvider", {
-                    "device_id": 0,
-                    # Optional: additional options can be provided, e.g.
-                    #"gpu_mem_limit":  * 1024 * 1024 * 1024,
-                    #"gpu_mem_limit":  6 * 1024,
-                    # "cudnn_conv_algo_search": "EXHAUSTIVE",
-                    # "do_copy_in_default_stream": True,
-                })
-            ]
+            def create_session():
+                sess_options = create_session_options(**self.session_options)
+                return ort.InferenceSession(model_filepath, sess_options=sess_options, providers=providers)
 
-            self.ort_sess = ort.InferenceSession(model_filepath, providers=providers)
+            with PROFILER.stage("model_load"):
+                if self.use_session_cache:
+                    # Reuse the session loaded by previous detectors in this process
+                    self.ort_sess = SESSION_CACHE.get(model_filepath, create_session, providers, self.session_options)
+                else:
+                    self.ort_sess = create_session()
+
+            self.model_filepath = model_filepath
 
             # self.ort_sess = ort.InferenceSession(model_filepath
             #                     ,providers=ort.get_available_providers()
             #                     )
 
+            print("Execution providers:", self.ort_sess.get_providers())
+
+            input_shape = self.ort_sess.get_inputs()[0].shape
+            self.model_batch_size = input_shape[0] if isinstance(input_shape[0], int) else None
+
+            self.imgsz, self.input_stride = self.input_geometry(input_shape)
+            if self.input_stride is not None:
+                print(f"Model {model_filepath} has dynamic input shapes, padding inputs to multiples of {self.input_stride}")
+
+            if self.batch_size > 1 and self.model_batch_size is not None:
+                print(f"Model {model_filepath} has a fixed batch size of {self.model_batch_size}, "
+                      f"running tiles one by one. Use export_dynamic_batch_model to create {DYNAMIC_MODEL_FILENAME}")
+
         return
-    
-    def inference(self, filepath, output_folder=None):
+
+    def input_geometry(self, input_shape):
+        """
+        Letterbox size and stride (None for square imgsz inputs) of a model input shape.
+        """
+
+        _, _, height_dim, width_dim = input_shape
+        if isinstance(height_dim, int) and isinstance(width_dim, int):
+            return max(height_dim, width_dim), None
+
+        # Dynamic height and width (e.g. ultralytics export with dynamic=True)
+        return IMGSZ, MODEL_STRIDE if self.dynamic_shapes else None
+
+    def get_model_filepath(self):
+
+        if self.quantized:
+            model_filepath = os.path.join(MODEL_PATH, QUANTIZED_MODEL_FILENAME)
+            if not os.path.exists(model_filepath):
+                raise FileNotFoundError(f"Quantized model not found: {model_filepath}, create it with the quantize_model task")
+            return model_filepath
+
+        model_filepath = os.path.join(MODEL_PATH, MODEL_FILENAME)
+
+        if self.batch_size > 1:
+            dynamic_model_filepath = os.path.join(MODEL_PATH, DYNAMIC_MODEL_FILENAME)
+            if os.path.exists(dynamic_model_filepath):
+                model_filepath = dynamic_model_filepath
+
+        return model_filepath
+
+    def release(self):
+        """
+        Drop the model session of this detector and remove it from the process session cache.
+        """
+
+        if self.ort_sess is not None:
+            if self.use_session_cache:
+                SESSION_CACHE.release(self.model_filepath)
+            self.ort_sess = None
+            self.runner = None
+
+    def predict(self, np_images, band_first=False, candidates=None):
+        """
+        Run the model over a list of RGB images, stacking up to batch_size images per session run.
+        With band_first=True the images are band-first raster arrays (bands, height, width).
+
+        When candidates is a list, it receives the raw candidates of each image decoded with
+        candidate_threshold (see decode). Cached candidates can be decoded with a lower threshold.
+
+        Returns:
+            list: Postprocessed outputs of each image, in the same order as np_images.
+        """
+
+        results = [None]*len(np_images)
+        keys = [None]*len(np_images)
+        image_candidates = [None]*len(np_images)
+
+        if self.result_cache is not None:
+            signature = self.cache_signature(band_first)
+            model_filepath = self.get_model_filepath()
+            for i, np_image in enumerate(np_images):
+                keys[i] = self.result_cache.make_key(np_image, model_filepath, signature)
+                image_candidates[i] = self.result_cache.get(keys[i], self.raw_conf_threshold())
+                if image_candidates[i] is not None:
+                    results[i] = self.select(image_candidates[i])
+
+        # Only the images without cached candidates run the model (the session is not loaded if all are cached)
+        pending = [i for i, result in enumerate(results) if result is None]
+
+        if pending:
+            # Candidates below conf_threshold are only decoded when they are kept
+            keep_candidates = self.result_cache is not None or candidates is not None
+            conf_threshold = self.raw_conf_threshold() if keep_candidates else self.conf_threshold
+            self.predict_pending(np_images, pending, band_first, conf_threshold, keys, results, image_candidates)
+
+        if candidates is not None:
+            candidates.extend(image_candidates)
+
+        return results
+
+    def predict_pending(self, np_images, pending, band_first, conf_threshold, keys, results, image_candidates):
+        """
+        Run the model over the pending indexes of np_images (see predict), filling their results and
+        their candidates decoded with conf_threshold, and storing the candidates in the result cache.
+        """
 
         self.initialize()
 
+        input_name = self.ort_sess.get_inputs()[0].name
+        run_size = self.batch_size if self.model_batch_size is None else self.model_batch_size
+
+        if (self.preprocessor is None or self.preprocessor.batch_size != run_size
+                or (self.preprocessor.imgsz, self.preprocessor.stride) != (self.imgsz, self.input_stride)):
+            self.preprocessor = LetterboxPreprocessor(imgsz=self.imgsz, batch_size=run_size, stride=self.input_stride)
+
+        if self.io_binding and (self.runner is None or self.runner.ort_sess is not self.ort_sess):
+            self.runner = IOBindingRunner(self.ort_sess)
+
+        for start in range(0, len(pending), run_size):
+            indexes = pending[start:start+run_size]
+            batch = [np_images[i] for i in indexes]
+            img_prec, scales, shapes = self.preprocessor.preprocess_batch(batch, band_first=band_first)
+            if self.io_binding:
+                # Outputs are reused by the next batch, they are decoded before it runs
+                outputs = self.runner.run(img_prec)
+            else:
+                with PROFILER.stage("inference"):
+                    outputs = self.ort_sess.run(None, {input_name:img_prec})
+
+            for i, image_outputs, r, shape in zip(indexes, split_batch_outputs(outputs, len(batch)), scales, shapes):
+                image_candidates[i] = self.decode(image_outputs, r, shape, conf_threshold)
+                results[i] = self.select(image_candidates[i])
+                if self.result_cache is not None:
+                    self.result_cache.put(keys[i], image_candidates[i], conf_threshold)
+
+    def cache_signature(self, band_first):
+        """
+        Preprocessing parameters changing the model outputs of an image with the same model, part
+        of the result cache keys. The model input geometry is read from the model file when the
+        session is not loaded yet.
+        """
+
+        imgsz, input_stride = self.imgsz, self.input_stride
+        if self.ort_sess is None:
+            input_shape = model_input_shape(self.get_model_filepath())
+            if input_shape is None:
+                self.initialize()
+                imgsz, input_stride = self.imgsz, self.input_stride
+            else:
+                imgsz, input_stride = self.input_geometry(input_shape)
+
+        return {"band_first": band_first
+                , "imgsz": imgsz
+                , "input_stride": input_stride}
+
+    def postprocess(self, image_outputs, scale, orig_shape):
+        """
+        Decode and filter the raw model outputs of one image, with boxes in the pixels of the
+        orig_shape (height, width) image preprocessed with the letterbox scale (LetterboxPreprocessor).
+        """
+        return self.select(self.decode(image_outputs, scale, orig_shape, self.conf_threshold))
+
+    def raw_conf_threshold(self):
+        """
+        Threshold of the saved raw candidates, never above conf_threshold so the run itself can be reproduced.
+        """
+        return min(self.candidate_threshold, self.conf_threshold)
+
+    @PROFILER.timed("decode")
+    def decode(self, image_outputs, scale, orig_shape, conf_threshold):
+        """
+        Raw candidates (boxes, objectness, class_scores) of one image with a confidence > conf_threshold, before NMS.
+        """
+        return decode_yolo_candidates(image_outputs, conf_threshold=conf_threshold, orig_shape=orig_shape
+                                      , scale=scale, pad=(0, 0))
+
+    @PROFILER.timed("nms")
+    def select(self, candidates):
+        """
+        Detections of the raw candidates of one image with the thresholds of the detector.
+        """
+        return select_detections(*candidates, conf_threshold=self.conf_threshold, nms_threshold=self.nms_threshold
+                                 , max_detections=self.max_detections)
+
+    def run_pipeline(self, items, read_fc, write_fc, interruption_check=None, candidates_fc=None):
+        """
+        Run the detection over items with the prefetch pipeline (interface.pipeline.Pipeline).
+
+        Reader threads read items with read_fc(item) -> (band-first image, context) and preprocess
+        them into free slots of a shared input tensor, the inference stage runs batches of slots,
+        and the writer stage decodes the outputs and calls write_fc(item, context, outputs).
+        The number of slots bounds the memory used by prefetched tiles. Items found in the result
+        cache skip the preprocessing and the model, their candidates are only selected.
+
+        With candidates_fc, the writer also calls candidates_fc(item, context, candidates) with the
+        raw candidates of each item (see decode).
+
+        Returns:
+            dict: Pipeline utilization report.
+        """
+
+        self.initialize()
+
+        input_name = self.ort_sess.get_inputs()[0].name
+        run_size = self.batch_size if self.model_batch_size is None else self.model_batch_size
+
+        # Slots in the read queue, held by readers and in the running batch
+        num_slots = self.queue_depth + self.reader_threads + run_size
+        preprocessor = LetterboxPreprocessor(imgsz=self.imgsz, batch_size=num_slots, stride=self.input_stride)
+        free_slots = queue.Queue()
+        for slot in range(num_slots):
+            free_slots.put(slot)
+
+        # Output buffers of batches not decoded yet by the writer (one batch runs while the
+        # write queue and the writer hold the others), see IOBindingRunner
+        runner = IOBindingRunner(self.ort_sess) if self.io_binding else None
+        num_output_sets = self.queue_depth + 2
+        free_output_sets = queue.Queue()
+        for output_set in range(num_output_sets):
+            free_output_sets.put(output_set)
+        # Images of each output set not decoded yet
+        pending_images = [0]*num_output_sets
+        pending_lock = threading.Lock()
+
+        pipeline = Pipeline(None, None, None
+                            , batch_size=run_size
+                            , queue_depth=self.queue_depth
+                            , reader_threads=self.reader_threads
+                            , interruption_check=interruption_check)
+
+        signature = self.cache_signature(True)
+        # Candidates below conf_threshold are only decoded when they are kept
+        keep_candidates = self.result_cache is not None or candidates_fc is not None
+        conf_threshold = self.raw_conf_threshold() if keep_candidates else self.conf_threshold
+
+        def read(item):
+            np_image, context = read_fc(item)
+            key = None
+            if self.result_cache is not None:
+                key = self.result_cache.make_key(np_image, self.model_filepath, signature)
+                cached = self.result_cache.get(key, conf_threshold)
+                if cached is not None:
+                    return None, None, context, key, cached
+            slot = pipeline.get(free_slots, interruptible=True)
+            letterbox = preprocessor.preprocess_into(np_image, slot, band_first=True)
+            return slot, letterbox, context, key, None
+
+        def infer(batch):
+            slots = [slot for slot, _, _, _, cached in batch if cached is None]
+            if not slots:
+                return [(None, None)]*len(batch)
+            img_prec = preprocessor.batch_tensor(slots)
+            if runner is not None:
+                output_set = pipeline.get(free_output_sets)
+                pending_images[output_set] = len(slots)
+                outputs = runner.run(img_prec, output_set)
+            else:
+                output_set = None
+                with PROFILER.stage("inference"):
+                    outputs = self.ort_sess.run(None, {input_name:img_prec})
+            for slot in slots:
+                free_slots.put(slot)
+            image_outputs = iter(split_batch_outputs(outputs, len(slots)))
+            return [(None, None) if cached is not None else (output_set, next(image_outputs))
+                    for _, _, _, _, cached in batch]
+
+        def write(item, data, result):
+            _, letterbox, context, key, cached = data
+            output_set, image_outputs = result
+            if cached is not None:
+                candidates = cached
+            else:
+                candidates = self.decode(image_outputs, *letterbox, conf_threshold)
+                if output_set is not None:
+                    with pending_lock:
+                        pending_images[output_set] -= 1
+                        if pending_images[output_set] == 0:
+                            free_output_sets.put(output_set)
+                if key is not None:
+                    self.result_cache.put(key, candidates, conf_threshold)
+            detections = self.select(candidates)
+            if candidates_fc is not None:
+                candidates_fc(item, context, candidates)
+            write_fc(item, context, detections)
+
+        pipeline.read_fc = read
+        pipeline.infer_fc = infer
+        pipeline.write_fc = write
+
+        self.pipeline_report = pipeline.run(items)
+        return self.pipeline_report
+
+    def inference(self, filepath, output_folder=None):
+
+        return self.inference_batch([filepath], output_folder)[0]
+
+    def inference_batch(self, filepaths, output_folder=None):
+        """
+        Run the detection over a list of images with batched session runs and save
+        the detections of each image separately.
+
+        output_folder can be a single folder or a list with one folder per image.
+
+        Returns:
+            list: Run manifest fields of each image ({"detections": count}).
+        """
+
+        if output_folder is None or isinstance(output_folder, str):
+            output_folders = [output_folder]*len(filepaths)
+        else:
+            output_folders = output_folder
+
+        inputs = [self.read_input(filepath) for filepath in filepaths]
+        outputs = self.predict([np_image for np_image, _, _, _ in inputs], band_first=True)
+
+        for filepath, folder, (np_image, extent, epsg, _), image_outputs in zip(filepaths, output_folders, inputs, outputs):
+            self.save_outputs(filepath, folder, np_image.shape, extent, epsg, image_outputs)
+
+        return [{"detections": len(image_outputs[1][0])} for image_outputs in outputs]
+
+    @PROFILER.timed("read")
+    def read_input(self, filepath):
+        """
+        Read a raster in a single pass: band-first pixels (bands, height, width), extent, EPSG code and nodata value.
+        """
+
+        # Check if file is a raster tif image
+        if not (filepath.lower().endswith('.tif') or filepath.lower().endswith('.tiff')):
+            # extent and epsg must be provided or set elsewhere for non-tif images
+            raise ValueError("EPSG code must be provided for non-tif images.")
+
+        with rio.open(filepath) as src:
+            np_image = src.read()
+            extent = src.bounds  # (left, bottom, right, top)
+            epsg = crs_to_epsg(src.crs, filepath)
+            nodata = src.nodata
+
+        print(epsg)
+
+        return np_image, extent, epsg, nodata
+
+    def save_outputs(self, filepath, output_folder, image_shape, extent, epsg, outputs):
+        """
+        Save the detections of an image, image_shape is the (bands, height, width) shape of the array returned by read_input.
+        """
+
         # Get basename without extension
         basename = os.path.splitext(os.path.basename(filepath))[0]
         if output_folder is None:
@@ -931,43 +2226,10 @@ class ForagesROIsDetector():
             output_folder = os.path.dirname(filepath)
 
         os.makedirs(output_folder, exist_ok=True)
-        
-        np_image = cv.imread(filepath)
-        np_image = cv.cvtColor(np_image, cv.COLOR_BGR2RGB)
 
-        is_raster = False
+        is_raster = extent is not None
 
-        # Check if file is a raster tif image
-        extent = None
-        epsg = None
-        if filepath.lower().endswith('.tif') or filepath.lower().endswith('.tiff'):
-            is_raster = True
-            with rio.open(filepath) as src:
-                bounds = src.bounds
-                extent = bounds  # (left, bottom, right, top)
-                crs = src.crs
-                if crs:
-                    if crs.is_epsg_code:
-                        epsg = crs.to_string().replace("EPSG:EPSG:", "EPSG:")
-                    elif crs.to_epsg() is not None:
-                        epsg = f"EPSG:{crs.to_epsg()}"
-                        epsg = crs.to_string().replace("EPSG:EPSG:", "EPSG:")
-                    else:
-                        raise ValueError(f"Could not determine EPSG code for file: {filepath}")
-                else:
-                    raise ValueError(f"No CRS found in raster file: {filepath}")
-        else:
-            # extent and epsg must be provided or set elsewhere for non-tif images
-            raise ValueError("EPSG code must be provided for non-tif images.")
-        
-        epsg = crs.to_string().replace("EPSG:EPSG:", "EPSG:")
-        epsg = crs.to_string().replace("EPSG:", "")
-        print(epsg)
-
-        img_prec, scale, (h0, w0) = preprocess(np_image)
-        outputs = self.ort_sess.run(None, {'images':img_prec})
-        outputs = postprocess_yolo_output(outputs, conf_threshold=0.26, nms_threshold=0.2, orig_shape=(1024,1024))
-        boxes_df = outputs_to_df(outputs)
+        detections = outputs_to_detections(outputs)
 
         if is_raster:
 
@@ -975,10 +2237,10 @@ class ForagesROIsDetector():
 
             print("Saving shapefile to", shp_bbox)
 
-            save_shapefile_bb(boxes_df,
+            save_shapefile_bb(detections,
                                 extent,
-                                np_image.shape[1],
-                                np_image.shape[0],
+                                image_shape[2],
+                                image_shape[1],
                                 epsg,
                                 allow_cols=["score","class"]
                                 , output_filename=shp_bbox
@@ -992,8 +2254,8 @@ class ForagesROIsDetector():
             csv_filename = os.path.join(output_folder, basename + "_boxes.csv")
 
             print("Saving csv file to", csv_filename)
-            # Save dataframe boxes_df
-            boxes_df.to_csv(csv_filename, index=False)
+            # The DataFrame is only created to write the csv
+            outputs_to_df(outputs).to_csv(csv_filename, index=False)
 
     def batch_processing(self, folder, output_folder, format="tif"
                         , progress_callback=None
@@ -1004,47 +2266,192 @@ class ForagesROIsDetector():
 
         def processFunction(filepath, output_files):
 
-            if os.path.exists(output_files[0]):
-                print(f"File already exists {output_files[0]}")
-            else:
-                print(output_files[0])
-                output_dir = os.path.dirname(output_files[0])
+            # Completed files are skipped by BatchProcessor with the run manifest
+            print(output_files[0])
+            output_dir = os.path.dirname(output_files[0])
 
-                self.inference(filepath, output_dir)
+            return self.inference(filepath, output_dir)
                 # results = self.inference_file(filepath)
 
                 # for index, result in enumerate(results):
                 #     cv.imwrite(output_files[index], result)
                 #     print(f"File saved {output_files[index]}")                
 
+        def batchProcessFunction(filepaths, output_files_list):
+
+            # Files in a batch may be saved in different subfolders
+            output_dirs = [os.path.dirname(output_files[0]) for output_files in output_files_list]
+            return self.inference_batch(filepaths, output_dirs)
+
+        def pipelineProcessFunction(filepaths, output_files_list, file_done):
+
+            def read(index):
+                start = time.perf_counter()
+                np_image, extent, epsg, _ = self.read_input(filepaths[index])
+                return np_image, (np_image.shape, extent, epsg, start)
+
+            def write(index, context, outputs):
+                shape, extent, epsg, start = context
+                output_files = output_files_list[index]
+                self.save_outputs(filepaths[index], os.path.dirname(output_files[0]), shape, extent, epsg, outputs)
+                # Time from the start of the read to the saved outputs (stages overlap between files)
+                file_done(filepaths[index], output_files, {"detections": len(outputs[1][0])}, time.perf_counter() - start)
+
+            self.run_pipeline(range(len(filepaths)), read, write, interruption_check=interruption_check)
+
+        def shardedProcessFunction(filepaths, output_files_list, file_done):
+
+            self.sharded_processing(filepaths, output_files_list, file_done, interruption_check=interruption_check)
+
+        if self.workers > 1:
+            pipeline_fc = shardedProcessFunction
+        elif self.pipeline:
+            pipeline_fc = pipelineProcessFunction
+        else:
+            pipeline_fc = None
+
         processor.batch_process(input_dir=folder
                                 , output_dir=output_folder
                                 , processing_fc=processFunction
+                                , batch_processing_fc=batchProcessFunction if self.batch_size > 1 else None
+                                , batch_size=self.batch_size
+                                , pipeline_fc=pipeline_fc
                                 , pattern = '**/*.' + format
                                 , output_suffixes = ["boxes"]
                                 , output_format="shp"
                                 , format=format
                                 , progress_callback=progress_callback
                                 , interruption_check=interruption_check
+                                , run_params=self.run_signature()
                                 )
 
-    def tile_inference(self, input_filepath, output_filepath, only=False):
+    def run_signature(self):
+        """
+        Model, preprocessing and decode parameters of the outputs, a run manifest saved with other values is not reused.
+        """
+        return dict(self.cache_signature(True)
+                    , conf_threshold=self.conf_threshold
+                    , nms_threshold=self.nms_threshold
+                    , max_detections=self.max_detections
+                    , model=model_hash(self.get_model_filepath()))
+
+    def sharded_processing(self, filepaths, output_files_list, file_done, interruption_check=None):
+        """
+        Split the files across worker processes (self.workers), each one with its own model session.
+
+        Unless intra_op_threads is set, the cores are divided between the workers so the total number
+        of ORT threads matches the machine. file_done(filepath, output_files, fields, seconds) is called in this process
+        as the workers save each file, and interruption_check is polled here and forwarded to the workers,
+        which stop after their current batch.
+        """
+
+        workers = min(self.workers, len(filepaths))
+
+        session_options = dict(self.session_options)
+        if session_options.get("intra_op_threads") is None:
+            session_options["intra_op_threads"] = max(1, (os.cpu_count() or 1) // workers)
+
+        detector_kwargs = {"batch_size": self.batch_size
+                           , "providers": self.providers
+                           , "session_options": session_options
+                           , "quantized": self.quantized
+                           , "max_detections": self.max_detections
+                           , "io_binding": self.io_binding
+                           , "dynamic_shapes": self.dynamic_shapes
+                           , "result_cache_dir": self.result_cache_dir
+                           , "result_cache_max_mb": self.result_cache_max_mb
+                           , "conf_threshold": self.conf_threshold
+                           , "nms_threshold": self.nms_threshold}
+
+        print(f"Processing {len(filepaths)} files with {workers} workers, {session_options['intra_op_threads']} threads each")
+
+        # spawn behaves the same on Windows (frozen exe) and Linux, and avoids forking ORT threads
+        context = multiprocessing.get_context("spawn")
+        messages = context.Queue()
+        stop_event = context.Event()
+
+        processes = []
+        for worker_id in range(workers):
+            indices = list(range(worker_id, len(filepaths), workers))
+            process = context.Process(target=sharded_processing_worker
+                                      , args=(worker_id
+                                              , [filepaths[i] for i in indices]
+                                              , [output_files_list[i] for i in indices]
+                                              , detector_kwargs
+                                              , messages
+                                              , stop_event)
+                                      , daemon=True)
+            process.start()
+            processes.append(process)
+
+        running = workers
+        errors = []
+        exited = False
+        while running > 0:
+
+            if interruption_check and interruption_check() and not stop_event.is_set():
+                print("Interruption requested, stopping workers.")
+                stop_event.set()
+
+            try:
+                message = messages.get(timeout=0.2)
+            except queue.Empty:
+                if exited:
+                    errors.append("Worker processes exited unexpectedly")
+                    break
+                # Read the last messages once more before giving up on dead workers
+                exited = not any(process.is_alive() for process in processes)
+                continue
 
-        # Get basename without extension
-        basename = os.path.splitext(os.path.basename(output_filepath))[0]
+            kind = message[0]
+            if kind == "saved":
+                _, filepath, output_files, fields, seconds = message
+                file_done(filepath, output_files, fields, seconds)
+            elif kind == "error":
+                errors.append(message[1])
+                stop_event.set()
+            elif kind == "finished":
+                running -= 1
 
-        # Set output folder as filepath dir
-        output_folder = os.path.dirname(output_filepath)
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        #output_folder = os.path.join(output_folder, f"{basename}_{timestamp}")
-        output_folder = os.path.join(output_folder, f"{basename}_foragesrois_temp")
-        images_dir = os.path.join(output_folder, "tiles")
-        shp_dir = os.path.join(output_folder, "shp")
-        
+        for process in processes:
+            process.join()
 
-        os.makedirs(output_folder, exist_ok=True)
-        os.makedirs(images_dir, exist_ok=True)
-        os.makedirs(shp_dir, exist_ok=True)
+        if errors:
+            raise RuntimeError("Sharded processing failed:\n" + "\n".join(errors))
+
+    def tile_inference(self, input_filepath, output_filepath, only=False, keep_tiles=False, min_valid_fraction=0.0
+                       , prescreen=False, prescreen_threshold=None, candidates_filepath=None, checkpoint=True
+                       , progress_callback=None, interruption_check=None):
+        """
+        Detect plots over a large raster split in overlapping tiles and save the merged detections.
+
+        By default the tiles are read as arrays from the source raster and the detections are
+        accumulated in memory, only the merged layer is written. With keep_tiles=True every tile
+        and its detections are saved in a temp folder next to the output (useful for debugging).
+
+        Tiles whose fraction of valid pixels (nodata, alpha band or mask) is <= min_valid_fraction are
+        not read nor processed, by default only fully empty tiles; a negative value keeps every tile.
+
+        With prescreen=True the tiles without vegetation in a low resolution overview are also skipped
+        (TILER.prescreen_tiles), prescreen_threshold is the Excess Green threshold (Otsu when None).
+
+        With candidates_filepath the raw candidates of every tile (candidate_threshold, before NMS)
+        are saved to that file, see rethreshold.
+
+        With checkpoint=True the status of every tile is recorded in <output>_manifest.json and the
+        detections of the completed tiles in <output>_foragesrois_checkpoint, so running again after
+        an interruption or a crash only processes the remaining tiles (see open_checkpoint).
+
+        progress_callback receives the progress events of each phase (grid, extract_tiles, inference,
+        merge, postprocessing) with counts, throughput and ETA, see ProgressReporter. When
+        interruption_check returns True the remaining tiles are not processed and no output is saved
+        (the checkpoint keeps the completed tiles).
+        """
+
+        phases = {phase: weight for phase, weight in TILE_INFERENCE_PHASES.items()
+                  if not (phase == "extract_tiles" and not keep_tiles) and not (phase == "postprocessing" and only)}
+        progress = ProgressReporter(progress_callback, phases)
+        progress.start("grid", status="Creating the tile grid")
 
         # tiling
         converter = TILER(input_filepath
@@ -1059,8 +2466,6 @@ class ForagesROIsDetector():
                 , crs = "4326"
                 )
         
-        converter.path_images = images_dir
-        
         metadata = check_raster(input_filepath)
 
 
@@ -1082,47 +2487,379 @@ class ForagesROIsDetector():
         print("rows", rows)
         print("overlap", overlap)
 
-        # Create a vector grid for each tile
-        converter.create_grid(rows, overlap, overlap)
+        with PROFILER.stage("tiling"):
+            # Create a vector grid for each tile
+            converter.create_grid(rows, overlap, overlap)
 
-        # Extract tiles and save
-        converter.extract_tiles()
+            if min_valid_fraction is not None and min_valid_fraction >= 0:
+                converter.skip_empty_tiles(min_valid_fraction)
 
+            if prescreen:
+                converter.prescreen_tiles(exg_threshold=prescreen_threshold)
 
-        # Process each tile
-        self.batch_processing(images_dir,shp_dir)
+        progress.finish(status=f"{len(converter.grid)} tiles to process")
 
-        # Merge all shapefiles in shp_dir and save
-        # Find all shapefiles in shp_dir
-        shp_files = glob.glob(os.path.join(shp_dir, "*.shp"))
-        print(f"Merging {len(shp_files)} files")
+        candidate_store = None
+        if candidates_filepath is not None:
+            if keep_tiles:
+                print("Raw candidates are not saved with keep_tiles")
+            else:
+                epsg = crs_to_epsg(converter.raster.crs, converter.path_raster)
+                candidate_store = CandidateStore({"input_file": os.path.abspath(input_filepath)
+                                                  , "epsg": epsg
+                                                  , "only": only
+                                                  , "model_file": self.get_model_filepath()
+                                                  , "candidate_threshold": self.raw_conf_threshold()
+                                                  , "conf_threshold": self.conf_threshold
+                                                  , "nms_threshold": self.nms_threshold
+                                                  , "max_detections": self.max_detections
+                                                  , "created": datetime.datetime.now().isoformat(timespec="seconds")})
+
+        tile_checkpoint = None
+        if checkpoint and not keep_tiles:
+            tile_checkpoint = self.open_checkpoint(input_filepath, output_filepath
+                                                   , {"rows": rows, "overlap": overlap
+                                                      , "candidate_threshold": self.raw_conf_threshold() if candidate_store is not None else None})
+
+        if keep_tiles:
+            # Per tile shapefiles, resumed by the run manifest of batch_processing
+            gdfs = self.tile_inference_on_disk(converter, output_filepath, progress, interruption_check)
+        else:
+            try:
+                gdfs = self.tile_inference_in_memory(converter, candidate_store, tile_checkpoint, progress, interruption_check)
+            except BaseException as e:
+                if tile_checkpoint is not None:
+                    tile_checkpoint.manifest.metadata["error"] = str(e) or type(e).__name__
+                    tile_checkpoint.close("failed")
+                raise
+
+        if interruption_check and interruption_check():
+            if tile_checkpoint is not None:
+                tile_checkpoint.close("interrupted")
+                print(f"Run manifest {tile_checkpoint.manifest.filepath}: {tile_checkpoint.manifest.format_counts()}")
+            print(f"Tile inference interrupted, {output_filepath} was not saved")
+            return
+
+        if self.result_cache is not None:
+            print(self.result_cache.summary())
+
+        if candidate_store is not None:
+            with PROFILER.stage("write"):
+                candidate_store.save(candidates_filepath)
+
+        self.save_merged_detections(gdfs, output_filepath, only=only, input_filepath=input_filepath, progress=progress)
+
+        if tile_checkpoint is not None:
+            tile_checkpoint.close("completed")
+            print(f"Run manifest {tile_checkpoint.manifest.filepath}: {tile_checkpoint.manifest.format_counts()}")
+
+        progress.complete()
+
+    def open_checkpoint(self, input_filepath, output_filepath, grid_params):
+        """
+        Checkpoint of a tile_inference run: <output>_manifest.json and the <output>_foragesrois_checkpoint
+        folder next to the output. Its tiles are reused only if the input raster, the model, the decode
+        parameters and the grid did not change.
+        """
 
-        if shp_files:
-            gdfs = [] #= [gpd.read_file(os.path.normpath(shp)) for shp in shp_files]
-            for shp in shp_files:
-                gdf = gpd.read_file(os.path.normpath(shp))
-                if not gdf.empty:
-                    gdfs.append(gdf)
+        basename = os.path.splitext(os.path.basename(output_filepath))[0]
+        output_folder = os.path.dirname(os.path.normpath(output_filepath))
+
+        run_hash = params_hash(file_signature(input_filepath), self.run_signature(), grid_params)
+
+        return TileCheckpoint(os.path.join(output_folder, f"{basename}_manifest.json")
+                              , os.path.join(output_folder, f"{basename}_foragesrois_checkpoint")
+                              , run_hash
+                              , metadata={"input_file": os.path.abspath(input_filepath)
+                                          , "output_file": os.path.abspath(output_filepath)
+                                          , "run_params": self.run_signature()
+                                          , "grid": grid_params})
+
+    def save_merged_detections(self, gdfs, output_filepath, only=False, input_filepath=None, progress=None):
+        """
+        Merge the detections of the tiles, label the plots (unless only) and save the layer.
+        The merge and postprocessing phases are reported to the optional progress (ProgressReporter).
+        """
 
-            print(f"Merging {len(gdfs)} files with detections")
+        progress = progress or ProgressReporter()
 
+        if gdfs:
 
-            merged_gdf = pd.concat(gdfs, ignore_index=True)
-            merged_gdf = gpd.GeoDataFrame(merged_gdf, geometry="geometry")
+            print(f"Merging {len(gdfs)} tiles with detections")
+            progress.start("merge", total=len(gdfs), status="Merging the tile detections")
 
+            with PROFILER.stage("merge"):
+                merged_gdf = pd.concat(gdfs, ignore_index=True)
+                merged_gdf = gpd.GeoDataFrame(merged_gdf, geometry="geometry")
+
+            progress.finish(status=f"Merged {len(merged_gdf)} detections")
 
             # Post process the merged shapefile
             if not only:
+                progress.start("postprocessing", total=len(merged_gdf), unit="detections", status="Numbering the plots")
                 gdf_labeled = label_polygons_from_shapefile(merged_gdf, serpentine=True, row_tol=1.0, min_ratio=1/1.8, max_ratio=1.8, iou_thresh=0.15, align_to_grid=False)
+                progress.finish(status=f"Numbered {len(gdf_labeled)} plots")
             else:
                 gdf_labeled = merged_gdf
 
 
             #merged_gdf.to_file(output_filepath, index=False)
             safe_path = os.path.normpath(output_filepath)
-            gdf_labeled.to_file(safe_path, index=False)
+            os.makedirs(os.path.dirname(safe_path) or ".", exist_ok=True)
+            with PROFILER.stage("write"):
+                gdf_labeled.to_file(safe_path, index=False)
         else:
-            print("No shapefiles found to merge in", shp_dir)
+            print("No detections found to merge for", input_filepath)
+
+    def tile_inference_in_memory(self, converter, candidate_store=None, checkpoint=None, progress=None, interruption_check=None):
+        """
+        Run the detection over the tiles of the converter grid without writing intermediate files.
+        The raw candidates of each tile are added to the optional candidate_store.
+
+        The inference phase is reported to the optional progress (ProgressReporter), and the
+        remaining tiles are not processed once interruption_check returns True.
+
+        With a checkpoint (TileCheckpoint), the tiles completed by a previous run with the same
+        parameters are loaded from it instead of running the model, and each new tile is saved to it.
+
+        Returns:
+            list: GeoDataFrames with the detections of each tile (tiles without detections are dropped).
+        """
+
+        progress = progress or ProgressReporter()
+        epsg = crs_to_epsg(converter.raster.crs, converter.path_raster)
+
+        tile_gdfs = {}
+        pending = []
+
+        def tile_key(tile_id):
+            # Grid ids and bounds do not change when other tiles are skipped (prescreen, nodata)
+            return str(converter.grid.index[tile_id]), params_hash(converter.grid.geometry.iloc[tile_id].bounds)
+
+        def tile_done(tile_id, tile_transform, shape, tile_outputs, candidates=None, seconds=None, resumed=False):
+            height, width = shape
+            if candidate_store is not None:
+                candidate_store.add(tile_id, tile_transform, shape, candidates)
+
+            if checkpoint is not None and not resumed:
+                arrays = {"boxes": tile_outputs[0][0], "classes": tile_outputs[1][0]
+                          , "transform": np.array(tuple(tile_transform)[:6]), "shape": np.array(shape)}
+                if candidates is not None:
+                    arrays.update({"candidate_boxes": candidates[0], "candidate_objectness": candidates[1]
+                                   , "candidate_class_scores": candidates[2]})
+                detections = len(tile_outputs[1][0])
+                checkpoint.save_tile(*tile_key(tile_id), arrays, status="done" if detections else "empty"
+                                     , detections=detections, seconds=None if seconds is None else round(seconds, 3))
+
+            extent = rio.coords.BoundingBox(*rio.transform.array_bounds(height, width, tile_transform))
+
+            gdf = save_shapefile_bb(outputs_to_detections(tile_outputs),
+                                    extent,
+                                    width,
+                                    height,
+                                    epsg,
+                                    allow_cols=["score","class"])
+            if not gdf.empty:
+                tile_gdfs[tile_id] = gdf
+
+            if not resumed:
+                progress.advance()
+
+        for tile_id in range(len(converter.grid)):
+            arrays = checkpoint.load_tile(*tile_key(tile_id)) if checkpoint is not None else None
+            if arrays is None:
+                pending.append(tile_id)
+                continue
+            candidates = None
+            if candidate_store is not None:
+                candidates = (arrays["candidate_boxes"], arrays["candidate_objectness"], arrays["candidate_class_scores"])
+            tile_done(tile_id, rio.transform.Affine(*arrays["transform"]), tuple(int(v) for v in arrays["shape"])
+                      , [[arrays["boxes"]], [arrays["classes"]]], candidates, resumed=True)
+
+        if checkpoint is not None and len(pending) < len(converter.grid):
+            print(f"Reusing {len(converter.grid) - len(pending)} tiles completed by a previous run, {len(pending)} tiles to process")
+
+        progress.start("inference", total=len(converter.grid), done=len(converter.grid) - len(pending), status="Detecting plots")
+
+        if self.pipeline:
+            if pending:
+                self.tile_inference_pipeline(converter, pending, tile_done, candidate_store is not None
+                                             , progress=progress, interruption_check=interruption_check)
+            if not (interruption_check and interruption_check()):
+                progress.finish()
+            return [tile_gdfs[tile_id] for tile_id in sorted(tile_gdfs)]
+
+        for start in range(0, len(pending), self.batch_size):
+
+            if interruption_check and interruption_check():
+                print("Interruption requested, stopping tile inference.")
+                break
+
+            batch_start = time.perf_counter()
+            batch_ids = pending[start:start+self.batch_size]
+            candidates = [] if candidate_store is not None else None
+            try:
+                tiles = [converter.read_tile(i) for i in batch_ids]
+                progress.add_bytes(sum(tile.nbytes for tile, _ in tiles))
+                outputs = self.predict([tile for tile, _ in tiles], band_first=True, candidates=candidates)
+            except Exception as e:
+                if checkpoint is not None:
+                    for tile_id in batch_ids:
+                        checkpoint.fail_tile(*tile_key(tile_id), str(e))
+                raise
+            seconds = (time.perf_counter() - batch_start)/len(batch_ids)
+
+            for index, ((tile, tile_transform), tile_outputs) in enumerate(zip(tiles, outputs)):
+                tile_done(batch_ids[index], tile_transform, tile.shape[1:], tile_outputs
+                          , candidates[index] if candidates is not None else None, seconds)
+
+        if not (interruption_check and interruption_check()):
+            progress.finish()
+
+        return [tile_gdfs[tile_id] for tile_id in sorted(tile_gdfs)]
+
+    def tile_inference_pipeline(self, converter, tile_ids, tile_done, with_candidates=False, progress=None, interruption_check=None):
+        """
+        Detection of the tile_ids of tile_inference_in_memory with the prefetch pipeline: tiles are
+        read in parallel (one raster handle per reader thread) while the model runs, and
+        tile_done(tile_id, transform, shape, outputs, candidates, seconds) is called by the writer.
+        The bytes read are counted in the optional progress (ProgressReporter).
+        """
+
+        progress = progress or ProgressReporter()
+
+        local = threading.local()
+        datasets = []
+        tile_candidates = {}
+
+        def read(tile_id):
+            start = time.perf_counter()
+            if not hasattr(local, "dataset"):
+                local.dataset = rio.open(converter.path_raster)
+                datasets.append(local.dataset)
+            tile, tile_transform = converter.read_tile(tile_id, dataset=local.dataset)
+            progress.add_bytes(tile.nbytes)
+            return tile, (tile.shape, tile_transform, start)
+
+        def write(tile_id, context, tile_outputs):
+            shape, tile_transform, start = context
+            # Time from the start of the read to the decoded detections (stages overlap between tiles)
+            tile_done(tile_id, tile_transform, shape[1:], tile_outputs, tile_candidates.pop(tile_id, None)
+                      , time.perf_counter() - start)
+
+        candidates_fc = None
+        if with_candidates:
+            def candidates_fc(tile_id, context, candidates):
+                tile_candidates[tile_id] = candidates
+
+        try:
+            self.run_pipeline(tile_ids, read, write, interruption_check=interruption_check, candidates_fc=candidates_fc)
+        finally:
+            for dataset in datasets:
+                dataset.close()
+
+    def tile_inference_on_disk(self, converter, output_filepath, progress=None, interruption_check=None):
+        """
+        Save every tile as GeoTIFF and its detections as shapefile in a temp folder, then read them back.
+        The extract_tiles and inference phases are reported to the optional progress (ProgressReporter).
+
+        Returns:
+            list: GeoDataFrames with the detections of each tile (tiles without detections are dropped).
+        """
+
+        # Get basename without extension
+        basename = os.path.splitext(os.path.basename(output_filepath))[0]
+
+        # Set output folder as filepath dir
+        output_folder = os.path.dirname(output_filepath)
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        #output_folder = os.path.join(output_folder, f"{basename}_{timestamp}")
+        output_folder = os.path.join(output_folder, f"{basename}_foragesrois_temp")
+        images_dir = os.path.join(output_folder, "tiles")
+        shp_dir = os.path.join(output_folder, "shp")
+        
+
+        os.makedirs(output_folder, exist_ok=True)
+        os.makedirs(images_dir, exist_ok=True)
+        os.makedirs(shp_dir, exist_ok=True)
+
+        converter.path_images = images_dir
+
+        progress = progress or ProgressReporter()
+
+        # Extract tiles and save
+        progress.start("extract_tiles", total=len(converter.grid), status="Extracting tiles")
+        with PROFILER.stage("extract_tiles"):
+            converter.extract_tiles(tile_done=lambda i, tile: progress.advance(nbytes=0 if tile is None else tile.nbytes))
+        progress.finish()
+
+        # Process each tile
+        progress.start("inference", total=len(converter.grid), status="Detecting plots")
+        self.batch_processing(images_dir,shp_dir
+                              , progress_callback=lambda event: progress.update(event["processed_count"], event["total_files"])
+                              , interruption_check=interruption_check)
+        if not (interruption_check and interruption_check()):
+            progress.finish()
+
+        # Merge all shapefiles in shp_dir and save
+        # Find all shapefiles in shp_dir
+        shp_files = glob.glob(os.path.join(shp_dir, "*.shp"))
+        print(f"Merging {len(shp_files)} files")
+
+        gdfs = [] #= [gpd.read_file(os.path.normpath(shp)) for shp in shp_files]
+        for shp in shp_files:
+            gdf = gpd.read_file(os.path.normpath(shp))
+            if not gdf.empty:
+                gdfs.append(gdf)
+
+        return gdfs
+
+    def rethreshold(self, candidates_filepath, output_filepath, only=None):
+        """
+        Select the detections again from the raw candidates saved by tile_inference, with the
+        conf_threshold, nms_threshold and max_detections of this detector, and merge and save them
+        like tile_inference. The model is not run.
+
+        Parameters:
+            candidates_filepath (str): Candidates file of a tile_inference run.
+            output_filepath (str): Output layer.
+            only (bool): Skip the plot labeling, by default the same as the saved run.
+        """
+
+        start = time.perf_counter()
+        store = CandidateStore.load(candidates_filepath)
+        metadata = store.metadata
+
+        candidate_threshold = metadata.get("candidate_threshold", 0)
+        if self.conf_threshold < candidate_threshold:
+            raise ValueError(f"conf_threshold {self.conf_threshold} is below the threshold of the saved candidates ({candidate_threshold}), "
+                             f"run the detection again with a lower candidate_threshold")
+
+        if only is None:
+            only = metadata.get("only", False)
+
+        print(f"Rethresholding {len(store)} candidates of {len(store.tiles)} tiles from {candidates_filepath}"
+              f" (conf {self.conf_threshold}, nms {self.nms_threshold}, max detections {self.max_detections})")
+
+        epsg = metadata.get("epsg")
+        gdfs = []
+        for tile_id in sorted(store.tiles):
+            tile_transform, (height, width), candidates = store.tiles[tile_id]
+            tile_outputs = self.select(candidates)
+
+            extent = rio.coords.BoundingBox(*rio.transform.array_bounds(height, width, rio.transform.Affine(*tile_transform)))
+            gdf = save_shapefile_bb(outputs_to_detections(tile_outputs),
+                                    extent,
+                                    width,
+                                    height,
+                                    epsg,
+                                    allow_cols=["score","class"])
+            if not gdf.empty:
+                gdfs.append(gdf)
+
+        print(f"Selected detections in {time.perf_counter() - start:.2f} s")
+
+        self.save_merged_detections(gdfs, output_filepath, only=only, input_filepath=metadata.get("input_file"))
 
     def plot_numbering(self, input_filepath, output_filepath, serpentine=True, align_to_grid=False,only_postprocess=False):
 
@@ -1134,7 +2871,31 @@ class ForagesROIsDetector():
         # Post process the merged shapefile
         gdf_labeled = label_polygons_from_shapefile(merged_gdf, serpentine=serpentine, row_tol=1.0, min_ratio=1/1.8, max_ratio=1.8, iou_thresh=0.15, align_to_grid=align_to_grid, only_postprocess=only_postprocess)
 
-        gdf_labeled.to_file(safe_input_output_filepath, index=False)
-
-
+        with PROFILER.stage("write"):
+            gdf_labeled.to_file(safe_input_output_filepath, index=False)
 
+def sharded_processing_worker(worker_id, filepaths, output_files_list, detector_kwargs, messages, stop_event):
+    """
+    Worker process of ForagesROIsDetector.sharded_processing: detect the files of one shard and
+    report ("saved", filepath, output_files, fields, seconds), ("error", traceback) and ("finished", worker_id),
+    seconds is the time of the batch of the file divided by its number of files.
+    """
+    try:
+        detector = ForagesROIsDetector(**detector_kwargs)
+
+        for start in range(0, len(filepaths), detector.batch_size):
+            if stop_event.is_set():
+                break
+
+            batch_start = time.perf_counter()
+            batch = filepaths[start:start+detector.batch_size]
+            batch_outputs = output_files_list[start:start+detector.batch_size]
+            batch_fields = detector.inference_batch(batch, [os.path.dirname(output_files[0]) for output_files in batch_outputs])
+            seconds = (time.perf_counter() - batch_start)/len(batch)
+
+            for filepath, output_files, fields in zip(batch, batch_outputs, batch_fields):
+                messages.put(("saved", filepath, output_files, fields, seconds))
+    except Exception:
+        messages.put(("error", f"Worker {worker_id}: {traceback.format_exc()}"))
+    finally:
+        messages.put(("finished", worker_id))
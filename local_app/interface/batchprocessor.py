@@ -1,7 +1,10 @@
 import os
+import time
 import pathlib
 import glob
 
+from interface.manifest import RunManifest, MANIFEST_FILENAME, params_hash
+
 class BatchProcessor():
 
     def __init__(self):
@@ -15,7 +18,25 @@ class BatchProcessor():
                       , output_format = None
                       , progress_callback=None
                       , interruption_check=None
+                      , batch_processing_fc=None
+                      , batch_size=1
+                      , pipeline_fc=None
+                      , run_params=None
                       ):
+        """
+        Process the files of input_dir matching format into output_dir, keeping the subfolders.
+
+        The status of each file is recorded in a run manifest (MANIFEST_FILENAME in output_dir), a file
+        is skipped only if the manifest marks it as done with the same run_params and the same input
+        file, and its first output exists. Interrupted or failed runs are resumed by running again, and
+        outputs of runs with other run_params are overwritten.
+
+        processing_fc(filepath, output_filepaths) and batch_processing_fc(filepaths, output_filepaths_list)
+        may return a dict (a list of dicts for batches) of fields saved in the manifest, e.g. the number
+        of detections. pipeline_fc(filepaths, output_filepaths_list, file_done) calls
+        file_done(filepath, output_filepaths, fields=None, seconds=None) for each saved file, with the
+        seconds spent on the file if it measures them (otherwise the time since the previous file).
+        """
 
         if processing_fc == None:
             print("Processing function is None")
@@ -33,6 +54,68 @@ class BatchProcessor():
             total_files = len(files)
             processed_count = 0
 
+            manifest = RunManifest(os.path.join(output_dir, MANIFEST_FILENAME)
+                                   , params_hash(run_params, output_suffixes, output_format, format)
+                                   , metadata={"input_dir": os.path.abspath(input_dir), "run_params": run_params})
+
+            # Input hash of each file to process
+            file_hashes = {}
+
+            def input_hash(file):
+                stat = os.stat(os.path.join(input_dir, file))
+                return params_hash(file, stat.st_size, stat.st_mtime_ns)
+
+            def mark_done(filepath, output_filepaths, fields, seconds):
+                file = os.path.relpath(filepath, input_dir)
+                fields = dict(fields or {})
+                status = "empty" if fields.get("detections") == 0 else "done"
+                manifest.update(file, status, file_hashes.get(file)
+                                , outputs=[os.path.relpath(output, output_dir) for output in output_filepaths]
+                                , seconds=round(seconds, 3), **fields)
+
+            def file_processed(output_filepaths, status="Processing"):
+                # Count a processed (or skipped) file and report the progress
+                nonlocal processed_count
+                processed_count += 1
+                if output_filepaths is not None:
+                    logs.append(f"Saved {output_filepaths[0]}")
+                if progress_callback:
+                    progress_callback({"processed_count":processed_count
+                                       , "total_files":total_files
+                                       , "status":status
+                                       , "logs": logs
+                                       , "percent": processed_count/total_files*100
+                                       })
+
+            def mark_failed(filepaths, error):
+                for filepath in filepaths:
+                    file = os.path.relpath(filepath, input_dir)
+                    manifest.update(file, "failed", file_hashes.get(file), error=error)
+                manifest.close("failed")
+
+            # Files waiting to be processed together by batch_processing_fc
+            pending_files = []
+            pending_outputs = []
+
+            # Files processed all together by pipeline_fc(files, outputs, file_done)
+            pipeline_files = []
+            pipeline_outputs = []
+
+            def process_pending():
+                if pending_files:
+                    start = time.perf_counter()
+                    try:
+                        batch_fields = batch_processing_fc(list(pending_files), list(pending_outputs)) # Process and save files
+                    except Exception as e:
+                        mark_failed(pending_files, str(e))
+                        raise
+                    seconds = (time.perf_counter() - start)/len(pending_files)
+                    for index, (file, output_filepaths) in enumerate(zip(pending_files, pending_outputs)):
+                        mark_done(file, output_filepaths, batch_fields[index] if batch_fields else None, seconds)
+                        file_processed(output_filepaths)
+                    pending_files.clear()
+                    pending_outputs.clear()
+
             # Emit initial progress if needed
             if progress_callback:
                 progress_callback({"processed_count":processed_count
@@ -42,11 +125,14 @@ class BatchProcessor():
                                     , "percent": processed_count/total_files*100
                                     })
 
+            interrupted = False
+
             for file in files:
 
                 # Check for interruption request before processing each file
                 if interruption_check and interruption_check():
                     print("Interruption requested, stopping batch process.")
+                    interrupted = True
                     break # Exit the loop
 
                 filepath = os.path.join(input_dir, file)
@@ -59,28 +145,75 @@ class BatchProcessor():
                 for suffix in output_suffixes:
                     output_filepaths.append(os.path.join(output_sub_dir, basename.replace("." + format, "_" + suffix + "." + output_format)))
 
-                if not os.path.exists(output_filepaths[0]):  # Process only if first output file does not exist
+                file_hashes[file] = input_hash(file)
+
+                # Process unless the manifest marks the file as done and the first output file exists
+                if not (manifest.is_done(file, file_hashes[file]) and os.path.exists(output_filepaths[0])):
 
                     if not os.path.exists(output_sub_dir):  # Create subfolders if necessary
                         pathlib.Path(output_sub_dir).mkdir(parents=True, exist_ok=True)
 
                     logs.append(f"Processing {file}")
-                    
-                    processing_fc(filepath, output_filepaths) # Process and save file
+
+                    if pipeline_fc is not None:
+                        pipeline_files.append(filepath)
+                        pipeline_outputs.append(output_filepaths)
+                        continue # Counted when the pipeline saves it
+
+                    if batch_processing_fc is not None and batch_size > 1:
+                        pending_files.append(filepath)
+                        pending_outputs.append(output_filepaths)
+                        if len(pending_files) >= batch_size:
+                            process_pending()
+                        continue # Counted when its batch is saved
+
+                    start = time.perf_counter()
+                    try:
+                        fields = processing_fc(filepath, output_filepaths) # Process and save file
+                    except Exception as e:
+                        mark_failed([filepath], str(e))
+                        raise
+                    mark_done(filepath, output_filepaths, fields, time.perf_counter() - start)
 
                     print(file)
                     print(output_filepaths[0])
                     print("****")
-                    logs.append(f"Saved {output_filepaths[0]}")
-
-                processed_count += 1
-                # Emit progress after attempting to process (or skip) each file
-                if progress_callback:
-                    progress_callback({"processed_count":processed_count
-                                       , "total_files":total_files
-                                       , "status":"Processing"
-                                       , "logs": logs
-                                       , "percent": processed_count/total_files*100
-                                       })
+                    file_processed(output_filepaths)
+                else:
+                    # Emit progress after skipping a completed file
+                    file_processed(None)
+
+            if interrupted:
+                # Queued files are left for the next run, the manifest does not mark them as done
+                if pending_files or pipeline_files:
+                    print(f"Skipping {len(pending_files) + len(pipeline_files)} queued files")
+            elif batch_processing_fc is not None:
+                # Process the last incomplete batch
+                process_pending()
+
+            if pipeline_fc is not None and pipeline_files and not interrupted:
+
+                last_done = [time.perf_counter()]
+
+                def file_done(filepath, output_filepaths, fields=None, seconds=None):
+                    # Without a measured time, the time since the previous file saved by the pipeline
+                    now = time.perf_counter()
+                    if seconds is None:
+                        seconds = now - last_done[0]
+                    last_done[0] = now
+                    mark_done(filepath, output_filepaths, fields, seconds)
+                    file_processed(output_filepaths)
+
+                try:
+                    pipeline_fc(pipeline_files, pipeline_outputs, file_done)
+                except Exception as e:
+                    mark_failed([filepath for filepath in pipeline_files
+                                 if not manifest.is_done(os.path.relpath(filepath, input_dir)
+                                                         , file_hashes[os.path.relpath(filepath, input_dir)])], str(e))
+                    raise
+
+            interrupted = interrupted or bool(interruption_check and interruption_check())
+            manifest.close("interrupted" if interrupted else "completed")
+            print(f"Run manifest {manifest.filepath}: {manifest.format_counts()}")
 
             print(f"Batch process loop finished. Processed {processed_count}/{total_files} files.")
\ No newline at end of file
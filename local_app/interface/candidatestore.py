@@ -0,0 +1,107 @@
+import os
+import json
+import threading
+
+import numpy as np
+
+# Confidence threshold of the raw candidates saved by a run, rethreshold accepts any higher threshold
+DEFAULT_CANDIDATE_THRESHOLD = 0.05
+
+# Version of the candidates file layout
+CANDIDATES_FORMAT_VERSION = 1
+
+def default_candidates_filepath(output_filepath):
+    """
+    Candidates file saved next to the output layer of a run: <output>_candidates.npz
+    """
+    return os.path.splitext(os.path.normpath(output_filepath))[0] + "_candidates.npz"
+
+class CandidateStore():
+    """
+    Raw detection candidates of a tiled run, decoded with a low confidence threshold and before NMS,
+    so the detections can be selected again with other thresholds without running the model.
+
+    The file is a compressed .npz with one array per column:
+        tile_id (N,), boxes (N, 4) in tile pixels xyxy, objectness (N,), class_scores (N, C)
+    the tiles table:
+        tile_ids (T,), tile_transforms (T, 6) affine coefficients, tile_shapes (T, 2) height and width
+    and a JSON metadata string (input raster, EPSG, model, thresholds of the run).
+    """
+
+    def __init__(self, metadata=None):
+        self.metadata = dict(metadata or {})
+        self.tiles = {}
+        self.lock = threading.Lock()
+
+    def add(self, tile_id, transform, shape, candidates):
+        """
+        Add the candidates of a tile.
+
+        Parameters:
+            tile_id (int): Tile index in the grid.
+            transform (Affine): Geotransform of the tile.
+            shape (tuple): Tile (height, width).
+            candidates (tuple): boxes (N, 4), objectness (N,) and class_scores (N, C) of decode_yolo_candidates.
+        """
+        with self.lock:
+            self.tiles[int(tile_id)] = (tuple(transform)[:6], tuple(shape), candidates)
+
+    def save(self, filepath):
+
+        tile_ids = sorted(self.tiles)
+        num_classes = max([self.tiles[i][2][2].shape[1] for i in tile_ids], default=0)
+
+        columns = {"tile_id": [], "boxes": [], "objectness": [], "class_scores": []}
+        for tile_id in tile_ids:
+            boxes, objectness, class_scores = self.tiles[tile_id][2]
+            columns["tile_id"].append(np.full(len(boxes), tile_id, dtype=np.int32))
+            columns["boxes"].append(np.asarray(boxes, dtype=np.float32).reshape(-1, 4))
+            columns["objectness"].append(np.asarray(objectness, dtype=np.float32))
+            columns["class_scores"].append(np.asarray(class_scores, dtype=np.float32).reshape(-1, num_classes))
+
+        empty = {"tile_id": np.zeros((0,), dtype=np.int32), "boxes": np.zeros((0, 4), dtype=np.float32)
+                 , "objectness": np.zeros((0,), dtype=np.float32), "class_scores": np.zeros((0, num_classes), dtype=np.float32)}
+        arrays = {name: np.concatenate(values) if values else empty[name] for name, values in columns.items()}
+
+        arrays["tile_ids"] = np.array(tile_ids, dtype=np.int32)
+        arrays["tile_transforms"] = np.array([self.tiles[i][0] for i in tile_ids], dtype=np.float64).reshape(-1, 6)
+        arrays["tile_shapes"] = np.array([self.tiles[i][1] for i in tile_ids], dtype=np.int32).reshape(-1, 2)
+
+        metadata = dict(self.metadata, format_version=CANDIDATES_FORMAT_VERSION)
+        arrays["metadata"] = np.array(json.dumps(metadata, default=str))
+
+        os.makedirs(os.path.dirname(os.path.abspath(filepath)), exist_ok=True)
+        tmp_filepath = filepath + ".tmp"
+        with open(tmp_filepath, "wb") as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp_filepath, filepath)
+
+        print(f"Saved {len(arrays['tile_id'])} candidates of {len(tile_ids)} tiles to {filepath}")
+
+    @classmethod
+    def load(cls, filepath):
+
+        store = cls()
+        with np.load(filepath) as data:
+            store.metadata = json.loads(str(data["metadata"]))
+            if store.metadata.get("format_version") != CANDIDATES_FORMAT_VERSION:
+                raise ValueError(f"Unsupported candidates file version: {store.metadata.get('format_version')} in {filepath}")
+
+            tile_id = data["tile_id"]
+            boxes = data["boxes"]
+            objectness = data["objectness"]
+            class_scores = data["class_scores"]
+
+            # Candidates are saved sorted by tile, each tile is a contiguous slice
+            tile_ids = data["tile_ids"]
+            starts = np.searchsorted(tile_id, tile_ids, side="left")
+            ends = np.searchsorted(tile_id, tile_ids, side="right")
+
+            for i, start, end, transform, shape in zip(tile_ids, starts, ends, data["tile_transforms"], data["tile_shapes"]):
+                store.tiles[int(i)] = (tuple(transform), tuple(int(v) for v in shape)
+                                       , (boxes[start:end], objectness[start:end], class_scores[start:end]))
+
+        return store
+
+    def __len__(self):
+        return sum(len(candidates[0]) for _, _, candidates in self.tiles.values())
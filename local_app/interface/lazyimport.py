@@ -0,0 +1,28 @@
+import importlib
+import threading
+
+class LazyModule():
+    """
+    Module imported on first attribute access, so tasks that never use it do not pay its import time.
+
+    Usage: cv = LazyModule("cv2"), then cv.resize(...) imports cv2 on the first call.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module '{self._name}' ({state})>"
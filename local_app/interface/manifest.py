@@ -0,0 +1,193 @@
+import os
+import json
+import time
+import hashlib
+import datetime
+import threading
+from collections import Counter
+
+import numpy as np
+
+# Manifest of BatchProcessor runs, saved in the output folder
+MANIFEST_FILENAME = "foragesrois_manifest.json"
+
+# Version of the manifest layout, manifests of other versions are not reused
+MANIFEST_VERSION = 1
+
+# Minimum seconds between two writes of the manifest file (every update is written by close)
+MANIFEST_FLUSH_SECONDS = 2.0
+
+# Item statuses reused by a resumed run, the others (failed, missing) are processed again
+DONE_STATUSES = ("done", "empty")
+
+def params_hash(*values):
+    """
+    Hash of JSON serializable values (parameters of a run or of an item).
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps(values, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+def file_signature(filepath):
+    """
+    Path, size and modification time of a file, changes when the file is replaced or edited.
+    """
+    stat = os.stat(filepath)
+    return [os.path.abspath(filepath), stat.st_size, stat.st_mtime_ns]
+
+def write_json_atomic(filepath, data):
+    """
+    Write a JSON file through a temp file and a rename, so readers never see a partial file.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(filepath)), exist_ok=True)
+    tmp_filepath = f"{filepath}.{os.getpid()}.tmp"
+    with open(tmp_filepath, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=1, default=str)
+    os.replace(tmp_filepath, filepath)
+
+class RunManifest():
+    """
+    Status of each item (file or tile) of a run, written atomically as the items are processed
+    so an interrupted run can be resumed.
+
+    Each item records its status (done, empty, failed), the hash of its input and parameters,
+    timings and fields like the number of detections. A manifest written with other run parameters
+    (run_hash) is discarded, and an item is only reused if its own hash did not change.
+    """
+
+    def __init__(self, filepath, run_hash, metadata=None):
+
+        self.filepath = filepath
+        self.run_hash = run_hash
+        self.metadata = dict(metadata or {})
+
+        self.items = {}
+        self.status = "running"
+        self.created = datetime.datetime.now().isoformat(timespec="seconds")
+
+        self.lock = threading.Lock()
+        self.last_flush = 0.0
+
+        self.load()
+
+    def load(self):
+
+        if not os.path.exists(self.filepath):
+            return
+
+        try:
+            with open(self.filepath, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable manifest {self.filepath}: {e}")
+            return
+
+        if data.get("version") != MANIFEST_VERSION or data.get("run_hash") != self.run_hash:
+            print(f"Parameters changed since the run of {self.filepath}, its results are not reused")
+            return
+
+        self.items = data.get("items", {})
+        self.created = data.get("created", self.created)
+
+        print(f"Resuming run of {self.filepath}: {self.format_counts()}")
+
+    def is_done(self, key, item_hash=None):
+        """
+        True if the item was completed by this or a previous run with the same item hash.
+        """
+        item = self.items.get(str(key))
+        return item is not None and item.get("status") in DONE_STATUSES and item.get("hash") == item_hash
+
+    def get(self, key):
+        return self.items.get(str(key))
+
+    def update(self, key, status, item_hash=None, **fields):
+        """
+        Record the status of an item, the manifest is written at most every MANIFEST_FLUSH_SECONDS.
+        """
+        with self.lock:
+            self.items[str(key)] = dict(fields, status=status, hash=item_hash
+                                        , updated=datetime.datetime.now().isoformat(timespec="seconds"))
+            flush = time.time() - self.last_flush >= MANIFEST_FLUSH_SECONDS
+
+        if flush:
+            self.flush()
+
+    def flush(self):
+
+        with self.lock:
+            data = {"version": MANIFEST_VERSION
+                    , "run_hash": self.run_hash
+                    , "status": self.status
+                    , "created": self.created
+                    , "metadata": self.metadata
+                    , "counts": dict(self.counts())
+                    , "items": self.items}
+            write_json_atomic(self.filepath, data)
+            self.last_flush = time.time()
+
+    def close(self, status="completed"):
+        self.status = status
+        self.flush()
+
+    def counts(self):
+        return Counter(item.get("status") for item in self.items.values())
+
+    def format_counts(self):
+        return ", ".join(f"{count} {status}" for status, count in sorted(self.counts().items())) or "no items"
+
+class TileCheckpoint():
+    """
+    Run manifest of a tiled detection plus the detections of each completed tile (one .npz per tile),
+    so a resumed tile_inference only runs the tiles that were not completed.
+    """
+
+    def __init__(self, manifest_filepath, tiles_folder, run_hash, metadata=None):
+        self.manifest = RunManifest(manifest_filepath, run_hash, metadata)
+        self.tiles_folder = tiles_folder
+
+    def tile_filepath(self, key):
+        return os.path.join(self.tiles_folder, f"{key}.npz")
+
+    def load_tile(self, key, item_hash):
+        """
+        Arrays saved for a completed tile, None if the tile has to be processed.
+        """
+        if not self.manifest.is_done(key, item_hash):
+            return None
+        try:
+            with np.load(self.tile_filepath(key)) as data:
+                return {name: data[name] for name in data.files}
+        except Exception:
+            # Missing or truncated tile file
+            return None
+
+    def save_tile(self, key, item_hash, arrays, status="done", **fields):
+        """
+        Save the arrays of a tile, then mark it in the manifest.
+        """
+        os.makedirs(self.tiles_folder, exist_ok=True)
+        filepath = self.tile_filepath(key)
+        tmp_filepath = filepath + ".tmp"
+        with open(tmp_filepath, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_filepath, filepath)
+
+        self.manifest.update(key, status, item_hash, **fields)
+
+    def fail_tile(self, key, item_hash, error, **fields):
+        self.manifest.update(key, "failed", item_hash, error=error, **fields)
+
+    def close(self, status="completed", remove_tiles=True):
+        """
+        Write the final manifest. The tile files of a completed run are removed.
+        """
+        self.manifest.close(status)
+        if status == "completed" and remove_tiles and os.path.isdir(self.tiles_folder):
+            for entry in os.scandir(self.tiles_folder):
+                if entry.name.endswith(".npz") or entry.name.endswith(".tmp"):
+                    os.remove(entry.path)
+            try:
+                os.rmdir(self.tiles_folder)
+            except OSError:
+                pass
@@ -0,0 +1,203 @@
+import time
+import queue
+import threading
+
+# Items waiting between two stages (backpressure: readers stop when inference falls behind)
+DEFAULT_QUEUE_DEPTH = 4
+
+# Threads reading and preprocessing inputs
+DEFAULT_READER_THREADS = 2
+
+# Seconds between checks of the stop flag while waiting on a queue
+POLL_SECONDS = 0.1
+
+class PipelineStopped(Exception):
+    pass
+
+class PipelineStage():
+    """
+    Busy time accounting of the threads of a pipeline stage.
+    """
+
+    def __init__(self, name, threads=1):
+        self.name = name
+        self.threads = threads
+        self.busy_seconds = 0.0
+        self.items = 0
+        self.lock = threading.Lock()
+
+    def add(self, seconds, items=1):
+        with self.lock:
+            self.busy_seconds += seconds
+            self.items += items
+
+    def summary(self, wall_seconds):
+        return {"threads": self.threads
+                , "items": self.items
+                , "busy_seconds": self.busy_seconds
+                , "utilization": self.busy_seconds / (self.threads * wall_seconds) if wall_seconds > 0 else 0.0
+                }
+
+class Pipeline():
+    """
+    Producer/consumer pipeline with three stages connected by bounded queues:
+
+        reader threads -> inference (one thread, batches) -> writer (one thread)
+
+    read_fc(item) returns the data of an item (e.g. a preprocessed tile), infer_fc(list of data)
+    returns one result per data, and write_fc(item, data, result) saves it. While the model runs a
+    batch, the readers prefetch the next tiles and the writer saves the previous results.
+
+    The first exception raised by any stage stops the pipeline and is raised again by run().
+    On interruption the readers stop and the results already computed are still written.
+    """
+
+    def __init__(self, read_fc, infer_fc, write_fc
+                 , batch_size=1
+                 , queue_depth=DEFAULT_QUEUE_DEPTH
+                 , reader_threads=DEFAULT_READER_THREADS
+                 , interruption_check=None
+                 ):
+
+        self.read_fc = read_fc
+        self.infer_fc = infer_fc
+        self.write_fc = write_fc
+
+        self.batch_size = max(1, int(batch_size))
+        self.queue_depth = max(1, int(queue_depth))
+        self.reader_threads = max(1, int(reader_threads))
+        self.interruption_check = interruption_check
+
+        self.stop_event = threading.Event()
+        self.interrupt_event = threading.Event()
+        self.errors = []
+
+    def put(self, q, value, interruptible=False):
+        while True:
+            if self.stop_event.is_set() or (interruptible and self.interrupt_event.is_set()):
+                raise PipelineStopped()
+            try:
+                q.put(value, timeout=POLL_SECONDS)
+                return
+            except queue.Full:
+                pass
+
+    def get(self, q, interruptible=False):
+        while True:
+            if self.stop_event.is_set() or (interruptible and self.interrupt_event.is_set()):
+                raise PipelineStopped()
+            try:
+                return q.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                pass
+
+    def fail(self, e):
+        self.errors.append(e)
+        self.stop_event.set()
+
+    def run(self, items):
+        """
+        Process all items.
+
+        Returns:
+            dict: Wall time and per stage utilization (busy time / (threads * wall time)).
+        """
+
+        items = list(items)
+
+        stages = {"read": PipelineStage("read", self.reader_threads)
+                  , "inference": PipelineStage("inference")
+                  , "write": PipelineStage("write")}
+
+        input_queue = queue.Queue()
+        read_queue = queue.Queue(maxsize=self.queue_depth)
+        write_queue = queue.Queue(maxsize=self.queue_depth)
+
+        for item in items:
+            input_queue.put(item)
+
+        def reader():
+            try:
+                while not self.interrupt_event.is_set():
+                    try:
+                        item = input_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    start = time.perf_counter()
+                    data = self.read_fc(item)
+                    stages["read"].add(time.perf_counter() - start)
+                    self.put(read_queue, (item, data), interruptible=True)
+                self.put(read_queue, None, interruptible=True)
+            except PipelineStopped:
+                pass
+            except Exception as e:
+                self.fail(e)
+
+        def inference():
+            try:
+                finished_readers = 0
+                while finished_readers < self.reader_threads:
+                    batch = []
+                    while len(batch) < self.batch_size and finished_readers < self.reader_threads:
+                        value = self.get(read_queue)
+                        if value is None:
+                            finished_readers += 1
+                        else:
+                            batch.append(value)
+
+                    if self.interruption_check and self.interruption_check():
+                        print("Interruption requested, stopping pipeline.")
+                        self.interrupt_event.set()
+                        break
+
+                    if batch:
+                        start = time.perf_counter()
+                        results = self.infer_fc([data for _, data in batch])
+                        stages["inference"].add(time.perf_counter() - start, len(batch))
+                        for (item, data), result in zip(batch, results):
+                            self.put(write_queue, (item, data, result))
+
+                self.put(write_queue, None)
+            except PipelineStopped:
+                pass
+            except Exception as e:
+                self.fail(e)
+
+        def writer():
+            try:
+                while True:
+                    value = self.get(write_queue)
+                    if value is None:
+                        break
+                    start = time.perf_counter()
+                    self.write_fc(*value)
+                    stages["write"].add(time.perf_counter() - start)
+            except PipelineStopped:
+                pass
+            except Exception as e:
+                self.fail(e)
+
+        threads = [threading.Thread(target=reader, daemon=True) for _ in range(self.reader_threads)]
+        threads.append(threading.Thread(target=inference, daemon=True))
+        threads.append(threading.Thread(target=writer, daemon=True))
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall_seconds = time.perf_counter() - start
+
+        if self.errors:
+            raise self.errors[0]
+
+        report = {"items": len(items)
+                  , "wall_seconds": wall_seconds
+                  , "queue_depth": self.queue_depth
+                  , "stages": {name: stage.summary(wall_seconds) for name, stage in stages.items()}}
+
+        print("Pipeline utilization: " + ", ".join(
+            f"{name} {stage['utilization']*100:.0f}% ({stage['items']} items, {stage['threads']} threads)"
+            for name, stage in report["stages"].items()))
+
+        return report
@@ -1,6 +1,18 @@
 #from rootprocessor import RootSegmentor
+import json
 
-from custom_processor import ForagesROIsDetector
+# custom_processor and quantization are imported by the tasks using them, so a CLI call only
+# pays the import time of its own task
+from interface.sessioncache import SESSION_CACHE
+from interface.pipeline import DEFAULT_QUEUE_DEPTH, DEFAULT_READER_THREADS
+from interface.resultcache import DEFAULT_RESULT_CACHE_DIR, DEFAULT_RESULT_CACHE_MAX_MB
+from interface.candidatestore import DEFAULT_CANDIDATE_THRESHOLD, default_candidates_filepath
+from interface.profiling import PROFILER
+from interface.manifest import write_json_atomic
+
+# Processor params forwarded to create_session_options
+SESSION_OPTIONS_KEYS = ["intra_op_threads", "inter_op_threads", "execution_mode"
+                        , "graph_optimization_level", "enable_cpu_mem_arena"]
 
 
 class Processor():
@@ -10,7 +22,97 @@ class Processor():
         self.progress_callback = progress_callback
         self.interruption_check = interruption_check
 
+    def create_detector(self):
+
+        from custom_processor import ForagesROIsDetector
+
+        batch_size = self.params.get("batch_size", 1)
+        providers = self.params.get("providers")
+        session_options = {key: self.params.get(key) for key in SESSION_OPTIONS_KEYS}
+
+        use_session_cache = self.params.get("use_session_cache", True)
+        quantized = self.params.get("quantized", False)
+        max_detections = self.params.get("max_detections")
+
+        pipeline = self.params.get("pipeline", False)
+        queue_depth = self.params.get("queue_depth", DEFAULT_QUEUE_DEPTH)
+        reader_threads = self.params.get("reader_threads", DEFAULT_READER_THREADS)
+        workers = self.params.get("workers", 1)
+        io_binding = self.params.get("io_binding", True)
+        dynamic_shapes = self.params.get("dynamic_shapes", True)
+
+        # Reuse the detections of tiles already processed with the same model and decode parameters
+        result_cache_dir = None
+        if self.params.get("result_cache", False):
+            result_cache_dir = self.params.get("result_cache_dir", DEFAULT_RESULT_CACHE_DIR)
+        result_cache_max_mb = self.params.get("result_cache_max_mb", DEFAULT_RESULT_CACHE_MAX_MB)
+
+        # Decode thresholds, None keeps the defaults of custom_processor
+        thresholds = {key: self.params.get(key) for key in ["conf_threshold", "nms_threshold"]
+                      if self.params.get(key) is not None}
+        candidate_threshold = self.params.get("candidate_threshold", DEFAULT_CANDIDATE_THRESHOLD)
+
+        if self.params.get("max_cached_sessions") is not None:
+            SESSION_CACHE.configure(max_sessions=self.params.get("max_cached_sessions"))
+
+        return ForagesROIsDetector(batch_size=batch_size
+                                   , providers=providers
+                                   , session_options=session_options
+                                   , use_session_cache=use_session_cache
+                                   , quantized=quantized
+                                   , max_detections=max_detections
+                                   , pipeline=pipeline
+                                   , queue_depth=queue_depth
+                                   , reader_threads=reader_threads
+                                   , workers=workers
+                                   , io_binding=io_binding
+                                   , dynamic_shapes=dynamic_shapes
+                                   , result_cache_dir=result_cache_dir
+                                   , result_cache_max_mb=result_cache_max_mb
+                                   , candidate_threshold=candidate_threshold
+                                   , **thresholds)
+
+    def candidates_filepath(self, output_folder):
+        """
+        File of the raw candidates of a tiling detection, None unless save_candidates is set.
+        """
+        if not self.params.get("save_candidates", False):
+            return None
+        return self.params.get("candidates_file") or default_candidates_filepath(output_folder)
+
     def run(self):
+        """
+        Run the task, with the stage timers of the run in results["profile"] if the profile param is set.
+        """
+
+        if not self.params.get("profile", False):
+            return self.run_task()
+
+        profile_stage = self.params.get("profile_stage")
+        PROFILER.enable(profile_stage=profile_stage)
+        try:
+            results = self.run_task()
+        finally:
+            report = PROFILER.report()
+            if profile_stage:
+                stats_filepath = self.params.get("profile_stats") or f"profile_{profile_stage}.prof"
+                if PROFILER.dump_stats(stats_filepath):
+                    report["stats_file"] = stats_filepath
+                else:
+                    print(f"Stage {profile_stage} did not run, no profile stats saved")
+            PROFILER.disable()
+
+        results["profile"] = report
+
+        profile_output = self.params.get("profile_output")
+        if profile_output:
+            write_json_atomic(profile_output, report)
+
+        print(json.dumps({"profile": report}, indent=4))
+
+        return results
+
+    def run_task(self):
 
         results = self.params
 
@@ -23,7 +125,7 @@ class Processor():
             input_file = self.params.get("input_file")
             output_folder = self.params.get("output_folder")
 
-            self.forages_rois_detector = ForagesROIsDetector()
+            self.forages_rois_detector = self.create_detector()
             self.forages_rois_detector.inference(input_file, output_folder)
 
 
@@ -35,8 +137,20 @@ class Processor():
             input_file = self.params.get("input_file")
             output_folder = self.params.get("output_folder")
 
-            self.forages_rois_detector = ForagesROIsDetector()
-            self.forages_rois_detector.tile_inference(input_file, output_folder)
+            keep_tiles = self.params.get("keep_tiles", False)
+            min_valid_fraction = self.params.get("min_valid_fraction", 0.0)
+            prescreen = self.params.get("prescreen", False)
+            prescreen_threshold = self.params.get("prescreen_threshold")
+
+            self.forages_rois_detector = self.create_detector()
+            self.forages_rois_detector.tile_inference(input_file, output_folder, keep_tiles=keep_tiles
+                                                      , min_valid_fraction=min_valid_fraction
+                                                      , prescreen=prescreen
+                                                      , prescreen_threshold=prescreen_threshold
+                                                      , candidates_filepath=self.candidates_filepath(output_folder)
+                                                      , checkpoint=self.params.get("checkpoint", True)
+                                                      , progress_callback=self.progress_callback
+                                                      , interruption_check=self.interruption_check)
 
             results.update({"status": "completed", "message": "Task completed succesfully."})
 
@@ -47,7 +161,7 @@ class Processor():
             align = self.params.get("align", False)
             serpentine = self.params.get("serpentine", False)
 
-            self.forages_rois_detector = ForagesROIsDetector()
+            self.forages_rois_detector = self.create_detector()
             self.forages_rois_detector.plot_numbering(input_file, output_folder
                                                       , align_to_grid=align
                                                       , serpentine=serpentine)
@@ -62,7 +176,7 @@ class Processor():
             align = self.params.get("align", False)
             serpentine = self.params.get("serpentine", False)
 
-            self.forages_rois_detector = ForagesROIsDetector()
+            self.forages_rois_detector = self.create_detector()
             self.forages_rois_detector.plot_numbering(input_file, output_folder
                                                       , only_postprocess=True
                                                       , align_to_grid=align
@@ -75,8 +189,78 @@ class Processor():
             input_file = self.params.get("input_file")
             output_folder = self.params.get("output_folder")
 
-            self.forages_rois_detector = ForagesROIsDetector()
-            self.forages_rois_detector.tile_inference(input_file, output_folder, only=True)
+            keep_tiles = self.params.get("keep_tiles", False)
+            min_valid_fraction = self.params.get("min_valid_fraction", 0.0)
+            prescreen = self.params.get("prescreen", False)
+            prescreen_threshold = self.params.get("prescreen_threshold")
+
+            self.forages_rois_detector = self.create_detector()
+            self.forages_rois_detector.tile_inference(input_file, output_folder, only=True, keep_tiles=keep_tiles
+                                                      , min_valid_fraction=min_valid_fraction
+                                                      , prescreen=prescreen
+                                                      , prescreen_threshold=prescreen_threshold
+                                                      , candidates_filepath=self.candidates_filepath(output_folder)
+                                                      , checkpoint=self.params.get("checkpoint", True)
+                                                      , progress_callback=self.progress_callback
+                                                      , interruption_check=self.interruption_check)
+
+            results.update({"status": "completed", "message": "Task completed succesfully."})
+
+        elif task == "rethreshold":
+
+            # input_file is the candidates file saved with save_candidates, the model is not run
+            input_file = self.params.get("input_file")
+            output_folder = self.params.get("output_folder")
+
+            self.forages_rois_detector = self.create_detector()
+            self.forages_rois_detector.rethreshold(input_file, output_folder, only=self.params.get("only"))
+
+            results.update({"status": "completed", "message": "Task completed succesfully."})
+
+        elif task == "release_models":
+
+            # Free the model sessions cached in this process (long running GUI or service)
+            released = SESSION_CACHE.release()
+
+            results.update({"status": "completed", "message": f"Released {released} model sessions."})
+
+        elif task == "quantize_model":
+
+            # input_file is the calibration tiles folder (static mode), output_folder the INT8 model filepath
+            input_file = self.params.get("input_file")
+            output_folder = self.params.get("output_folder")
+            mode = self.params.get("quantization_mode", "dynamic")
+
+            from quantization import quantize_model
+
+            quantize_model(output_filepath=output_folder, mode=mode, calibration_folder=input_file)
+
+            results.update({"status": "completed", "message": "Task completed succesfully."})
+
+        elif task == "quantization_report":
+
+            # input_file is the tiles folder, output_folder the JSON report filepath
+            input_file = self.params.get("input_file")
+            output_folder = self.params.get("output_folder")
+            session_options = {key: self.params.get(key) for key in SESSION_OPTIONS_KEYS}
+
+            from quantization import quantization_report
+
+            report = quantization_report(input_file, output_folder
+                                         , providers=self.params.get("providers")
+                                         , session_options=session_options)
+
+            results.update({"status": "completed", "message": "Task completed succesfully.", "summary": report["summary"]})
+
+        elif task == "export_dynamic_batch_model":
+
+            # input_file is the fixed batch ONNX model, output_folder the new model filepath
+            input_file = self.params.get("input_file")
+            output_folder = self.params.get("output_folder")
+
+            from custom_processor import export_dynamic_batch_model
+
+            export_dynamic_batch_model(input_file, output_folder)
 
             results.update({"status": "completed", "message": "Task completed succesfully."})
 
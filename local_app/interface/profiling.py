@@ -0,0 +1,141 @@
+import os
+import time
+import threading
+import functools
+import contextlib
+
+# Stage timers of the detection tasks. PROFILER is shared by the process like SESSION_CACHE: the
+# code marks its stages with "with PROFILER.stage(name):" or the @PROFILER.timed(name) decorator,
+# which cost a shared null context or a flag check when profiling is disabled (the default), and
+# accumulate seconds and calls per stage when enabled.
+#
+# Stages used by custom_processor: model_load, tiling, extract_tiles, read, preprocess, inference,
+# decode, nms, georeference, merge, numbering and write. Stages can be nested (e.g. numbering runs
+# inside merge), the report gives the inclusive time of each one.
+
+NULL_STAGE = contextlib.nullcontext()
+
+class StageProfiler():
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+
+        # Optional cProfile of one stage, one profile per thread running it
+        self.profile_stage_name = None
+        self.thread_profiles = []
+        self.local = threading.local()
+
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.seconds = {}
+            self.calls = {}
+            self.max_seconds = {}
+            self.thread_profiles = []
+            self.start_time = time.perf_counter()
+        self.local = threading.local()
+
+    def enable(self, profile_stage=None):
+        """
+        Start collecting the stage timers of a run (resets the previous ones).
+
+        Parameters:
+            profile_stage (str): Optional stage also run under cProfile, see dump_stats.
+        """
+        self.reset()
+        self.profile_stage_name = profile_stage
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+        self.profile_stage_name = None
+
+    def stage(self, name):
+        if not self.enabled:
+            return NULL_STAGE
+        return self.timed_stage(name)
+
+    def timed(self, name):
+        """
+        Decorator running a whole function as a stage.
+        """
+        def decorator(fc):
+            @functools.wraps(fc)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fc(*args, **kwargs)
+                with self.timed_stage(name):
+                    return fc(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @contextlib.contextmanager
+    def timed_stage(self, name):
+        profile = None
+        if name == self.profile_stage_name and not getattr(self.local, "profiling", False):
+            profile = self.thread_profile()
+            self.local.profiling = True
+            profile.enable()
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            if profile is not None:
+                profile.disable()
+                self.local.profiling = False
+            self.add(name, seconds)
+
+    def thread_profile(self):
+        profile = getattr(self.local, "profile", None)
+        if profile is None:
+            import cProfile
+            profile = cProfile.Profile()
+            self.local.profile = profile
+            with self.lock:
+                self.thread_profiles.append(profile)
+        return profile
+
+    def add(self, name, seconds):
+        with self.lock:
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+            self.calls[name] = self.calls.get(name, 0) + 1
+            self.max_seconds[name] = max(self.max_seconds.get(name, 0.0), seconds)
+
+    def report(self):
+        """
+        Seconds, calls, mean and max milliseconds of each stage since enable, by decreasing time.
+        """
+        with self.lock:
+            stages = {}
+            for name in sorted(self.seconds, key=self.seconds.get, reverse=True):
+                stages[name] = {"seconds": round(self.seconds[name], 4)
+                                , "calls": self.calls[name]
+                                , "mean_ms": round(self.seconds[name]/self.calls[name]*1000, 3)
+                                , "max_ms": round(self.max_seconds[name]*1000, 3)}
+            return {"total_seconds": round(time.perf_counter() - self.start_time, 4), "stages": stages}
+
+    def dump_stats(self, filepath):
+        """
+        Save the cProfile stats of the profiled stage (all threads merged) for pstats or snakeviz.
+
+        Returns:
+            bool: False if the stage did not run.
+        """
+        with self.lock:
+            profiles = list(self.thread_profiles)
+        if not profiles:
+            return False
+
+        import pstats
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        os.makedirs(os.path.dirname(os.path.abspath(filepath)), exist_ok=True)
+        stats.dump_stats(filepath)
+        return True
+
+PROFILER = StageProfiler()
@@ -0,0 +1,184 @@
+import json
+import time
+import threading
+
+# Phases of a tiled detection (tile_inference) and their share of the overall percent. The
+# phases skipped by a run (extract_tiles without keep_tiles, postprocessing with only) are
+# left out of its weights.
+TILE_INFERENCE_PHASES = {"grid": 2, "extract_tiles": 15, "inference": 70, "merge": 3, "postprocessing": 10}
+
+# Minimum seconds between two progress events of a phase (the start and finish events are always sent)
+PROGRESS_MIN_SECONDS = 0.5
+
+# Prefix of the progress lines printed in CLI mode, followed by the event as JSON
+PROGRESS_LINE_PREFIX = "PROGRESS "
+
+class ProgressReporter():
+    """
+    Progress events of a run split in phases, sent to progress_callback (the progressUpdated
+    signal of the GUI Worker, the stdio server or the CLI printer) as dicts with:
+
+        phase, status, processed_count, total_count, unit, percent (overall run), phase_percent,
+        items_per_second, mb_per_second (bytes read), elapsed_seconds, eta_seconds (of the phase).
+
+    Items already done when a phase starts (e.g. tiles resumed from a checkpoint) count in the
+    percent but not in the rates. Methods can be called from the pipeline threads. Without a
+    callback every method returns immediately.
+    """
+
+    def __init__(self, progress_callback=None, phases=None, min_interval=PROGRESS_MIN_SECONDS):
+
+        self.progress_callback = progress_callback
+        self.phases = dict(phases or {})
+        self.min_interval = min_interval
+        self.lock = threading.Lock()
+
+        self.phase = None
+        self.status = ""
+        self.phase_weight_done = 0.0
+        self.start_phase_values("", None, "items", 0)
+
+    def start_phase_values(self, phase, total, unit, done):
+        self.phase = phase
+        self.total = total
+        self.unit = unit
+        self.done = done
+        self.initial = done
+        self.bytes_read = 0
+        self.start_time = time.perf_counter()
+        self.last_event = 0.0
+
+    def start(self, phase, total=None, unit="tiles", done=0, status=None):
+        """
+        Start a phase of total items (None if unknown), done of them already completed.
+        """
+        if self.progress_callback is None:
+            return
+
+        with self.lock:
+            if self.phase in self.phases:
+                self.phase_weight_done += self.phases[self.phase]
+            self.start_phase_values(phase, total, unit, done)
+            self.status = status or phase.replace("_", " ").capitalize()
+            event = self.event()
+        self.progress_callback(event)
+
+    def advance(self, count=1, nbytes=0):
+        """
+        Count completed items of the phase, and the bytes read for them.
+        """
+        if self.progress_callback is None:
+            return
+
+        with self.lock:
+            self.done += count
+            self.bytes_read += nbytes
+            event = self.throttled_event()
+        if event is not None:
+            self.progress_callback(event)
+
+    def update(self, done, total=None):
+        """
+        Set the completed items of the phase (e.g. from the progress of BatchProcessor).
+        """
+        if self.progress_callback is None:
+            return
+
+        with self.lock:
+            self.done = done
+            if total is not None:
+                self.total = total
+            event = self.throttled_event()
+        if event is not None:
+            self.progress_callback(event)
+
+    def add_bytes(self, nbytes):
+        """
+        Count bytes read before their items are completed (reader threads of the pipeline).
+        """
+        if self.progress_callback is None:
+            return
+
+        with self.lock:
+            self.bytes_read += nbytes
+
+    def finish(self, status=None):
+        """
+        Send the final event of the current phase.
+        """
+        if self.progress_callback is None:
+            return
+
+        with self.lock:
+            if self.total is not None:
+                self.done = max(self.done, self.total)
+            if status is not None:
+                self.status = status
+            event = self.event(finished=True)
+        self.progress_callback(event)
+
+    def complete(self, status="Completed"):
+        """
+        Send the last event of the run (100 percent).
+        """
+        if self.progress_callback is None:
+            return
+
+        with self.lock:
+            if self.phase in self.phases:
+                self.phase_weight_done += self.phases[self.phase]
+            self.start_phase_values("completed", None, self.unit, 0)
+            self.status = status
+            event = self.event(finished=True)
+        self.progress_callback(event)
+
+    def throttled_event(self):
+        now = time.perf_counter()
+        if now - self.last_event < self.min_interval:
+            return None
+        return self.event()
+
+    def event(self, finished=False):
+
+        now = time.perf_counter()
+        self.last_event = now
+        elapsed = now - self.start_time
+
+        if self.total:
+            phase_fraction = min(1.0, self.done/self.total)
+        else:
+            phase_fraction = 1.0 if finished else 0.0
+
+        rate = (self.done - self.initial)/elapsed if elapsed > 0 else 0.0
+        eta = None
+        if self.total is not None and rate > 0:
+            eta = round(max(0, self.total - self.done)/rate, 1)
+
+        total_weight = sum(self.phases.values())
+        if total_weight and self.phase in self.phases:
+            percent = (self.phase_weight_done + self.phases[self.phase]*phase_fraction)/total_weight*100
+        else:
+            percent = phase_fraction*100
+
+        return {"phase": self.phase
+                , "status": self.status
+                , "processed_count": self.done
+                , "total_count": self.total
+                , "unit": self.unit
+                , "percent": round(percent, 2)
+                , "phase_percent": round(phase_fraction*100, 2)
+                , "items_per_second": round(rate, 3)
+                , "mb_per_second": round(self.bytes_read/1e6/elapsed, 3) if elapsed > 0 else 0.0
+                , "elapsed_seconds": round(elapsed, 2)
+                , "eta_seconds": 0.0 if finished else eta}
+
+def format_progress_line(progress):
+    """
+    One line progress event for CLI mode: PROGRESS_LINE_PREFIX and the event as compact JSON
+    (without the accumulated logs of BatchProcessor events).
+    """
+    progress = {k: v for k, v in progress.items() if k != "logs"}
+    return PROGRESS_LINE_PREFIX + json.dumps(progress, separators=(",", ":"), default=str)
+
+def print_progress(progress):
+    print(format_progress_line(progress), flush=True)
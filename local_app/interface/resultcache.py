@@ -0,0 +1,197 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+import numpy as np
+
+# Folder of the cached candidates, relative to the working directory like the models folder
+DEFAULT_RESULT_CACHE_DIR = os.path.join(".", "cache", "results")
+
+# Size cap of the cache folder, least recently used entries are removed above it
+DEFAULT_RESULT_CACHE_MAX_MB = 1024
+
+# Eviction removes entries until the cache is below this fraction of the cap (avoids evicting on every put)
+EVICTION_TARGET = 0.9
+
+# Model file hashes, (path, size, mtime) -> hash, the model is read once per process
+MODEL_HASHES = {}
+MODEL_HASHES_LOCK = threading.Lock()
+
+def model_hash(model_filepath):
+    """
+    Hash of the content of a model file, cached while the file does not change.
+    """
+
+    model_filepath = os.path.abspath(model_filepath)
+    stat = os.stat(model_filepath)
+    key = (model_filepath, stat.st_size, stat.st_mtime)
+
+    with MODEL_HASHES_LOCK:
+        if key in MODEL_HASHES:
+            return MODEL_HASHES[key]
+
+    digest = hashlib.blake2b(digest_size=16)
+    with open(model_filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+
+    with MODEL_HASHES_LOCK:
+        MODEL_HASHES[key] = digest.hexdigest()
+    return MODEL_HASHES[key]
+
+class ResultCache():
+    """
+    On disk cache of the raw candidates of images (see ForagesROIsDetector.decode), keyed by content:
+    a hash of the image pixels, the model file hash and the preprocessing parameters. Rerunning a
+    mosaic with the same model only reads the tiles and the cached candidates, and selects the
+    detections with the current confidence, NMS and max detections parameters.
+
+    Each entry keeps the threshold its candidates were decoded with, and only serves runs with a
+    confidence threshold at or above it (a lower one is a miss and replaces the entry).
+
+    Each entry is a small .npz file. Entries are touched when read and the least recently used ones
+    are removed when the folder grows over max_mb. Several processes can share a folder: a missing
+    or unreadable entry is a miss.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_RESULT_CACHE_DIR, max_mb=DEFAULT_RESULT_CACHE_MAX_MB):
+
+        self.cache_dir = cache_dir
+        self.max_mb = max_mb
+        self.max_bytes = int(max_mb * 1024 * 1024)
+
+        self.index = None # key -> [size, last access], loaded on first use
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, np_image, model_filepath, signature):
+        """
+        Key of the candidates of an image.
+
+        Parameters:
+            np_image (np.ndarray): Image pixels as passed to the model preprocessing.
+            model_filepath (str): Model file.
+            signature (dict): JSON serializable preprocessing parameters.
+        """
+
+        np_image = np.ascontiguousarray(np_image)
+
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(json.dumps([np_image.shape, np_image.dtype.str, model_hash(model_filepath), signature]
+                                 , sort_keys=True).encode())
+        digest.update(memoryview(np_image).cast("B"))
+
+        return digest.hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".npz")
+
+    def load_index(self):
+        """
+        Scan the cache folder, must be called holding self.lock.
+        """
+
+        if self.index is not None:
+            return
+
+        self.index = {}
+        self.total_bytes = 0
+        if not os.path.isdir(self.cache_dir):
+            return
+
+        for folder in os.scandir(self.cache_dir):
+            if not folder.is_dir():
+                continue
+            for entry in os.scandir(folder.path):
+                if entry.name.endswith(".npz"):
+                    stat = entry.stat()
+                    self.index[entry.name[:-4]] = [stat.st_size, stat.st_mtime]
+                    self.total_bytes += stat.st_size
+
+    def get(self, key, conf_threshold):
+        """
+        Cached candidates (boxes, objectness, class_scores) of a key, None if not cached or if
+        they were decoded with a threshold above conf_threshold.
+        """
+
+        path = self.entry_path(key)
+        try:
+            with np.load(path) as data:
+                if float(data["threshold"]) > conf_threshold:
+                    raise ValueError("Candidates decoded with a higher threshold")
+                candidates = (data["boxes"], data["objectness"], data["class_scores"])
+        except Exception:
+            # Missing, evicted by another process, truncated or decoded with a higher threshold
+            with self.lock:
+                self.misses += 1
+                if self.index is not None and key in self.index:
+                    self.total_bytes -= self.index.pop(key)[0]
+            return None
+
+        now = time.time()
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+
+        with self.lock:
+            self.hits += 1
+            if self.index is not None and key in self.index:
+                self.index[key][1] = now
+
+        return candidates
+
+    def put(self, key, candidates, threshold):
+        """
+        Store the candidates (boxes, objectness, class_scores) of a key decoded with threshold.
+        """
+
+        path = self.entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write then rename, so readers never see a partial entry
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            boxes, objectness, class_scores = candidates
+            np.savez(f, boxes=boxes, objectness=objectness, class_scores=class_scores, threshold=threshold)
+        os.replace(tmp_path, path)
+
+        size = os.path.getsize(path)
+
+        with self.lock:
+            self.load_index()
+            if key in self.index:
+                self.total_bytes -= self.index[key][0]
+            self.index[key] = [size, time.time()]
+            self.total_bytes += size
+
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries, must be called holding self.lock.
+        """
+
+        target = self.max_bytes * EVICTION_TARGET
+        removed = 0
+        for key, (size, _) in sorted(self.index.items(), key=lambda item: item[1][1]):
+            if self.total_bytes <= target:
+                break
+            try:
+                os.remove(self.entry_path(key))
+            except OSError:
+                pass
+            del self.index[key]
+            self.total_bytes -= size
+            removed += 1
+
+        print(f"Result cache over {self.max_mb:g} MB, removed {removed} least recently used entries")
+
+    def summary(self):
+        return f"Result cache {self.cache_dir}: {self.hits} hits, {self.misses} misses"
@@ -0,0 +1,139 @@
+import os
+import json
+import threading
+from collections import OrderedDict
+
+# Maximum number of model sessions kept alive in the process
+MAX_CACHED_SESSIONS = 2
+
+# Least recently used sessions are released when the available memory goes below this value (needs psutil)
+MIN_AVAILABLE_MEMORY_MB = 1024
+
+def available_memory_mb():
+    """
+    Available system memory in MB, None if psutil is not installed.
+    """
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.virtual_memory().available / (1024*1024)
+
+class SessionCache():
+    """
+    Process wide registry of model sessions shared by all detectors, Processor tasks and Worker threads.
+
+    Sessions are keyed by model file (path, size and modification time) and session options, so
+    a model is loaded and optimized only once per process while its configuration does not change.
+    """
+
+    def __init__(self, max_sessions=MAX_CACHED_SESSIONS, min_available_memory_mb=MIN_AVAILABLE_MEMORY_MB):
+
+        self.max_sessions = max_sessions
+        self.min_available_memory_mb = min_available_memory_mb
+
+        self.sessions = OrderedDict() # key -> session, least recently used first
+        self.lock = threading.Lock()
+        self.key_locks = {} # avoid loading the same model twice from concurrent threads
+
+    def configure(self, max_sessions=None, min_available_memory_mb=None):
+
+        with self.lock:
+            if max_sessions is not None:
+                self.max_sessions = max(1, int(max_sessions))
+            if min_available_memory_mb is not None:
+                self.min_available_memory_mb = min_available_memory_mb
+            self.evict()
+
+    def make_key(self, model_filepath, *options):
+
+        model_filepath = os.path.abspath(model_filepath)
+        stat = os.stat(model_filepath)
+        options_key = json.dumps(options, sort_keys=True, default=str)
+
+        return (model_filepath, stat.st_size, stat.st_mtime, options_key)
+
+    def get(self, model_filepath, create_fc, *options):
+        """
+        Get the cached session of a model, creating it with create_fc() if needed.
+
+        Parameters:
+            model_filepath (str): Model file.
+            create_fc (callable): Function without arguments returning a new session.
+            options: JSON serializable values identifying the session configuration.
+        """
+
+        key = self.make_key(model_filepath, *options)
+
+        with self.lock:
+            if key in self.sessions:
+                self.sessions.move_to_end(key)
+                return self.sessions[key]
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            # Another thread may have loaded it while waiting
+            with self.lock:
+                if key in self.sessions:
+                    self.sessions.move_to_end(key)
+                    return self.sessions[key]
+
+            print(f"Loading model {model_filepath}")
+            session = create_fc()
+
+            with self.lock:
+                self.sessions[key] = session
+                self.key_locks.pop(key, None)
+                self.evict(keep=key)
+
+        return session
+
+    def evict(self, keep=None):
+        """
+        Release least recently used sessions over max_sessions or while memory is low.
+        Must be called holding self.lock.
+        """
+
+        while len(self.sessions) > self.max_sessions:
+            self.pop_oldest(keep)
+
+        if self.min_available_memory_mb is not None:
+            memory_mb = available_memory_mb()
+            while memory_mb is not None and memory_mb < self.min_available_memory_mb and len(self.sessions) > 1:
+                if not self.pop_oldest(keep):
+                    break
+                memory_mb = available_memory_mb()
+
+    def pop_oldest(self, keep=None):
+
+        for key in self.sessions:
+            if key != keep:
+                print(f"Releasing model {key[0]}")
+                del self.sessions[key]
+                return True
+        return False
+
+    def release(self, model_filepath=None):
+        """
+        Release the sessions of a model (all its configurations), or every session if model_filepath is None.
+        Detectors still running keep their session alive until they finish.
+        """
+
+        with self.lock:
+            if model_filepath is None:
+                released = len(self.sessions)
+                self.sessions.clear()
+            else:
+                model_filepath = os.path.abspath(model_filepath)
+                keys = [key for key in self.sessions if key[0] == model_filepath]
+                for key in keys:
+                    del self.sessions[key]
+                released = len(keys)
+
+        print(f"Released {released} model sessions")
+        return released
+
+    def __len__(self):
+        return len(self.sessions)
+
+SESSION_CACHE = SessionCache()
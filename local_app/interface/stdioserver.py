@@ -0,0 +1,155 @@
+import os
+import sys
+import json
+import queue
+import threading
+import traceback
+
+from interface.processor import Processor
+
+# JSON lines protocol of ForagesROIs.py --serve-stdio (one JSON object per line):
+#
+#   requests (stdin)  : {"id": 1, "task": "tiling_detection", "input_file": ..., "output_folder": ...}
+#                       with the same params as Processor, or a command: {"command": "cancel"},
+#                       {"command": "ping"} or {"command": "shutdown"}
+#   responses (stdout): {"event": "ready", "pid": ...} once at start up, then for each request
+#                       {"event": "log", "id": 1, "message": ...} for each printed line,
+#                       {"event": "progress", "id": 1, "progress": {...}} and finally
+#                       {"event": "result", "id": 1, "results": {...}}
+#
+# The progress of the tiling tasks has the phase, counts, throughput and ETA of ProgressReporter
+# (interface/progress.py), its percent covers the whole task.
+#
+# The process stays alive between requests, so the imported modules and the model sessions of
+# SESSION_CACHE are reused by the next task.
+
+class ProtocolWriter():
+    """
+    Writes the JSON lines responses to the original stdout, one complete line at a time.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def send(self, message):
+        line = json.dumps(message, default=str)
+        with self.lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+class LogStream():
+    """
+    Replacement of sys.stdout sending each printed line as a log event of the current request.
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.request_id = None
+        self.buffer = ""
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        with self.lock:
+            self.buffer += text
+            *lines, self.buffer = self.buffer.split("\n")
+        for line in lines:
+            self.writer.send({"event": "log", "id": self.request_id, "message": line})
+        return len(text)
+
+    def flush(self):
+        with self.lock:
+            line, self.buffer = self.buffer, ""
+        if line:
+            self.writer.send({"event": "log", "id": self.request_id, "message": line})
+
+def read_requests(stream, requests, cancel_event):
+    """
+    Read the requests from stdin. Cancel commands are handled here so they arrive while a task runs.
+    """
+
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as e:
+            requests.put({"invalid": f"Invalid JSON request: {e}"})
+            continue
+
+        if isinstance(request, dict) and request.get("command") == "cancel":
+            cancel_event.set()
+        else:
+            requests.put(request)
+
+    # stdin closed, the client is gone
+    cancel_event.set()
+    requests.put(None)
+
+def serve_stdio():
+    """
+    Run tasks received as JSON lines on stdin until a shutdown command or the end of stdin.
+    """
+
+    # Protocol messages use a duplicate of the stdout file descriptor. File descriptor 1 is redirected
+    # to stderr, so output of native libraries and worker processes can not corrupt the protocol.
+    protocol_stream = os.fdopen(os.dup(sys.stdout.fileno()), "w", encoding="utf-8")
+    sys.stdout.flush()
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    writer = ProtocolWriter(protocol_stream)
+    log_stream = LogStream(writer)
+    sys.stdout = log_stream
+
+    requests = queue.Queue()
+    cancel_event = threading.Event()
+
+    threading.Thread(target=read_requests, args=(sys.stdin, requests, cancel_event), daemon=True).start()
+
+    writer.send({"event": "ready", "pid": os.getpid()})
+
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+
+        if not isinstance(request, dict) or "invalid" in request:
+            message = request.get("invalid") if isinstance(request, dict) else "Request must be a JSON object."
+            writer.send({"event": "result", "id": None, "results": {"status": "error", "message": message}})
+            continue
+
+        request_id = request.pop("id", None)
+        command = request.get("command")
+
+        if command == "shutdown":
+            writer.send({"event": "result", "id": request_id, "results": {"status": "completed", "message": "Shutting down."}})
+            break
+
+        if command == "ping":
+            writer.send({"event": "result", "id": request_id, "results": {"status": "completed", "message": "pong"}})
+            continue
+
+        # A cancel sent between two tasks must not cancel the next one
+        cancel_event.clear()
+        log_stream.request_id = request_id
+
+        def progress_callback(progress, request_id=request_id):
+            # The accumulated logs are already sent as log events
+            progress = {k: v for k, v in progress.items() if k != "logs"}
+            writer.send({"event": "progress", "id": request_id, "progress": progress})
+
+        try:
+            processor = Processor(request
+                                  , progress_callback=progress_callback
+                                  , interruption_check=cancel_event.is_set)
+            results = processor.run()
+            if cancel_event.is_set():
+                results.update({"status": "cancelled"})
+        except Exception as e:
+            print(traceback.format_exc())
+            results = {"status": "error", "message": str(e)}
+
+        log_stream.flush()
+        log_stream.request_id = None
+        writer.send({"event": "result", "id": request_id, "results": results})
@@ -0,0 +1,206 @@
+import os
+import glob
+import json
+import time
+
+import numpy as np
+
+import custom_processor
+from interface.lazyimport import LazyModule
+from custom_processor import ForagesROIsDetector, preprocess, box_iou
+
+cv = LazyModule("cv2")
+
+# Image extensions used as calibration/evaluation tiles (QGIS2COCO images folder)
+TILE_FORMATS = ["tif", "tiff", "jpg", "jpeg", "png"]
+
+def list_tiles(folder, max_tiles=None):
+    """
+    List the tile images of a folder (and subfolders), e.g. the images folder created by QGIS2COCO.
+    """
+    files = []
+    for format in TILE_FORMATS:
+        files.extend(glob.glob(os.path.join(folder, "**", "*." + format), recursive=True))
+    files = sorted(set(files))
+
+    if max_tiles is not None:
+        files = files[:max_tiles]
+
+    return files
+
+def read_tile(filepath):
+    """
+    Read a tile as RGB image.
+    """
+    np_image = cv.imread(filepath)
+    if np_image is None:
+        raise ValueError(f"Could not read image: {filepath}")
+    return cv.cvtColor(np_image, cv.COLOR_BGR2RGB)
+
+def create_calibration_reader(tiles, input_name):
+    """
+    Create an onnxruntime CalibrationDataReader feeding the preprocessed tiles to the model input.
+    """
+    from onnxruntime.quantization import CalibrationDataReader
+
+    class TilesCalibrationReader(CalibrationDataReader):
+
+        def __init__(self):
+            self.tiles = iter(tiles)
+
+        def get_next(self):
+            filepath = next(self.tiles, None)
+            if filepath is None:
+                return None
+            img_input, _, _ = preprocess(read_tile(filepath))
+            return {input_name: img_input}
+
+    return TilesCalibrationReader()
+
+def quantize_model(model_filepath=None, output_filepath=None, mode="dynamic", calibration_folder=None, max_calibration_tiles=100):
+    """
+    Create an INT8 version of the model next to the fp32 one (QUANTIZED_MODEL_FILENAME).
+
+    Parameters:
+        model_filepath (str): fp32 model, by default MODEL_PATH/MODEL_FILENAME.
+        output_filepath (str): INT8 model, by default MODEL_PATH/QUANTIZED_MODEL_FILENAME.
+        mode (str): "dynamic" (weights only, no calibration) or "static" (weights and activations,
+            calibrated over the tiles of calibration_folder).
+        calibration_folder (str): Folder with tiles, e.g. the images folder created by QGIS2COCO.
+        max_calibration_tiles (int): Maximum number of tiles used for calibration.
+    """
+    import onnx
+    from onnxruntime.quantization import quantize_dynamic, quantize_static, QuantType, QuantFormat
+
+    if model_filepath is None:
+        model_filepath = os.path.join(custom_processor.MODEL_PATH, custom_processor.MODEL_FILENAME)
+    if output_filepath is None:
+        output_filepath = os.path.join(custom_processor.MODEL_PATH, custom_processor.QUANTIZED_MODEL_FILENAME)
+
+    print(f"Quantizing {model_filepath} ({mode})")
+
+    if mode == "dynamic":
+        quantize_dynamic(model_filepath, output_filepath, weight_type=QuantType.QUInt8)
+
+    elif mode == "static":
+        if calibration_folder is None:
+            raise ValueError("Static quantization needs a calibration folder with tiles")
+
+        tiles = list_tiles(calibration_folder, max_calibration_tiles)
+        if not tiles:
+            raise ValueError(f"No tiles found for calibration in {calibration_folder}")
+        print(f"Calibrating with {len(tiles)} tiles")
+
+        input_name = onnx.load(model_filepath).graph.input[0].name
+        quantize_static(model_filepath
+                        , output_filepath
+                        , create_calibration_reader(tiles, input_name)
+                        , quant_format=QuantFormat.QDQ
+                        , activation_type=QuantType.QUInt8
+                        , weight_type=QuantType.QInt8
+                        , per_channel=True
+                        )
+    else:
+        raise ValueError(f"Invalid quantization mode: {mode}")
+
+    print("Quantized model saved to", output_filepath)
+    return output_filepath
+
+def match_detections(boxes_ref, boxes, iou_threshold=0.5):
+    """
+    Greedy one to one matching of detections by IoU (highest IoU first).
+
+    Returns:
+        list: IoU of each matched pair.
+    """
+    if len(boxes_ref) == 0 or len(boxes) == 0:
+        return []
+
+    iou = box_iou(boxes_ref, boxes)
+    matched_ious = []
+    while True:
+        i, j = np.unravel_index(np.argmax(iou), iou.shape)
+        if iou[i, j] < iou_threshold:
+            break
+        matched_ious.append(float(iou[i, j]))
+        iou[i, :] = -1
+        iou[:, j] = -1
+
+    return matched_ious
+
+def quantization_report(tiles_folder, output_filepath=None, max_tiles=50, iou_threshold=0.5, providers=None, session_options=None):
+    """
+    Compare the fp32 and INT8 models over a folder of tiles: detection counts, IoU agreement and per tile latency.
+
+    Returns:
+        dict: Report with a summary and per tile results, also saved as JSON in output_filepath.
+    """
+
+    tiles = list_tiles(tiles_folder, max_tiles)
+    if not tiles:
+        raise ValueError(f"No tiles found in {tiles_folder}")
+
+    detectors = {
+        "fp32": ForagesROIsDetector(providers=providers, session_options=session_options),
+        "int8": ForagesROIsDetector(providers=providers, session_options=session_options, quantized=True),
+    }
+
+    # Load both sessions and warm them up before timing
+    warm_up_image = read_tile(tiles[0])
+    for detector in detectors.values():
+        detector.predict([warm_up_image])
+
+    tile_results = []
+    for filepath in tiles:
+        np_image = read_tile(filepath)
+
+        result = {"tile": os.path.relpath(filepath, tiles_folder)}
+        boxes = {}
+        for name, detector in detectors.items():
+            start = time.perf_counter()
+            outputs = detector.predict([np_image])[0]
+            result[f"{name}_seconds"] = time.perf_counter() - start
+            boxes[name] = outputs[0][0]
+            result[f"{name}_detections"] = len(boxes[name])
+
+        matched_ious = match_detections(boxes["fp32"], boxes["int8"], iou_threshold)
+        result["matched"] = len(matched_ious)
+        result["mean_iou"] = float(np.mean(matched_ious)) if matched_ious else None
+        tile_results.append(result)
+
+    fp32_detections = sum(r["fp32_detections"] for r in tile_results)
+    int8_detections = sum(r["int8_detections"] for r in tile_results)
+    matched = sum(r["matched"] for r in tile_results)
+    fp32_seconds = float(np.mean([r["fp32_seconds"] for r in tile_results]))
+    int8_seconds = float(np.mean([r["int8_seconds"] for r in tile_results]))
+    matched_ious = [r["mean_iou"]*r["matched"] for r in tile_results if r["matched"]]
+
+    summary = {
+        "tiles": len(tile_results),
+        "iou_threshold": iou_threshold,
+        "fp32_detections": fp32_detections,
+        "int8_detections": int8_detections,
+        "matched": matched,
+        # Agreement of the INT8 detections taking the fp32 ones as reference
+        "recall": matched / fp32_detections if fp32_detections else None,
+        "precision": matched / int8_detections if int8_detections else None,
+        "mean_iou": sum(matched_ious) / matched if matched else None,
+        "fp32_seconds_per_tile": fp32_seconds,
+        "int8_seconds_per_tile": int8_seconds,
+        "speedup": fp32_seconds / int8_seconds if int8_seconds > 0 else None,
+    }
+
+    report = {"fp32_model": detectors["fp32"].model_filepath
+              , "int8_model": detectors["int8"].model_filepath
+              , "summary": summary
+              , "tiles": tile_results}
+
+    print(json.dumps(summary, indent=4))
+
+    if output_filepath is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(output_filepath)), exist_ok=True)
+        with open(output_filepath, 'w') as f:
+            json.dump(report, f, indent=4)
+        print("Quantization report saved to", output_filepath)
+
+    return report
@@ -0,0 +1,59 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+# Run from the local_app folder: python tests/bench_batch_inference.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import custom_processor
+from custom_processor import ForagesROIsDetector, export_dynamic_batch_model
+
+# CPU throughput comparison of batched inference (batch sizes 1/2/4/8)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark batched ONNX inference on CPU.")
+    parser.add_argument("--tiles", type=int, default=16, help="Number of synthetic 1024x1024 tiles.")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed repetitions per batch size.")
+    parser.add_argument("--batch-sizes", type=str, default="1,2,4,8")
+    parser.add_argument("--output", type=str, help="Optional JSON file for the results.")
+    args = parser.parse_args()
+
+    model_filepath = os.path.join(custom_processor.MODEL_PATH, custom_processor.MODEL_FILENAME)
+    dynamic_model_filepath = os.path.join(custom_processor.MODEL_PATH, custom_processor.DYNAMIC_MODEL_FILENAME)
+    if not os.path.exists(dynamic_model_filepath):
+        export_dynamic_batch_model(model_filepath, dynamic_model_filepath)
+
+    rng = np.random.default_rng(0)
+    tiles = [rng.integers(0, 255, (1024, 1024, 3), dtype=np.uint8) for _ in range(args.tiles)]
+
+    results = []
+    for batch_size in [int(b) for b in args.batch_sizes.split(",")]:
+
+        detector = ForagesROIsDetector(batch_size=batch_size)
+        detector.predict(tiles[:batch_size]) # Warm up
+
+        times = []
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            detector.predict(tiles)
+            times.append(time.perf_counter() - start)
+
+        best = min(times)
+        results.append({"batch_size": batch_size
+                        , "tiles": len(tiles)
+                        , "seconds": best
+                        , "tiles_per_second": len(tiles)/best
+                        , "model_batch_size": detector.model_batch_size
+                        })
+        print(f"batch_size={batch_size}: {len(tiles)/best:.2f} tiles/s ({best:.3f} s)")
+
+    print(json.dumps(results, indent=4))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
@@ -0,0 +1,67 @@
+import os
+import sys
+import json
+import time
+
+import numpy as np
+
+# Run from the local_app folder: python tests/bench_decode.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from custom_processor import sigmoid, prefilter_candidates
+
+# Decode cost of the logit space prefilter vs computing the sigmoid scores of every anchor,
+# on outputs where most anchors are background (the usual case)
+
+def full_sigmoid_candidates(outputs, conf_threshold):
+    output = np.squeeze(outputs[0], axis=0).transpose(1, 0)
+    scores = sigmoid(output[:, 4])[:, None] * sigmoid(output[:, 5:])
+    return np.flatnonzero(np.max(scores, axis=1) > conf_threshold)
+
+def prefiltered_candidates(outputs, conf_threshold):
+    output = np.squeeze(outputs[0], axis=0)
+    candidates = prefilter_candidates(output, conf_threshold)
+    output = output[:, candidates].transpose(1, 0)
+    scores = sigmoid(output[:, 4])[:, None] * sigmoid(output[:, 5:])
+    return candidates[np.max(scores, axis=1) > conf_threshold]
+
+def create_output(rng, foreground_fraction, num_classes=3, anchors=21504):
+    """
+    Raw output (1, 5+C, N) with a fraction of foreground anchors, the rest background logits.
+    """
+    centers = rng.uniform(0, 1024, (anchors, 2))
+    sizes = rng.normal(50, 8, (anchors, 2))
+    objectness = rng.normal(-8.0, 2.0, (anchors, 1))
+    classes = rng.normal(-4.0, 2.0, (anchors, num_classes))
+
+    foreground = rng.random(anchors) < foreground_fraction
+    objectness[foreground] = rng.normal(2.0, 1.5, (foreground.sum(), 1))
+    classes[foreground, 0] = rng.normal(2.0, 1.5, foreground.sum())
+
+    output = np.concatenate([centers, sizes, objectness, classes], axis=1).astype(np.float32)
+    return [np.ascontiguousarray(output.T[None])]
+
+def timeit(fc, repeats=50):
+    fc()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fc()
+    return (time.perf_counter() - start) / repeats * 1000
+
+if __name__ == "__main__":
+
+    rng = np.random.default_rng(0)
+    conf_threshold = 0.26
+
+    results = []
+    for foreground_fraction in [0.001, 0.01, 0.05]:
+        outputs = create_output(rng, foreground_fraction)
+        assert np.array_equal(full_sigmoid_candidates(outputs, conf_threshold), prefiltered_candidates(outputs, conf_threshold))
+
+        results.append({"foreground_fraction": foreground_fraction
+                        , "candidates": len(full_sigmoid_candidates(outputs, conf_threshold))
+                        , "full_sigmoid_scores_ms": timeit(lambda: full_sigmoid_candidates(outputs, conf_threshold))
+                        , "prefiltered_scores_ms": timeit(lambda: prefiltered_candidates(outputs, conf_threshold))
+                        })
+
+    print(json.dumps(results, indent=4))
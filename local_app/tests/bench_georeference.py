@@ -0,0 +1,76 @@
+import os
+import sys
+import json
+import time
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely.geometry
+from rasterio.coords import BoundingBox
+
+# Run from the local_app folder: python tests/bench_georeference.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from custom_processor import pos2coords, save_shapefile_bb, DETECTION_COLUMNS
+
+# Time of save_shapefile_bb (without writing) vs the previous row by row implementation
+
+def reference_save_shapefile_bb(df, extent, img_width, img_height, epsg, allow_cols=[]):
+
+    df_tree_polygons_test = pd.DataFrame()
+    tree_bb = []
+    count = 0
+
+    for index, detection in df.iterrows():
+        new_contour = [(detection["xmin"], detection["ymin"]), (detection["xmax"], detection["ymin"])
+                       , (detection["xmax"], detection["ymax"]), (detection["xmin"], detection["ymax"])]
+        coord_polygon = [pos2coords(point, extent, img_width, img_height) for point in new_contour]
+        mydic = {'Type': 'forage_plant'}
+        for col in allow_cols:
+            mydic[col] = detection[col]
+        df_tree_polygons_test = pd.concat((df_tree_polygons_test, pd.DataFrame(mydic, index=[count])))
+        tree_bb.append(shapely.geometry.Polygon(coord_polygon))
+        count = count + 1
+
+    gdf_trees = gpd.GeoDataFrame(df_tree_polygons_test, geometry=tree_bb).set_crs(epsg=epsg)
+    new_crs = f"+proj=cea +lat_0={extent.bottom} +lon_0={extent.left} +units=m"
+    gdf_trees["area_m2"] = gdf_trees.to_crs(new_crs).area
+    return gdf_trees
+
+def create_detections(rng, n):
+    xy = rng.uniform(0, 980, (n, 2)).astype(np.float32)
+    wh = rng.uniform(20, 44, (n, 2)).astype(np.float32)
+    values = [xy[:, 0], xy[:, 1], xy[:, 0] + wh[:, 0], xy[:, 1] + wh[:, 1]
+              , rng.uniform(0.26, 1, n).astype(np.float32), rng.integers(0, 3, n).astype(np.int32)]
+    return dict(zip(DETECTION_COLUMNS, values))
+
+if __name__ == "__main__":
+
+    rng = np.random.default_rng(0)
+    extent = BoundingBox(-76.35, 3.50, -76.349, 3.501)
+    epsg = "4326"
+
+    results = []
+    for n in [100, 500, 2000]:
+        detections = create_detections(rng, n)
+
+        start = time.perf_counter()
+        reference = reference_save_shapefile_bb(pd.DataFrame(detections), extent, 1024, 1024, epsg, ["score", "class"])
+        reference_seconds = time.perf_counter() - start
+
+        current_seconds = np.inf
+        for _ in range(3):
+            start = time.perf_counter()
+            current = save_shapefile_bb(detections, extent, 1024, 1024, epsg, ["score", "class"])
+            current_seconds = min(current_seconds, time.perf_counter() - start)
+
+        same = (all(a.equals_exact(b, 0) for a, b in zip(reference.geometry, current.geometry))
+                and np.allclose(reference["area_m2"], current["area_m2"], rtol=1e-9))
+
+        results.append({"detections": n
+                        , "reference_seconds": reference_seconds
+                        , "vectorized_seconds": current_seconds
+                        , "same_polygons_and_areas": bool(same)})
+
+    print(json.dumps(results, indent=4))
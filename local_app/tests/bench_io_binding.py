@@ -0,0 +1,70 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+# Run from the local_app folder: python tests/bench_io_binding.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from custom_processor import ForagesROIsDetector, IOBindingRunner
+
+# Latency and jitter of session runs with ort_sess.run vs IOBindingRunner, and number of distinct
+# output buffers returned over the runs (1 when the outputs are preallocated and reused)
+
+def time_runs(run_fc, runs):
+    run_fc() # warm up (first run of a shape creates the bindings and buffers)
+
+    seconds = []
+    addresses = set()
+    for _ in range(runs):
+        start = time.perf_counter()
+        outputs = run_fc()
+        seconds.append(time.perf_counter() - start)
+        addresses.add(outputs[0].ctypes.data)
+        del outputs
+    seconds = np.array(seconds)*1000
+
+    return {"mean_ms": float(seconds.mean())
+            , "p50_ms": float(np.percentile(seconds, 50))
+            , "p99_ms": float(np.percentile(seconds, 99))
+            , "std_ms": float(seconds.std())
+            , "distinct_output_buffers": len(addresses)}
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark IO binding session runs.")
+    parser.add_argument("--batch-sizes", type=str, default="1,2,4")
+    parser.add_argument("--runs", type=int, default=30)
+    parser.add_argument("--output", type=str, help="Optional JSON file for the results.")
+    args = parser.parse_args()
+
+    results = []
+    for batch_size in [int(b) for b in args.batch_sizes.split(",")]:
+        detector = ForagesROIsDetector(batch_size=batch_size)
+        detector.initialize()
+        if detector.model_batch_size is not None and detector.model_batch_size != batch_size:
+            print(f"Skipping batch size {batch_size}, the model has a fixed batch size of {detector.model_batch_size}")
+            continue
+
+        _, c, h, w = [d if isinstance(d, int) else 1024 for d in detector.ort_sess.get_inputs()[0].shape]
+        blob = np.random.default_rng(0).random((batch_size, c, h, w), dtype=np.float32)
+        input_name = detector.ort_sess.get_inputs()[0].name
+        runner = IOBindingRunner(detector.ort_sess)
+
+        run = time_runs(lambda: detector.ort_sess.run(None, {input_name: blob}), args.runs)
+        bound = time_runs(lambda: runner.run(blob), args.runs)
+
+        same = all(np.array_equal(a, b) for a, b in zip(detector.ort_sess.run(None, {input_name: blob}), runner.run(blob)))
+
+        results.append({"batch_size": batch_size, "run": run, "io_binding": bound, "same_outputs": same})
+        print(f"batch {batch_size}: run {run['mean_ms']:.1f} ms (p99 {run['p99_ms']:.1f}, {run['distinct_output_buffers']} output buffers)"
+              f", io binding {bound['mean_ms']:.1f} ms (p99 {bound['p99_ms']:.1f}, {bound['distinct_output_buffers']} output buffers)")
+
+    print(json.dumps(results, indent=4))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
@@ -0,0 +1,58 @@
+import os
+import sys
+import json
+import time
+import tracemalloc
+
+import numpy as np
+
+# Run from the local_app folder: python tests/bench_preprocess.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from custom_processor import preprocess, LetterboxPreprocessor
+
+# Per tile preprocess time and memory churn of preprocess() vs LetterboxPreprocessor
+
+def measure(fc, images, repeats=20):
+
+    fc(images[0]) # Warm up buffers
+
+    tracemalloc.start()
+    peaks = []
+    for image in images:
+        tracemalloc.reset_peak()
+        current, _ = tracemalloc.get_traced_memory()
+        fc(image)
+        _, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - current)
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for image in images:
+            fc(image)
+    seconds = (time.perf_counter() - start) / (repeats*len(images))
+
+    return {"ms_per_tile": seconds*1000, "peak_allocated_mb_per_tile": max(peaks)/(1024*1024)}
+
+if __name__ == "__main__":
+
+    rng = np.random.default_rng(0)
+
+    # Full tiles (no resize needed) and edge tiles (resized)
+    cases = {
+        "full_tile_1024x1024": [rng.integers(0, 255, (1024, 1024, 3), dtype=np.uint8) for _ in range(4)],
+        "edge_tile_1024x600": [rng.integers(0, 255, (1024, 600, 3), dtype=np.uint8) for _ in range(4)],
+        "small_image_800x700": [rng.integers(0, 255, (800, 700, 3), dtype=np.uint8) for _ in range(4)],
+    }
+
+    preprocessor = LetterboxPreprocessor(batch_size=1)
+
+    results = {}
+    for name, images in cases.items():
+        results[name] = {
+            "preprocess": measure(lambda image: preprocess(image), images),
+            "LetterboxPreprocessor": measure(lambda image: preprocessor.preprocess_batch([image]), images),
+        }
+
+    print(json.dumps(results, indent=4))
@@ -0,0 +1,154 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+
+import numpy as np
+
+# Run from the local_app folder (models in ./models): python tests/bench_suite.py --sizes 2048,8192 --output bench.json
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from interface.processor import Processor
+from interface.profiling import PROFILER
+from synthetic_orthomosaic import create_orthomosaic
+
+# End to end benchmark of the Processor tasks over synthetic orthomosaics, offline on CPU. Every task
+# runs in this process (model sessions are reused between runs like in the GUI and the daemon) and
+# reports its wall time and the time of its internal stages (the stage timers of PROFILER) as JSON,
+# to compare releases on the same hardware.
+
+TASKS = ["detection", "tiling_detection", "tiling_detection_only", "postprocessing", "plot_numbering"]
+
+# Size of the single image of the detection task
+DETECTION_IMAGE_SIZE = 1024
+
+def environment():
+    import onnxruntime
+    return {"python": platform.python_version()
+            , "platform": platform.platform()
+            , "processor": platform.processor()
+            , "cpu_count": os.cpu_count()
+            , "numpy": np.__version__
+            , "onnxruntime": onnxruntime.__version__
+            , "providers": onnxruntime.get_available_providers()}
+
+def count_features(filepath):
+    import geopandas as gpd
+    if filepath and os.path.exists(filepath):
+        return len(gpd.read_file(filepath))
+    return None
+
+def task_params(task, raster, image, folder, name):
+    """
+    Input and output of a task: the detection task runs on a single image, the postprocessing and
+    plot_numbering tasks on the plots of the synthetic lattice (independent of the model).
+    """
+    if task == "detection":
+        output_folder = os.path.join(folder, name)
+        return {"input_file": image["filepath"], "output_folder": output_folder}, os.path.join(output_folder, "image_boxes.shp")
+    if task in ("postprocessing", "plot_numbering"):
+        output = os.path.join(folder, f"{name}.shp")
+        return {"input_file": raster["plots_filepath"], "output_folder": output}, output
+    output = os.path.join(folder, f"{name}.shp")
+    return {"input_file": raster["filepath"], "output_folder": output}, output
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark the Processor tasks over synthetic orthomosaics.")
+    parser.add_argument("--sizes", type=str, default="2048,4096", help="Comma separated raster sizes in pixels (1k to 40k).")
+    parser.add_argument("--tasks", type=str, default=",".join(TASKS))
+    parser.add_argument("--repeat", type=int, default=1, help="Runs of each task, the first one includes the model load.")
+    parser.add_argument("--crs", type=str, default="EPSG:32618")
+    parser.add_argument("--pixel-size", type=float, default=0.02, help="Ground sampling distance in meters.")
+    parser.add_argument("--plot-size", type=str, default="1.2,1.8", help="Plot width,height in meters.")
+    parser.add_argument("--plot-gap", type=str, default="0.5,0.75", help="Gap between plots x,y in meters.")
+    parser.add_argument("--angle", type=float, default=0.0, help="Rotation of the plot lattice in degrees.")
+    parser.add_argument("--param", action="append", default=[], help="Extra Processor param as key=value (JSON value), e.g. --param batch_size=4.")
+    parser.add_argument("--workdir", type=str, help="Folder of the rasters and outputs, a temp folder removed at the end by default.")
+    parser.add_argument("--output", type=str, help="Optional JSON file for the results.")
+    args = parser.parse_args()
+
+    extra_params = {}
+    for param in args.param:
+        key, value = param.split("=", 1)
+        try:
+            extra_params[key] = json.loads(value)
+        except json.JSONDecodeError:
+            extra_params[key] = value
+    # Every run starts from scratch
+    extra_params.setdefault("checkpoint", False)
+
+    tasks = [task for task in args.tasks.split(",") if task]
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    plot_size = tuple(float(v) for v in args.plot_size.split(","))
+    plot_gap = tuple(float(v) for v in args.plot_gap.split(","))
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="foragesrois_bench_")
+    # label_polygons_from_shapefile saves debug points in ./local
+    os.makedirs("local", exist_ok=True)
+
+    report = {"environment": environment()
+              , "config": {"sizes": sizes, "tasks": tasks, "repeat": args.repeat, "crs": args.crs
+                           , "pixel_size_m": args.pixel_size, "plot_size_m": plot_size, "plot_gap_m": plot_gap
+                           , "angle": args.angle, "params": extra_params}
+              , "rasters": []
+              , "results": []}
+
+    try:
+        image = None
+        if "detection" in tasks:
+            image = create_orthomosaic(os.path.join(workdir, "image.tif"), DETECTION_IMAGE_SIZE, crs=args.crs
+                                       , pixel_size_m=args.pixel_size, plot_size_m=plot_size, plot_gap_m=plot_gap, angle=args.angle)
+
+        for size in sizes:
+            raster = create_orthomosaic(os.path.join(workdir, f"field_{size}.tif"), size, crs=args.crs
+                                        , pixel_size_m=args.pixel_size, plot_size_m=plot_size, plot_gap_m=plot_gap
+                                        , angle=args.angle, plots_filepath=os.path.join(workdir, f"field_{size}_plots.shp"))
+            report["rasters"].append(raster)
+            print(f"raster {size}x{size}: {raster['plots']} plots, {raster['megabytes']:.1f} MB in {raster['seconds']:.1f} s")
+
+            for task in tasks:
+                if task == "detection" and size != sizes[0]:
+                    continue # The single image does not depend on the raster size
+
+                for run in range(args.repeat):
+                    name = f"{task}_{size}_{run}"
+                    params, output = task_params(task, raster, image, workdir, name)
+                    params = dict(extra_params, task=task, **params)
+
+                    start = time.perf_counter()
+                    PROFILER.enable()
+                    try:
+                        results = Processor(params).run()
+                        status = results.get("status")
+                    except Exception as e:
+                        status = f"error: {e}"
+                    finally:
+                        stages = PROFILER.report()["stages"]
+                        PROFILER.disable()
+                    seconds = time.perf_counter() - start
+
+                    result = {"task": task
+                              , "size": DETECTION_IMAGE_SIZE if task == "detection" else size
+                              , "run": run
+                              , "status": status
+                              , "seconds": round(seconds, 4)
+                              , "megapixels_per_second": round((DETECTION_IMAGE_SIZE if task == "detection" else size)**2/1e6/seconds, 3)
+                              , "features": count_features(output)
+                              , "stages": stages}
+                    report["results"].append(result)
+                    print(f"{task} {result['size']} run {run}: {status} in {seconds:.2f} s, {result['features']} features")
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(json.dumps(report, indent=4, default=str))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4, default=str)
@@ -0,0 +1,67 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+import rasterio as rio
+from rasterio.transform import from_origin
+
+# Run from the local_app folder: python tests/bench_workers.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from custom_processor import ForagesROIsDetector
+
+# Scaling of batch_processing with 1, 2, 4 and 8 worker processes over synthetic GeoTIFF tiles
+
+def create_tiles(folder, count, size=1024):
+    rng = np.random.default_rng(0)
+    for i in range(count):
+        transform = from_origin(-76.35 + i*0.01, 3.5, 1e-5, 1e-5)
+        with rio.open(os.path.join(folder, f"{i}.tif"), "w", driver="GTiff", width=size, height=size, count=3
+                      , dtype="uint8", crs="EPSG:4326", transform=transform) as dst:
+            dst.write(rng.integers(0, 255, (3, size, size), dtype=np.uint8))
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark multi-process batch processing.")
+    parser.add_argument("--tiles", type=int, default=32, help="Number of synthetic 1024x1024 GeoTIFF tiles.")
+    parser.add_argument("--workers", type=str, default="1,2,4,8")
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--output", type=str, help="Optional JSON file for the results.")
+    args = parser.parse_args()
+
+    tiles_folder = tempfile.mkdtemp(prefix="foragesrois_tiles_")
+    create_tiles(tiles_folder, args.tiles)
+
+    results = []
+    try:
+        for workers in [int(w) for w in args.workers.split(",")]:
+            output_folder = tempfile.mkdtemp(prefix="foragesrois_shp_")
+
+            detector = ForagesROIsDetector(batch_size=args.batch_size, workers=workers)
+
+            start = time.perf_counter()
+            detector.batch_processing(tiles_folder, output_folder)
+            seconds = time.perf_counter() - start
+
+            shutil.rmtree(output_folder, ignore_errors=True)
+
+            results.append({"workers": workers
+                            , "tiles": args.tiles
+                            , "cpu_count": os.cpu_count()
+                            , "seconds": seconds
+                            , "tiles_per_second": args.tiles/seconds
+                            })
+            print(f"workers={workers}: {args.tiles/seconds:.2f} tiles/s ({seconds:.1f} s, including worker start up)")
+    finally:
+        shutil.rmtree(tiles_folder, ignore_errors=True)
+
+    print(json.dumps(results, indent=4))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
@@ -0,0 +1,65 @@
+import os
+import sys
+import argparse
+import tempfile
+
+import numpy as np
+import rasterio as rio
+import geopandas as gpd
+
+# Run from the local_app folder: python tests/check_input_dtypes.py --input x.tif [--size 1024]
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from custom_processor import ForagesROIsDetector, LetterboxPreprocessor
+from interface.processor import Processor
+
+# Saves a crop of an 8-bit raster also as 16-bit (x257, the same image at full 16-bit range) and
+# float32, and checks that the three give the same model input and the same detections, with
+# predict and with the in-memory tiling path.
+
+def save_crop(src_filepath, filepath, size, dtype, factor):
+    with rio.open(src_filepath) as src:
+        window = rio.windows.Window(0, 0, min(size, src.width), min(size, src.height))
+        data = src.read(window=window)
+        profile = dict(src.profile, width=window.width, height=window.height
+                       , transform=src.window_transform(window), dtype=dtype)
+        profile.pop("nodata", None)
+    with rio.open(filepath, "w", **profile) as dst:
+        dst.write((data.astype(np.float64)*factor).astype(dtype))
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Check that 16-bit and float rasters are detected like 8-bit rasters.")
+    parser.add_argument("--input", type=str, required=True, help="8-bit RGB GeoTIFF.")
+    parser.add_argument("--size", type=int, default=1024)
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix="dtypes_")
+    cases = {"uint8": ("uint8", 1), "uint16": ("uint16", 257), "float32": ("float32", 1)}
+    filepaths = {}
+    for name, (dtype, factor) in cases.items():
+        filepaths[name] = os.path.join(folder, f"{name}.tif")
+        save_crop(args.input, filepaths[name], args.size, dtype, factor)
+
+    detector = ForagesROIsDetector()
+    preprocessor = LetterboxPreprocessor(imgsz=1024, batch_size=1)
+
+    reference = None
+    for name, filepath in filepaths.items():
+        np_image = detector.read_input(filepath)[0]
+        preprocessor.preprocess_into(np_image, 0, band_first=True)
+        blob = preprocessor.batch_tensor([0]).copy()
+        detections = len(detector.predict([np_image], band_first=True)[0][1][0])
+
+        output = os.path.join(folder, f"{name}_tiles.shp")
+        Processor({"task": "tiling_detection_only", "input_file": filepath, "output_folder": output, "checkpoint": False}).run()
+        tiled = len(gpd.read_file(output)) if os.path.exists(output) else 0
+
+        print(f"{name}: input max {blob.max():.3f}, {detections} detections, {tiled} tiled detections")
+        if reference is None:
+            reference = (blob, detections, tiled)
+            continue
+        assert np.abs(blob - reference[0]).max() < 1e-6, name
+        assert (detections, tiled) == reference[1:], (name, detections, tiled, reference[1:])
+
+    print(f"Same inputs and detections for {', '.join(cases)} (files in {folder})")
@@ -0,0 +1,143 @@
+import os
+import sys
+import time
+
+import numpy as np
+import cv2 as cv
+
+# Run from the local_app folder: python tests/check_nms_regression.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import custom_processor
+from custom_processor import sigmoid, xywh2xyxy, postprocess_yolo_output, nms_boxes
+
+# Regression check of the vectorized class aware NMS against the previous
+# per class cv.dnn.NMSBoxes implementation of postprocess_yolo_output
+
+def reference_postprocess(outputs, conf_threshold=0.3, nms_threshold=0.5, input_size=1024, orig_shape=(1024, 1024)):
+
+    output = np.squeeze(outputs[0], axis=0).transpose(1, 0)
+
+    boxes_xywh = output[:, :4]
+    scores = sigmoid(output[:, 4])[:, None] * sigmoid(output[:, 5:])
+    class_ids = np.argmax(scores, axis=1)
+    confidences = np.max(scores, axis=1)
+
+    mask = confidences > conf_threshold
+    boxes_xywh = boxes_xywh[mask]
+    class_ids = class_ids[mask]
+    confidences = confidences[mask]
+
+    boxes_xyxy = xywh2xyxy(boxes_xywh)
+    gain = input_size / max(orig_shape)
+    boxes_xyxy[:, [0, 2]] -= (input_size - orig_shape[1] * gain) / 2
+    boxes_xyxy[:, [1, 3]] -= (input_size - orig_shape[0] * gain) / 2
+    boxes_xyxy /= gain
+    boxes_xyxy = np.clip(boxes_xyxy, 0, [orig_shape[1], orig_shape[0], orig_shape[1], orig_shape[0]])
+
+    final_boxes = []
+    final_scores = []
+    final_classes = []
+    for cls in np.unique(class_ids):
+        cls_mask = class_ids == cls
+        cls_boxes = boxes_xyxy[cls_mask]
+        cls_scores = confidences[cls_mask]
+
+        boxes_nms = cls_boxes.copy()
+        boxes_nms[:, 2] -= boxes_nms[:, 0]
+        boxes_nms[:, 3] -= boxes_nms[:, 1]
+
+        indices = cv.dnn.NMSBoxes(bboxes=boxes_nms.tolist(), scores=cls_scores.tolist()
+                                  , score_threshold=conf_threshold, nms_threshold=nms_threshold)
+        if len(indices) > 0:
+            indices = np.array(indices).flatten()
+            final_boxes.append(cls_boxes[indices])
+            final_scores.append(cls_scores[indices])
+            final_classes.append(np.full(len(indices), cls, dtype=np.int32))
+
+    final_boxes = np.concatenate([np.concatenate(final_boxes), np.concatenate(final_scores)[:, None]], axis=1)
+    return [[final_boxes], [np.concatenate(final_classes)]]
+
+def create_fixture(seed, num_classes=3, anchors=21504):
+    """
+    Dense raw output (1, 5+C, N): many overlapping boxes around a lattice of plots.
+    """
+    rng = np.random.default_rng(seed)
+
+    centers = rng.integers(0, 16, (anchors, 2)) * 64 + 32 + rng.normal(0, 6, (anchors, 2))
+    sizes = rng.normal(50, 8, (anchors, 2))
+    objectness = rng.normal(-1.0, 1.5, (anchors, 1))
+    classes = rng.normal(0, 2, (anchors, num_classes))
+
+    output = np.concatenate([centers, sizes, objectness, classes], axis=1).astype(np.float32)
+    return [output.T[None]]
+
+def create_chain(count, step=8.0, size=40.0):
+    """
+    Boxes (N, 4) xyxy in a chain, each one overlapping the next ones, by decreasing score: the
+    worst case of greedy NMS resolved layer by layer.
+    """
+    x1 = np.arange(count, dtype=np.float32) * step
+    boxes = np.stack([x1, np.zeros(count, np.float32), x1 + size, np.full(count, size, np.float32)], axis=1)
+    scores = np.linspace(0.99, 0.3, count).astype(np.float32)
+    return boxes, scores
+
+if __name__ == "__main__":
+
+    failed = 0
+    for seed in range(5):
+        for conf_threshold, nms_threshold in [(0.26, 0.2), (0.05, 0.5), (0.1, 0.7)]:
+            outputs = create_fixture(seed)
+
+            start = time.perf_counter()
+            reference = reference_postprocess(outputs, conf_threshold, nms_threshold)
+            reference_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            current = postprocess_yolo_output(outputs, conf_threshold, nms_threshold)
+            current_seconds = time.perf_counter() - start
+
+            same = (current[0][0].shape == reference[0][0].shape
+                    and np.array_equal(current[1][0], reference[1][0])
+                    and np.allclose(current[0][0], reference[0][0], atol=1e-3))
+            failed += not same
+
+            print(f"seed={seed} conf={conf_threshold} nms={nms_threshold}: {len(reference[0][0])} boxes"
+                  f", reference {reference_seconds*1000:.1f} ms, vectorized {current_seconds*1000:.1f} ms"
+                  f", {'OK' if same else 'MISMATCH'}")
+
+    # Small candidate sets (cv.dnn.NMSBoxes path of nms_boxes), also forced through the sparse path
+    for sparse_min_boxes in [custom_processor.NMS_SPARSE_MIN_BOXES, 0]:
+        custom_processor.NMS_SPARSE_MIN_BOXES = sparse_min_boxes
+        for seed in range(5):
+            outputs = create_fixture(seed, anchors=600)
+            reference = reference_postprocess(outputs, 0.26, 0.2)
+            current = postprocess_yolo_output(outputs, 0.26, 0.2)
+            same = (current[0][0].shape == reference[0][0].shape
+                    and np.array_equal(current[1][0], reference[1][0])
+                    and np.allclose(current[0][0], reference[0][0], atol=1e-3))
+            failed += not same
+            print(f"small seed={seed} sparse from {sparse_min_boxes} boxes: {len(reference[0][0])} boxes, {'OK' if same else 'MISMATCH'}")
+
+    for count in [10000, 20000]:
+        boxes, scores = create_chain(count)
+
+        start = time.perf_counter()
+        xywh = boxes.copy()
+        xywh[:, 2:] -= xywh[:, :2]
+        reference = np.array(cv.dnn.NMSBoxes(bboxes=xywh.tolist(), scores=scores.tolist()
+                                             , score_threshold=0.0, nms_threshold=0.5)).flatten()
+        reference_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        current = nms_boxes(boxes, scores, np.zeros(count, dtype=np.int64), 0.5)
+        current_seconds = time.perf_counter() - start
+
+        same = np.array_equal(np.sort(current), np.sort(reference))
+        failed += not same
+
+        print(f"chain of {count} boxes: {len(reference)} kept, reference {reference_seconds*1000:.1f} ms"
+              f", vectorized {current_seconds*1000:.1f} ms, {'OK' if same else 'MISMATCH'}")
+
+    print("All results identical" if failed == 0 else f"{failed} mismatches")
+    sys.exit(1 if failed else 0)
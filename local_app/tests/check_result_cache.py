@@ -0,0 +1,87 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+import geopandas as gpd
+
+# Run from the local_app folder: python tests/check_result_cache.py [--input x.tif --output y.shp]
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import custom_processor
+from interface.resultcache import ResultCache
+from interface.processor import Processor
+
+# Checks the put / get / eviction of the result cache, and optionally runs a tiling detection with
+# the cache: a cold run, a warm run and a run with another NMS threshold, which must not load the
+# model and must give the detections of a run without the cache.
+
+# Count the detectors getting a model session
+MODEL_LOADS = [0]
+initialize = custom_processor.ForagesROIsDetector.initialize
+
+def counting_initialize(self):
+    MODEL_LOADS[0] += self.ort_sess is None
+    return initialize(self)
+
+custom_processor.ForagesROIsDetector.initialize = counting_initialize
+
+def check_entries(cache_dir):
+    cache = ResultCache(cache_dir, max_mb=0.01)
+    rng = np.random.default_rng(0)
+
+    image = rng.integers(0, 255, (3, 64, 64), dtype=np.uint8)
+    key = cache.make_key(image, __file__, {"band_first": True, "imgsz": 1024, "input_stride": None})
+    assert key != cache.make_key(image, __file__, {"band_first": True, "imgsz": 1024, "input_stride": 32}), "signature not in the key"
+    assert key != cache.make_key(image[:, ::-1], __file__, {"band_first": True, "imgsz": 1024, "input_stride": None}), "pixels not in the key"
+    assert cache.get(key, 0.05) is None
+
+    candidates = (rng.random((4, 4), dtype=np.float32), rng.random(4, dtype=np.float32), rng.random((4, 2), dtype=np.float32))
+    cache.put(key, candidates, 0.05)
+    cached = cache.get(key, 0.26)
+    assert all(np.array_equal(a, b) for a, b in zip(candidates, cached))
+    assert cache.get(key, 0.01) is None, "candidates decoded with a higher threshold served"
+
+    # Fill over the cap, the oldest entries are removed and the folder stays below it
+    for i in range(40):
+        cache.put(f"{i:040x}", candidates, 0.05)
+    total = sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(cache_dir) for f in files)
+    assert total <= cache.max_bytes, total
+    assert cache.get(f"{39:040x}", 0.05) is not None and cache.get(f"{0:040x}", 0.05) is None
+
+    print(f"entries ok ({len(cache.index)} entries, {total} bytes), {cache.summary()}")
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Check the detections result cache.")
+    parser.add_argument("--input", type=str, help="Optional raster for a cold and a warm tiling_detection run.")
+    parser.add_argument("--output", type=str)
+    args = parser.parse_args()
+
+    cache_dir = tempfile.mkdtemp(prefix="result_cache_")
+    try:
+        check_entries(os.path.join(cache_dir, "entries"))
+
+        if args.input:
+            params = {"task": "tiling_detection", "input_file": args.input, "output_folder": args.output
+                      , "checkpoint": False, "result_cache": True, "result_cache_dir": os.path.join(cache_dir, "run")}
+            for name, run_params in [("cold", {}), ("warm", {}), ("nms 0.3", {"nms_threshold": 0.3})]:
+                model_loads = MODEL_LOADS[0]
+                start = time.perf_counter()
+                results = Processor(dict(params, **run_params)).run()
+                loaded = MODEL_LOADS[0] > model_loads
+                print(f"{name} run: {results['status']} in {time.perf_counter() - start:.2f} s, model loaded: {loaded}")
+                assert name == "cold" or not loaded, f"{name} run loaded the model"
+
+            # The run with the new threshold from the cache gives the detections of an uncached run
+            cached_detections = gpd.read_file(args.output)
+            Processor(dict(params, nms_threshold=0.3, result_cache=False)).run()
+            detections = gpd.read_file(args.output)
+            assert len(cached_detections) == len(detections), (len(cached_detections), len(detections))
+            assert np.allclose(np.sort(cached_detections.total_bounds), np.sort(detections.total_bounds))
+            print(f"nms 0.3 from the cache: {len(cached_detections)} detections, same as without the cache")
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
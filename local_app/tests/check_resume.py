@@ -0,0 +1,72 @@
+import os
+import sys
+import json
+import argparse
+import tempfile
+
+import geopandas as gpd
+
+# Run from the local_app folder: python tests/check_resume.py --input x.tif [--fail-after 5 --pipeline]
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import custom_processor
+from interface.processor import Processor
+
+# Interrupts a tiling detection after some tiles (simulated crash), runs it again to resume from
+# the run manifest and compares the result with an uninterrupted run.
+
+class SimulatedCrash(Exception):
+    pass
+
+def crash_after(count):
+    """
+    Make save_shapefile_bb (called once per completed tile) raise after count tiles.
+    """
+    original = custom_processor.save_shapefile_bb
+    calls = [0]
+
+    def save_shapefile_bb(*args, **kwargs):
+        calls[0] += 1
+        if calls[0] > count:
+            raise SimulatedCrash(f"simulated crash after {count} tiles")
+        return original(*args, **kwargs)
+
+    custom_processor.save_shapefile_bb = save_shapefile_bb
+    return original
+
+def manifest_summary(filepath):
+    with open(filepath) as f:
+        manifest = json.load(f)
+    return manifest["status"], manifest["counts"]
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Check the checkpoint and resume of tiling_detection.")
+    parser.add_argument("--input", type=str, required=True)
+    parser.add_argument("--fail-after", type=int, default=5)
+    parser.add_argument("--pipeline", action="store_true")
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix="resume_")
+    params = {"task": "tiling_detection", "input_file": args.input, "pipeline": args.pipeline}
+
+    Processor(dict(params, output_folder=os.path.join(folder, "full.shp"))).run()
+
+    output = os.path.join(folder, "resumed.shp")
+    original = crash_after(args.fail_after)
+    try:
+        Processor(dict(params, output_folder=output)).run()
+        raise AssertionError("the run did not crash")
+    except SimulatedCrash as e:
+        print(f"interrupted: {e}, manifest {manifest_summary(os.path.join(folder, 'resumed_manifest.json'))}")
+    finally:
+        custom_processor.save_shapefile_bb = original
+
+    Processor(dict(params, output_folder=output)).run()
+    print(f"resumed: manifest {manifest_summary(os.path.join(folder, 'resumed_manifest.json'))}")
+
+    full = gpd.read_file(os.path.join(folder, "full.shp"))
+    resumed = gpd.read_file(output)
+    assert len(full) == len(resumed), (len(full), len(resumed))
+    assert (full["score"].round(6).sort_values().values == resumed["score"].round(6).sort_values().values).all()
+    print(f"{len(resumed)} detections, same as the uninterrupted run (outputs in {folder})")
@@ -0,0 +1,57 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import geopandas as gpd
+
+# Run from the local_app folder: python tests/check_rethreshold.py --input x.tif [--conf 0.4 --nms 0.3]
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from interface.processor import Processor
+
+# Runs a tiling detection saving the raw candidates, then compares the rethreshold task with a
+# detection run with the same thresholds (same boxes and scores expected) and reports the times.
+
+def run(params):
+    start = time.perf_counter()
+    results = Processor(dict(params)).run()
+    assert results["status"] == "completed", results
+    return time.perf_counter() - start
+
+def compare(filepath_a, filepath_b):
+    gdf_a = gpd.read_file(filepath_a)
+    gdf_b = gpd.read_file(filepath_b)
+    assert len(gdf_a) == len(gdf_b), (len(gdf_a), len(gdf_b))
+    same_scores = (gdf_a["score"].round(6).sort_values().values == gdf_b["score"].round(6).sort_values().values).all()
+    assert same_scores, "different scores"
+    return len(gdf_a)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Check the rethreshold task against detection runs.")
+    parser.add_argument("--input", type=str, required=True)
+    parser.add_argument("--conf", type=float, default=0.4)
+    parser.add_argument("--nms", type=float, default=0.3)
+    parser.add_argument("--pipeline", action="store_true")
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix="rethreshold_")
+    base = {"task": "tiling_detection", "input_file": args.input, "pipeline": args.pipeline}
+
+    seconds = run(dict(base, output_folder=os.path.join(folder, "run.shp"), save_candidates=True))
+    print(f"detection with candidates: {seconds:.2f} s")
+    candidates_file = os.path.join(folder, "run_candidates.npz")
+
+    seconds = run({"task": "rethreshold", "input_file": candidates_file, "output_folder": os.path.join(folder, "same.shp")})
+    count = compare(os.path.join(folder, "run.shp"), os.path.join(folder, "same.shp"))
+    print(f"rethreshold with the run thresholds: {seconds:.2f} s, {count} detections, same as the run")
+
+    thresholds = {"conf_threshold": args.conf, "nms_threshold": args.nms}
+    detection_seconds = run(dict(base, output_folder=os.path.join(folder, "detection.shp"), **thresholds))
+    seconds = run(dict({"task": "rethreshold", "input_file": candidates_file, "output_folder": os.path.join(folder, "other.shp")}, **thresholds))
+    count = compare(os.path.join(folder, "detection.shp"), os.path.join(folder, "other.shp"))
+    print(f"conf {args.conf} nms {args.nms}: detection {detection_seconds:.2f} s, rethreshold {seconds:.2f} s, {count} detections in both")
+
+    print(f"outputs in {folder}")
@@ -0,0 +1,61 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+# Drives ForagesROIs.py --serve-stdio through its JSON lines protocol and reports the time of each request.
+# Run from the local_app folder: python tests/check_serve_stdio.py [--task tiling_detection --input x.tif --output y.shp]
+
+APP_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def request(process, message):
+    process.stdin.write(json.dumps(message) + "\n")
+    process.stdin.flush()
+
+    logs = 0
+    progress = 0
+    while True:
+        line = process.stdout.readline()
+        if not line:
+            raise RuntimeError("Daemon stopped unexpectedly.")
+        response = json.loads(line)
+        if response["event"] == "log":
+            logs += 1
+        elif response["event"] == "progress":
+            progress += 1
+        elif response["event"] == "result":
+            return response, logs, progress
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Check the --serve-stdio daemon protocol.")
+    parser.add_argument("--task", type=str, help="Optional task run twice to compare a cold and a warm run.")
+    parser.add_argument("--input", type=str)
+    parser.add_argument("--output", type=str)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "ForagesROIs.py", "--serve-stdio"], cwd=APP_FOLDER
+                               , stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    ready = json.loads(process.stdout.readline())
+    assert ready["event"] == "ready", ready
+    print(f"ready in {time.perf_counter() - start:.2f} s (pid {ready['pid']})")
+
+    requests = [{"id": 1, "command": "ping"}, {"id": 2, "task": "invalid_task"}, {"id": 3, "task": "release_models"}]
+    if args.task:
+        params = {"task": args.task, "input_file": args.input, "output_folder": args.output}
+        requests += [dict(params, id=4), dict(params, id=5)]
+    requests.append({"id": 6, "command": "shutdown"})
+
+    for message in requests:
+        start = time.perf_counter()
+        response, logs, progress = request(process, message)
+        assert response["id"] == message["id"], response
+        results = response["results"]
+        print(f"request {message['id']}: {results['status']} in {time.perf_counter() - start:.2f} s"
+              f" ({logs} log lines, {progress} progress messages) {results.get('message', '')}")
+
+    process.wait(timeout=10)
+    print(f"daemon exit code {process.returncode}")
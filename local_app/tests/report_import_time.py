@@ -0,0 +1,90 @@
+import os
+import re
+import sys
+import json
+import argparse
+import subprocess
+
+# Import time breakdown (python -X importtime) of the CLI entry points, to track cold start regressions.
+# Run from the local_app folder: python tests/report_import_time.py
+
+APP_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that should only be loaded by the tasks needing them
+HEAVY_MODULES = ["onnxruntime", "cv2", "rasterio", "sklearn", "PySide6", "geopandas", "pandas", "shapely", "pyproj"]
+
+# Code run for each scenario, the task scenarios import what Processor.run imports for them.
+# The lazy modules are imported with import statements: -X importtime does not report the top
+# module of importlib.import_module calls
+SCENARIOS = {
+    "processor": "import interface.processor",
+    "plot_numbering": "import interface.processor; from custom_processor import ForagesROIsDetector",
+    "detection": ("import interface.processor; from custom_processor import ForagesROIsDetector"
+                  "; import onnxruntime, cv2, rasterio, rasterio.mask"),
+    "quantization": "import interface.processor; import quantization; import onnxruntime, cv2",
+}
+
+IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+
+def import_times(code):
+    """
+    Run code in a new interpreter with -X importtime.
+
+    Returns:
+        list: (module, self microseconds, cumulative microseconds, nesting level) of each import.
+    """
+
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code]
+                            , cwd=APP_FOLDER, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Scenario failed: {code}\n{result.stderr[-2000:]}")
+
+    imports = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            imports.append((module, int(self_us), int(cumulative_us), (len(indent) - 1)//2))
+    return imports
+
+def scenario_report(code, top=10):
+
+    imports = import_times(code)
+
+    # Top level imports add up to the total import time
+    total_us = sum(cumulative for _, _, cumulative, level in imports if level == 0)
+    loaded = {module for module, _, _, _ in imports}
+
+    heavy = {}
+    for name in HEAVY_MODULES:
+        times = [cumulative for module, _, cumulative, _ in imports if module == name]
+        heavy[name] = round(max(times)/1000, 1) if times else None
+
+    slowest = sorted(imports, key=lambda x: x[1], reverse=True)[:top]
+
+    return {"code": code
+            , "total_ms": round(total_us/1000, 1)
+            , "modules": len(loaded)
+            , "heavy_modules_ms": heavy
+            , "top_self_ms": [{"module": module, "self_ms": round(self_us/1000, 1)} for module, self_us, _, _ in slowest]
+            }
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Report the import time of the CLI tasks.")
+    parser.add_argument("--scenarios", type=str, default=",".join(SCENARIOS), help="Comma separated scenarios.")
+    parser.add_argument("--top", type=int, default=10, help="Slowest modules (self time) listed per scenario.")
+    parser.add_argument("--output", type=str, help="Optional JSON file for the report.")
+    args = parser.parse_args()
+
+    report = {}
+    for name in args.scenarios.split(","):
+        report[name] = scenario_report(SCENARIOS[name], top=args.top)
+        loaded = [module for module, ms in report[name]["heavy_modules_ms"].items() if ms is not None]
+        print(f"{name}: {report[name]['total_ms']:.0f} ms, heavy modules loaded: {', '.join(loaded) or 'none'}")
+
+    print(json.dumps(report, indent=4))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
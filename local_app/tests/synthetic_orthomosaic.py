@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import argparse
+
+import numpy as np
+import geopandas as gpd
+import rasterio as rio
+from rasterio.transform import from_origin
+from shapely.geometry import Polygon
+from pyproj import CRS, Transformer
+
+# Synthetic georeferenced orthomosaics of a field trial: a lattice of rectangular green plots over
+# bare soil, rendered in strips of rows so rasters of 40k x 40k pixels do not need to fit in memory.
+# Run from the local_app folder: python tests/synthetic_orthomosaic.py --size 4096 --output field.tif
+
+# Center of the field (lon, lat), transformed to the CRS of the raster
+DEFAULT_CENTER = (-76.35, 3.5)
+
+# Approximate meters per degree of latitude, used for geographic CRS
+METERS_PER_DEGREE = 111320.0
+
+def crs_units_per_meter(crs, center):
+    """
+    CRS units per meter at the field center (1 for projected CRS in meters).
+    """
+    crs = CRS.from_user_input(crs)
+    if crs.is_geographic:
+        return 1/(METERS_PER_DEGREE*np.cos(np.radians(center[1])))
+    return 1/crs.axis_info[0].unit_conversion_factor
+
+def lattice(width, height, pixel_size_m=0.02, plot_size_m=(1.2, 1.8), plot_gap_m=(0.5, 0.75), angle=0.0, margin=0.05):
+    """
+    Plot lattice filling the raster minus a margin, in meters relative to the raster center.
+
+    Returns:
+        dict: rows, cols, pitch (x, y), plot size and angle of the lattice.
+    """
+    pitch = (plot_size_m[0] + plot_gap_m[0], plot_size_m[1] + plot_gap_m[1])
+
+    # Rotated lattices must still fit in the raster
+    theta = np.radians(angle)
+    fit = 1/(abs(np.cos(theta)) + abs(np.sin(theta)))
+    field_w = width*pixel_size_m*(1 - 2*margin)*fit
+    field_h = height*pixel_size_m*(1 - 2*margin)*fit
+
+    cols = max(1, int((field_w + plot_gap_m[0])//pitch[0]))
+    rows = max(1, int((field_h + plot_gap_m[1])//pitch[1]))
+
+    return {"rows": rows, "cols": cols, "pitch": pitch, "plot_size": tuple(plot_size_m), "angle": angle}
+
+def render_strip(x, y, grid, rng):
+    """
+    RGB pixels of the points (x, y), in meters from the raster center (y up).
+    """
+    theta = np.radians(grid["angle"])
+    u = x*np.cos(theta) + y*np.sin(theta)
+    v = -x*np.sin(theta) + y*np.cos(theta)
+
+    # Lattice coordinates with the origin at the corner of the first plot
+    u = u + grid["cols"]*grid["pitch"][0]/2
+    v = v + grid["rows"]*grid["pitch"][1]/2
+    col = np.floor(u/grid["pitch"][0])
+    row = np.floor(v/grid["pitch"][1])
+    inside = ((col >= 0) & (col < grid["cols"]) & (row >= 0) & (row < grid["rows"])
+              & (u - col*grid["pitch"][0] < grid["plot_size"][0])
+              & (v - row*grid["pitch"][1] < grid["plot_size"][1]))
+
+    noise = rng.normal(0, 12, x.shape)
+    soil = np.stack([150 + noise, 120 + noise, 90 + noise])
+    vegetation = np.stack([60 + noise, 140 + 1.5*noise, 50 + noise])
+
+    pixels = np.where(inside[None], vegetation, soil)
+    return np.clip(pixels, 0, 255).astype(np.uint8)
+
+def create_orthomosaic(filepath, width, height=None, crs="EPSG:32618", pixel_size_m=0.02, plot_size_m=(1.2, 1.8)
+                       , plot_gap_m=(0.5, 0.75), angle=0.0, center=DEFAULT_CENTER, strip_rows=512, seed=0, plots_filepath=None):
+    """
+    Write a synthetic orthomosaic GeoTIFF and optionally its plots as a shapefile (with score and class
+    columns, usable as detections by the postprocessing and plot_numbering tasks).
+
+    Parameters:
+        filepath (str): GeoTIFF to create.
+        width, height (int): Raster size in pixels (height defaults to width).
+        crs (str): CRS of the raster, projected in meters or geographic.
+        pixel_size_m (float): Ground sampling distance in meters.
+        plot_size_m, plot_gap_m (tuple): Plot size and gap between plots (x, y) in meters.
+        angle (float): Rotation of the lattice in degrees.
+        center (tuple): Field center (lon, lat).
+
+    Returns:
+        dict: Raster and lattice description.
+    """
+    height = height or width
+    rng = np.random.default_rng(seed)
+
+    units = crs_units_per_meter(crs, center)
+    cx, cy = Transformer.from_crs("EPSG:4326", crs, always_xy=True).transform(*center)
+    pixel_size = pixel_size_m*units
+    transform = from_origin(cx - width*pixel_size/2, cy + height*pixel_size/2, pixel_size, pixel_size)
+
+    grid = lattice(width, height, pixel_size_m, plot_size_m, plot_gap_m, angle)
+
+    start = time.perf_counter()
+    profile = {"driver": "GTiff", "width": width, "height": height, "count": 3, "dtype": "uint8", "crs": crs
+               , "transform": transform, "tiled": True, "blockxsize": 512, "blockysize": 512, "BIGTIFF": "IF_SAFER"}
+    os.makedirs(os.path.dirname(os.path.abspath(filepath)), exist_ok=True)
+    with rio.open(filepath, "w", **profile) as dst:
+        x = (np.arange(width) + 0.5 - width/2)*pixel_size_m
+        for row_start in range(0, height, strip_rows):
+            rows = min(strip_rows, height - row_start)
+            y = (height/2 - (row_start + np.arange(rows) + 0.5))*pixel_size_m
+            xx, yy = np.meshgrid(x, y)
+            dst.write(render_strip(xx, yy, grid, rng), window=rio.windows.Window(0, row_start, width, rows))
+    seconds = time.perf_counter() - start
+
+    info = {"filepath": filepath, "width": width, "height": height, "crs": crs, "pixel_size_m": pixel_size_m
+            , "plots": grid["rows"]*grid["cols"], "lattice": grid, "megabytes": os.path.getsize(filepath)/1e6
+            , "seconds": seconds}
+
+    if plots_filepath:
+        plots = lattice_polygons(grid, cx, cy, units, crs)
+        plots.to_file(plots_filepath)
+        info["plots_filepath"] = plots_filepath
+
+    return info
+
+def lattice_polygons(grid, cx, cy, units, crs):
+    """
+    Plots of the lattice as polygons in the CRS, with the score and class columns of the detections.
+    """
+    theta = np.radians(grid["angle"])
+    rotation = np.array([[np.cos(theta), -np.sin(theta)], [np.sin(theta), np.cos(theta)]])
+    w, h = grid["plot_size"]
+
+    polygons = []
+    for row in range(grid["rows"]):
+        for col in range(grid["cols"]):
+            u0 = col*grid["pitch"][0] - grid["cols"]*grid["pitch"][0]/2
+            v0 = row*grid["pitch"][1] - grid["rows"]*grid["pitch"][1]/2
+            corners = np.array([[u0, v0], [u0 + w, v0], [u0 + w, v0 + h], [u0, v0 + h]]) @ rotation.T
+            polygons.append(Polygon(corners*units + [cx, cy]))
+
+    rng = np.random.default_rng(0)
+    return gpd.GeoDataFrame({"score": rng.uniform(0.5, 0.95, len(polygons)).round(3), "class": 0}
+                            , geometry=polygons, crs=crs)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Create a synthetic orthomosaic GeoTIFF with a plot lattice.")
+    parser.add_argument("--output", type=str, required=True)
+    parser.add_argument("--size", type=int, default=4096, help="Width in pixels (1k to 40k).")
+    parser.add_argument("--height", type=int, help="Height in pixels, default --size.")
+    parser.add_argument("--crs", type=str, default="EPSG:32618")
+    parser.add_argument("--pixel-size", type=float, default=0.02, help="Ground sampling distance in meters.")
+    parser.add_argument("--plot-size", type=str, default="1.2,1.8", help="Plot width,height in meters.")
+    parser.add_argument("--plot-gap", type=str, default="0.5,0.75", help="Gap between plots x,y in meters.")
+    parser.add_argument("--angle", type=float, default=0.0, help="Rotation of the lattice in degrees.")
+    parser.add_argument("--plots", type=str, help="Optional shapefile with the plots of the lattice.")
+    args = parser.parse_args()
+
+    info = create_orthomosaic(args.output, args.size, args.height, crs=args.crs, pixel_size_m=args.pixel_size
+                              , plot_size_m=tuple(float(v) for v in args.plot_size.split(","))
+                              , plot_gap_m=tuple(float(v) for v in args.plot_gap.split(","))
+                              , angle=args.angle, plots_filepath=args.plots)
+
+    print(json.dumps(info, indent=4, default=str))
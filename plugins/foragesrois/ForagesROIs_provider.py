@@ -37,6 +37,7 @@ from .ForagesROIs_algorithm import ForagesROIsAlgorithm
 from .plot_enumeration_algorithm import PlotEnumerationAlgorithm
 from .detection_algorithm import ROIsDetectionAlgorithm
 from .nms_algorithm import PostprocessingAlgorithm
+from .daemon_client import stop_daemon
 
 
 class ForagesROIsProvider(QgsProcessingProvider):
@@ -52,7 +53,8 @@ class ForagesROIsProvider(QgsProcessingProvider):
         Unloads the provider. Any tear-down steps required by the provider
         should be implemented here.
         """
-        pass
+        # Stop the ForagesROIs.exe daemon shared by the algorithms
+        stop_daemon()
 
     def loadAlgorithms(self):
         """
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ ForagesROIs
+                                 A QGIS plugin
+ Detection, classification and grid generation for forages
+ Generated by Plugin Builder: http://g-sherman.github.io/Qgis-Plugin-Builder/
+                              -------------------
+        begin                : 2025-05-14
+        copyright            : (C) 2025 by Andres Felipe Ruiz-Hurtado, Tropical Forages Program CIAT
+        email                : a.f.ruiz@cgiar.org
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+__author__ = 'Andres Felipe Ruiz-Hurtado, Tropical Forages Program CIAT'
+__date__ = '2025-05-14'
+__copyright__ = '(C) 2025 by Andres Felipe Ruiz-Hurtado, Tropical Forages Program CIAT'
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = '$Format:%H$'
+
+import os
+import json
+import time
+import queue
+import atexit
+import threading
+import subprocess
+from collections import deque
+
+# Client of the ForagesROIs.exe --serve-stdio daemon. One daemon is started on the first algorithm
+# run and reused by the next ones, so the interpreter start up, the library imports and the model
+# load are paid once per QGIS session. A daemon that stopped (crash, killed) is started again by the
+# next run.
+
+# Seconds between checks of cancellation and daemon state while waiting for messages
+POLL_SECONDS = 0.2
+
+# Seconds to wait for the ready message of a new daemon
+STARTUP_TIMEOUT = 300
+
+# stderr lines kept to report why a daemon stopped
+STDERR_TAIL_LINES = 50
+
+class DaemonError(Exception):
+    pass
+
+def app_folder():
+    plugin_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(plugin_dir, 'ForagesROIs')
+
+class ForagesROIsDaemon():
+    """
+    A ForagesROIs.exe --serve-stdio process and the threads reading its stdout and stderr.
+    """
+
+    def __init__(self, cwd_path=None):
+        self.cwd_path = cwd_path or app_folder()
+        self.process = None
+        self.messages = None
+        self.errors = None
+        self.stderr_tail = deque(maxlen=STDERR_TAIL_LINES)
+        self.request_count = 0
+        self.lock = threading.Lock()
+
+    def is_running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self, feedback=None):
+
+        # Prepare environment with cwd_path added to PATH
+        env = os.environ.copy()
+        env["PATH"] = self.cwd_path
+
+        # Add cwd_path to the Python process PATH if not already present
+        if self.cwd_path not in os.environ["PATH"]:
+            os.environ["PATH"] = self.cwd_path
+
+        cmd = ['ForagesROIs.exe', '--serve-stdio']
+        if feedback:
+            feedback.pushInfo(f"Starting ForagesROIs daemon in {self.cwd_path}: {' '.join(cmd)}")
+
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+                                        , cwd=self.cwd_path, env=env, encoding='utf-8', errors='replace', bufsize=1
+                                        , creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0))
+
+        self.messages = queue.Queue()
+        self.errors = queue.Queue()
+        self.stderr_tail.clear()
+
+        threading.Thread(target=self.read_stdout, args=(self.process, self.messages), daemon=True).start()
+        threading.Thread(target=self.read_stderr, args=(self.process, self.errors), daemon=True).start()
+
+        start = time.time()
+        while True:
+            message = self.next_message(feedback)
+            if message is not None and message.get("event") == "ready":
+                break
+            if time.time() - start > STARTUP_TIMEOUT:
+                self.stop()
+                raise DaemonError(f"ForagesROIs daemon did not start in {STARTUP_TIMEOUT} s.")
+
+    def read_stdout(self, process, messages):
+        for line in process.stdout:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                messages.put(json.loads(line))
+            except json.JSONDecodeError:
+                messages.put({"event": "log", "id": None, "message": line})
+        # End of stdout, the process stopped
+        messages.put(None)
+
+    def read_stderr(self, process, errors):
+        for line in process.stderr:
+            line = line.rstrip()
+            self.stderr_tail.append(line)
+            errors.put(line)
+
+    def forward_stderr(self, feedback):
+        while True:
+            try:
+                line = self.errors.get_nowait()
+            except queue.Empty:
+                return
+            if feedback:
+                feedback.pushInfo(line)
+
+    def crashed(self):
+        exit_code = None
+        if self.process is not None:
+            try:
+                exit_code = self.process.wait(timeout=POLL_SECONDS)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+        tail = "\n".join(self.stderr_tail)
+        return DaemonError(f"ForagesROIs daemon stopped unexpectedly (exit code {exit_code}):\n{tail}")
+
+    def next_message(self, feedback=None):
+        """
+        Next message of the daemon, None after POLL_SECONDS without messages.
+        Raises DaemonError if the daemon stopped.
+        """
+
+        try:
+            message = self.messages.get(timeout=POLL_SECONDS)
+        except queue.Empty:
+            self.forward_stderr(feedback)
+            if self.process.poll() is not None and self.messages.empty():
+                raise self.crashed()
+            return None
+
+        if message is None:
+            self.forward_stderr(feedback)
+            raise self.crashed()
+        return message
+
+    def send(self, message):
+        self.process.stdin.write(json.dumps(message) + "\n")
+        self.process.stdin.flush()
+
+    def run_task(self, params, feedback=None, progress_range=(10, 80)):
+        """
+        Run a task in the daemon, starting it if it is not running.
+
+        Parameters:
+            params (dict): Processor params (task, input_file, output_folder, ...).
+            feedback (QgsProcessingFeedback): Receives the logs and progress, and requests cancellation.
+            progress_range (tuple): Algorithm progress at 0% and 100% of the task.
+
+        Returns:
+            dict: Processor results (status, message, ...).
+        """
+
+        with self.lock:
+
+            if not self.is_running():
+                self.start(feedback)
+
+            self.request_count += 1
+            request_id = self.request_count
+
+            try:
+                self.send(dict(params, id=request_id))
+            except OSError:
+                # Daemon stopped while idle, start a new one and send again
+                self.process = None
+                self.start(feedback)
+                self.send(dict(params, id=request_id))
+
+            cancelled = False
+            while True:
+                if feedback and feedback.isCanceled() and not cancelled:
+                    feedback.pushInfo("Cancelling ForagesROIs task...")
+                    self.send({"command": "cancel"})
+                    cancelled = True
+
+                message = self.next_message(feedback)
+                if message is None or message.get("id") not in (request_id, None):
+                    continue
+
+                event = message.get("event")
+                if event == "log":
+                    if feedback:
+                        feedback.pushInfo(message.get("message", ""))
+                elif event == "progress":
+                    percent = message.get("progress", {}).get("percent")
+                    if feedback and percent is not None:
+                        start, end = progress_range
+                        feedback.setProgress(start + (end - start)*percent/100)
+                elif event == "result":
+                    self.forward_stderr(feedback)
+                    return message.get("results", {})
+
+    def stop(self, timeout=5):
+        """
+        Ask the daemon to shut down, killing it after timeout seconds.
+        """
+
+        if self.process is None:
+            return
+        process, self.process = self.process, None
+        try:
+            if process.poll() is None:
+                process.stdin.write(json.dumps({"command": "shutdown"}) + "\n")
+                process.stdin.flush()
+                process.stdin.close()
+                process.wait(timeout=timeout)
+        except (OSError, subprocess.TimeoutExpired):
+            process.kill()
+
+DAEMON = None
+DAEMON_LOCK = threading.Lock()
+
+def get_daemon():
+    global DAEMON
+    with DAEMON_LOCK:
+        if DAEMON is None:
+            DAEMON = ForagesROIsDaemon()
+        return DAEMON
+
+def run_task(params, feedback=None):
+    """
+    Run a task in the shared daemon of the plugin.
+    """
+    return get_daemon().run_task(params, feedback)
+
+@atexit.register
+def stop_daemon():
+    with DAEMON_LOCK:
+        if DAEMON is not None:
+            DAEMON.stop()
@@ -38,7 +38,7 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterFeatureSink)
 
 from qgis.core import QgsProcessingParameterRasterLayer, QgsProcessingParameterFileDestination
-import subprocess
+from .daemon_client import run_task
 import tempfile
 from qgis.core import QgsVectorLayer, QgsProject
 
@@ -100,42 +100,20 @@ class ROIsDetectionAlgorithm(QgsProcessingAlgorithm):
 
         if not os.path.exists(output_path):
 
-            plugin_dir = os.path.dirname(os.path.abspath(__file__))
-            cwd_path = os.path.join(plugin_dir, 'ForagesROIs')
-            exe_path = os.path.join(plugin_dir, 'ForagesROIs', 'ForagesROIs.exe')
-
-            # Prepare environment with cwd_path added to PATH
-            env = os.environ.copy()
-            env["PATH"] = cwd_path# + os.pathsep + env.get("PATH", "")
-            #proj_lib_path = r"C:\Program Files\QGIS 3.34.2\share\proj"  # Adjust if your QGIS is in a different folder
-            #env["PROJ_LIB"] = cwd_path
-
-            # Add cwd_path to the Python process PATH if not already present
-            if cwd_path not in os.environ["PATH"]:
-                os.environ["PATH"] = cwd_path# + os.pathsep + os.environ.get("PATH", "")
-            #os.environ["PROJ_LIB"] = cwd_path
-
-            #cmd = [exe_path, '--cli', '--input', os.path.normpath(raster_path), '--output', os.path.normpath(output_path)]
-            cmd = ['ForagesROIs.exe', '--cli','--task','tiling_detection_only', '--input', os.path.normpath(raster_path), '--output', os.path.normpath(output_path)]
-            feedback.pushInfo(f"Process working directory (cwd): {cwd_path}")
-            feedback.pushInfo(f"Process PATH: {env['PATH']}")
-            #feedback.pushInfo(f"PROJ_LIB: {env['PROJ_LIB']}")
-            feedback.pushInfo(f'Running: {" ".join(cmd)}')
-            feedback.setProgress(10)  # Set progress to 10% before running the subprocess
-            result = subprocess.run(cmd, capture_output=True, text=True, cwd=cwd_path, env=env, encoding='latin1')
-            feedback.setProgress(80)  # Set progress to 80% after subprocess completes
-            
-            feedback.pushInfo(result.stdout)
-            
-            # Always show stderr if present
-            if result.stderr:
-                feedback.reportError(result.stderr)
-                feedback.pushInfo(f"STDERR: {result.stderr}")
-
-            if result.returncode != 0:
-                raise Exception(f'Error running ForagesROIs.exe: {result.stderr}')
-
-            
+            # The task runs in the ForagesROIs.exe daemon shared by the algorithms (started on first use)
+            params = {"task": "tiling_detection_only"
+                      , "input_file": os.path.normpath(raster_path)
+                      , "output_folder": os.path.normpath(output_path)}
+            feedback.pushInfo(f"Running ForagesROIs task: {params}")
+            feedback.setProgress(10)  # Set progress to 10% before running the task
+            results = run_task(params, feedback)
+            feedback.setProgress(80)  # Set progress to 80% after the task completes
+
+            if results.get("status") == "cancelled":
+                feedback.pushInfo("ForagesROIs task cancelled.")
+                return {}
+            if results.get("status") != "completed":
+                raise Exception(f'Error running ForagesROIs task: {results.get("message")}')
 
         feedback.pushInfo("Loading output shapefile into QGIS...")
 